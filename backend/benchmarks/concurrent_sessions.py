@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.agents.execution_agent import ExecutionAgent
+from src.services.kernel_pool import KernelPool
+
+# Runs cells in N sessions at once and measures whether one session's long cell
+# delays the others (head-of-line blocking) or the event loop itself.
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+async def run_session(agent: ExecutionAgent, session_id: str, cells: int, cell_seconds: float) -> list:
+    latencies = []
+    for _ in range(cells):
+        started = time.perf_counter()
+        _, error, _ = await agent._execute_python_code(f"import time; time.sleep({cell_seconds})", session_id)
+        if error:
+            raise RuntimeError(error)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+async def run_level(agent: ExecutionAgent, sessions: int, cells: int, cell_seconds: float) -> dict:
+    session_ids = [f"bench-{sessions}-{i}" for i in range(sessions)]
+    # Acquire kernels up front so kernel start-up is not part of the measurement
+    await asyncio.gather(*(agent.kernel_pool.acquire(session_id) for session_id in session_ids))
+    
+    stop = asyncio.Event()
+    lag_samples = []
+    lag_task = asyncio.create_task(measure_loop_lag(stop, 0.01, lag_samples))
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_session(agent, session_id, cells, cell_seconds) for session_id in session_ids))
+    wall = time.perf_counter() - started
+    
+    stop.set()
+    await lag_task
+    await asyncio.gather(*(agent.release_session(session_id) for session_id in session_ids))
+    
+    latencies = sorted(latency for session in results for latency in session)
+    serial = sessions * cells * cell_seconds
+    return {
+        "sessions": sessions,
+        "cells_per_session": cells,
+        "cell_seconds": cell_seconds,
+        "wall_seconds": round(wall, 3),
+        "serial_seconds": round(serial, 3),
+        "concurrency_speedup": round(serial / wall, 2),
+        "cell_latency_p50": round(statistics.median(latencies), 4),
+        "cell_latency_max": round(latencies[-1], 4),
+        "loop_lag_max_ms": round(max(lag_samples, default=0) * 1000, 2)
+    }
+
+async def main(args):
+    agent = ExecutionAgent()
+    agent.kernel_pool = KernelPool(warm_size=0, max_kernels=max(args.sessions) + 1, idle_ttl=0)
+    agent.kernel_pool.start()
+    try:
+        for sessions in args.sessions:
+            result = await run_level(agent, sessions, args.cells, args.cell_seconds)
+            print(json.dumps(result), flush=True)
+    finally:
+        await agent.kernel_pool.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent session execution benchmark")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--cells", type=int, default=3)
+    parser.add_argument("--cell-seconds", type=float, default=0.5)
+    asyncio.run(main(parser.parse_args()))
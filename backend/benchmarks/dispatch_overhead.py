@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.agents.supervisor_agent import SupervisorAgent
+
+# Compares per-request supervisor overhead of the LangGraph path and the direct dispatcher.
+# Agents are replaced with no-op handlers so only routing cost is measured.
+
+class NoopAgent:
+    def process(self, state):
+        state["result"] = {"status": "ok"}
+        return state
+
+class AsyncNoopAgent:
+    async def process(self, state):
+        state["result"] = {"status": "ok"}
+        return state
+    
+    async def release_session(self, session_id):
+        return True
+
+async def measure(call, iterations: int) -> dict:
+    for _ in range(min(iterations, 100)):
+        await call()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await call()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        "mean_us": round(statistics.fmean(samples) * 1e6, 1),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 1),
+        "p99_us": round(samples[int(len(samples) * 0.99)] * 1e6, 1)
+    }
+
+async def main(args):
+    supervisor = SupervisorAgent()
+    supervisor.ui_agent = NoopAgent()
+    supervisor.storage_agent = NoopAgent()
+    supervisor.file_agent = NoopAgent()
+    supervisor.execution_agent = AsyncNoopAgent()
+    supervisor.routes = supervisor._build_routes()
+    supervisor.graph = supervisor._build_graph()
+    
+    for action in ("update_cell", "run_cell"):
+        graph = await measure(lambda: supervisor.process_request("bench", action, {}, use_graph=True), args.iterations)
+        direct = await measure(lambda: supervisor.dispatch({
+            "messages": [], "session_id": "bench", "action": action, "data": {}, "result": {}
+        }), args.iterations)
+        print(json.dumps({
+            "action": action,
+            "handler": "sync" if action == "update_cell" else "async",
+            "graph": graph,
+            "direct": direct,
+            "speedup": round(graph["mean_us"] / direct["mean_us"], 1)
+        }))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Supervisor dispatch overhead microbenchmark")
+    parser.add_argument("--iterations", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
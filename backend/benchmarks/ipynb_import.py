@@ -0,0 +1,95 @@
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.ipynb import read_cells
+
+# Generates a notebook whose size is dominated by embedded plot outputs and compares the old
+# whole-document json.loads import with the streaming parser: wall time, then peak Python
+# memory (measured in a separate pass, since tracemalloc slows both down).
+
+def write_notebook(path: str, size_mb: int, cells: int):
+    image = base64.b64encode(random.randbytes(size_mb * 1024 * 1024 * 3 // 4 // cells)).decode("ascii")
+    with open(path, "w") as f:
+        f.write('{"nbformat": 4, "nbformat_minor": 5, "metadata": {}, "cells": [')
+        for i in range(cells):
+            if i:
+                f.write(",")
+            f.write(json.dumps({
+                "cell_type": "code" if i % 5 else "markdown",
+                "metadata": {},
+                "source": [f"# cell {i}\n", "import matplotlib.pyplot as plt\n", f"plt.plot(range({i}))"],
+                "execution_count": i,
+                "outputs": [
+                    {"output_type": "stream", "name": "stdout", "text": [f"line {n}\n" for n in range(20)]},
+                    {"output_type": "display_data", "metadata": {}, "data": {"image/png": image, "text/plain": ["<Figure>"]}}
+                ]
+            }))
+        f.write("]}")
+
+def json_loads_cells(path: str):
+    # What FileAgent used to do: bytes, decoded str and the full object tree all at once
+    with open(path, "rb") as f:
+        content = f.read()
+    notebook = json.loads(content.decode("utf-8"))
+    return [{
+        "cell_type": cell.get("cell_type", "code"),
+        "source": "".join(cell.get("source", [])),
+        "order_index": index
+    } for index, cell in enumerate(notebook.get("cells", []))]
+
+def run(name: str, parse, path: str, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cells = parse(path)
+        timings.append(time.perf_counter() - started)
+    
+    tracemalloc.start()
+    parse(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "parser": name,
+        "cells": len(cells),
+        "best_seconds": round(min(timings), 3),
+        "peak_mb": round(peak / 1024 / 1024, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=300, help="Approximate notebook size")
+    parser.add_argument("--cells", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--notebook", default=None, help="Parse an existing .ipynb instead of generating one")
+    args = parser.parse_args()
+    
+    path = args.notebook
+    if path is None:
+        path = tempfile.NamedTemporaryFile(suffix=".ipynb", delete=False).name
+        write_notebook(path, args.size_mb, args.cells)
+    try:
+        print(json.dumps({"notebook": path, "size_mb": round(os.path.getsize(path) / 1024 / 1024, 1)}))
+        before = run("json_loads", json_loads_cells, path, args.repeat)
+        print(json.dumps(before))
+        after = run("streaming", read_cells, path, args.repeat)
+        print(json.dumps(after))
+        assert before["cells"] == after["cells"]
+        print(json.dumps({
+            "speedup": round(before["best_seconds"] / after["best_seconds"], 1) if after["best_seconds"] else None,
+            "memory_reduction": round(before["peak_mb"] / after["peak_mb"], 1) if after["peak_mb"] else None
+        }))
+    finally:
+        if args.notebook is None:
+            os.unlink(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Starts the API in a uvicorn subprocess against its own database (a temporary SQLite file
+# unless --url is given) and upload directory, then drives it over HTTP and WebSocket with N
+# concurrent sessions, each creating and editing cells, running them on real local kernels,
+# loading the notebook, uploading a file and listening for execution events. Latencies are
+# reported per endpoint and action as JSON; pass two result files to --compare to diff runs.
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = True
+    
+    def add(self, operation: str, seconds: float, ok: bool = True):
+        if not self.recording:
+            return
+        self.latencies[operation].append(seconds)
+        if not ok:
+            self.errors[operation] += 1
+
+def percentile(ordered: list, q: float) -> float:
+    # Nearest-rank, so results are actual observations and stable between runs of equal size
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def summarize(recorder: Recorder, wall: float) -> dict:
+    endpoints = {}
+    for operation, samples in sorted(recorder.latencies.items()):
+        ordered = sorted(samples)
+        endpoints[operation] = {
+            "count": len(ordered),
+            "errors": recorder.errors[operation],
+            "throughput_per_s": round(len(ordered) / wall, 2),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2)
+        }
+    total = sum(stats["count"] for name, stats in endpoints.items() if not name.startswith("WS "))
+    return {"wall_seconds": round(wall, 3), "requests": total, "requests_per_s": round(total / wall, 2), "endpoints": endpoints}
+
+async def timed(recorder: Recorder, operation: str, request) -> httpx.Response:
+    started = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError:
+        recorder.add(operation, time.perf_counter() - started, ok=False)
+        return None
+    elapsed = time.perf_counter() - started
+    ok = response.status_code < 400
+    if ok and response.status_code != 304 and response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        ok = not (isinstance(body, dict) and body.get("error"))
+    recorder.add(operation, elapsed, ok)
+    return response
+
+async def action(client: httpx.AsyncClient, recorder: Recorder, session_id: str, name: str, data: dict) -> dict:
+    response = await timed(recorder, f"POST /api/notebook/{{session_id}} {name}", client.post(
+        f"/api/notebook/{session_id}", json={"action": name, "data": data}
+    ))
+    return response.json() if response is not None else {}
+
+async def listen(url: str, recorder: Recorder, state: dict, ready: asyncio.Event):
+    # execution_result frames are timed from the most recent execution request of the session,
+    # which covers the kernel run plus event delivery
+    started = time.perf_counter()
+    async with websockets.connect(url, max_size=None) as ws:
+        recorder.add("WS connect", time.perf_counter() - started)
+        ready.set()
+        async for frame in ws:
+            message = json.loads(frame)
+            kind = message.get("type")
+            if kind == "execution_result" and state.get("sent") is not None:
+                recorder.add("WS execution_result", time.perf_counter() - state["sent"], not message.get("data", {}).get("error"))
+            elif kind == "execution_output":
+                state["outputs"] = state.get("outputs", 0) + 1
+
+async def run_session(client: httpx.AsyncClient, ws_base: str, recorder: Recorder, index: int, args):
+    rng = random.Random(args.seed * 1000003 + index)
+    response = await timed(recorder, "POST /api/session", client.post("/api/session", json={"action": "create_session", "data": {}}))
+    if response is None or response.status_code >= 400:
+        return
+    session_id = response.json()["session_id"]
+    
+    state = {"sent": None}
+    ready = asyncio.Event()
+    listener = asyncio.create_task(listen(f"{ws_base}/ws/{session_id}", recorder, state, ready))
+    await asyncio.wait_for(ready.wait(), 30)
+    
+    cells = []
+    for i in range(args.cells):
+        # Each cell reads the one before it, so run_all works through a chain of dependencies
+        source = f"x{i} = sum(range({args.work})) + {'x' + str(i - 1) if i else 0}"
+        created = await action(client, recorder, session_id, "create_cell", {"source": source, "order_index": i + 1})
+        if "cell_id" in created:
+            cells.append((created["cell_id"], i))
+    upload = rng.randbytes(args.upload_kb * 1024)
+    etag = None
+    
+    for iteration in range(args.iterations):
+        cell_id, i = rng.choice(cells)
+        source = f"x{i} = sum(range({args.work + iteration})) + {'x' + str(i - 1) if i else 0}"
+        await action(client, recorder, session_id, "update_cell", {"cell_id": cell_id, "source": source})
+        state["sent"] = time.perf_counter()
+        # Earlier cells may not have run yet in this kernel, so the cell defines what it reads
+        code = "".join(f"x{n} = 0\n" for n in range(i)) + source
+        await action(client, recorder, session_id, "run_cell", {"cell_id": cell_id, "code": code, "session_id": session_id})
+        
+        response = await timed(recorder, "GET /api/notebook/{session_id}", client.get(f"/api/notebook/{session_id}"))
+        if response is not None:
+            etag = response.headers.get("etag")
+        if etag:
+            await timed(recorder, "GET /api/notebook/{session_id} If-None-Match", client.get(
+                f"/api/notebook/{session_id}", headers={"If-None-Match": etag}
+            ))
+        await timed(recorder, "POST /api/upload/{session_id}", client.post(
+            f"/api/upload/{session_id}", files={"file": (f"data-{iteration}.bin", upload, "application/octet-stream")}
+        ))
+    
+    state["sent"] = time.perf_counter()
+    await action(client, recorder, session_id, "run_all", {"session_id": session_id})
+    await action(client, recorder, session_id, "cleanup_session", {"session_id": session_id})
+    listener.cancel()
+    try:
+        await listener
+    except (asyncio.CancelledError, websockets.ConnectionClosed):
+        pass
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def wait_until_ready(base: str, server: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                if (await client.get("/api/metrics")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="notebook-load-")
+    port = args.port or free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URL": args.url or f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "BLOB_DIR": os.path.join(workdir, "blobs"),
+        "OUTPUT_SPILL_DIR": os.path.join(workdir, "outputs"),
+        "RETENTION_ARCHIVE_DIR": os.path.join(workdir, "archive"),
+        "RETENTION_ENABLED": "false",
+        "PYTHONPATH": BACKEND_DIR
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    base = f"http://127.0.0.1:{port}"
+    recorder = Recorder()
+    try:
+        await wait_until_ready(base, server, args.startup_timeout)
+        limits = httpx.Limits(max_connections=args.sessions * 2, max_keepalive_connections=args.sessions * 2)
+        async with httpx.AsyncClient(base_url=base, timeout=args.timeout, limits=limits) as client:
+            # The first session creates the default user; concurrent first sessions would race to insert it
+            response = await client.post("/api/session", json={"action": "create_session", "data": {}})
+            response.raise_for_status()
+            await client.delete(f"/api/session/{response.json()['session_id']}")
+            if args.warmup:
+                # Starts kernels and fills caches; its samples are discarded
+                recorder.recording = False
+                await asyncio.gather(*(run_session(client, f"ws://127.0.0.1:{port}", recorder, -1 - i, args) for i in range(args.warmup)))
+                recorder.recording = True
+            started = time.perf_counter()
+            await asyncio.gather(*(run_session(client, f"ws://127.0.0.1:{port}", recorder, i, args) for i in range(args.sessions)))
+            wall = time.perf_counter() - started
+    finally:
+        server.terminate()
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "database": "postgresql" if args.url and args.url.startswith("postgresql") else "sqlite",
+            "python": platform.python_version(),
+            "sessions": args.sessions,
+            "cells": args.cells,
+            "iterations": args.iterations,
+            "upload_kb": args.upload_kb,
+            "seed": args.seed
+        },
+        **summarize(recorder, wall)
+    }
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    # Prints one line per operation with the relative change of each statistic; exits non-zero
+    # when any p95 grew by more than the threshold (in percent)
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    regressions = []
+    for operation in sorted(set(base["endpoints"]) | set(new["endpoints"])):
+        before, after = base["endpoints"].get(operation), new["endpoints"].get(operation)
+        row = {"operation": operation}
+        if before is None or after is None:
+            row["only_in"] = "new" if before is None else "base"
+        else:
+            for stat in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "errors"):
+                row[stat] = [before[stat], after[stat]]
+                if before[stat]:
+                    row[f"{stat}_change_pct"] = round((after[stat] - before[stat]) / before[stat] * 100, 1)
+            if threshold is not None and row.get("p95_ms_change_pct", 0) > threshold:
+                regressions.append(operation)
+        print(json.dumps(row))
+    print(json.dumps({
+        "base": base["meta"].get("commit"),
+        "new": new["meta"].get("commit"),
+        "requests_per_s": [base["requests_per_s"], new["requests_per_s"]],
+        "regressions": regressions
+    }))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP and WebSocket load test for the notebook API")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--cells", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--work", type=int, default=10000, help="Range summed by each cell")
+    parser.add_argument("--upload-kb", type=int, default=64)
+    parser.add_argument("--warmup", type=int, default=1, help="Sessions run and discarded before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="Database URL; a temporary SQLite file by default")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output", help="Also write the result to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Diff two result files instead of running")
+    parser.add_argument("--threshold", type=float, help="With --compare, fail when a p95 grew by more than this percent")
+    args = parser.parse_args()
+    
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.schema import CreateIndex, DropIndex
+from src.models.database import Base, Session, Notebook, Cell, Execution
+
+# Seeds a large dataset and times the hot lookups with the secondary indexes dropped and then
+# recreated. Uses its own database (a temporary SQLite file unless --url is given).
+
+def secondary_indexes():
+    return [
+        index for table in Base.metadata.sorted_tables for index in table.indexes
+        if not index.unique and [column.name for column in index.columns] != ["id"]
+    ]
+
+async def seed(engine, notebooks: int, cells: int, executions: int, batch: int = 5000):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    
+    now = datetime.utcnow()
+    session_ids = [str(uuid.uuid4()) for _ in range(notebooks)]
+    async with engine.begin() as conn:
+        await conn.execute(insert(Session), [{"id": session_id} for session_id in session_ids])
+        await conn.execute(insert(Notebook), [{
+            "id": i + 1,
+            "session_id": session_id,
+            "title": f"Notebook {i}",
+            "created_at": now,
+            "updated_at": now - timedelta(seconds=random.randint(0, 10 ** 6)),
+            "is_saved": i % 3 == 0,
+            "revision": cells
+        } for i, session_id in enumerate(session_ids)])
+        
+        rows = []
+        cell_id = 0
+        for notebook_id in range(1, notebooks + 1):
+            for order_index in range(cells):
+                cell_id += 1
+                rows.append({
+                    "id": cell_id,
+                    "notebook_id": notebook_id,
+                    "cell_type": "code",
+                    "source": f"x = {order_index}",
+                    "output": "",
+                    "order_index": order_index,
+                    "revision": order_index + 1
+                })
+                if len(rows) >= batch:
+                    await conn.execute(insert(Cell), rows)
+                    rows = []
+        if rows:
+            await conn.execute(insert(Cell), rows)
+        
+        rows = []
+        for cell_id in range(1, notebooks * cells + 1):
+            for _ in range(executions):
+                rows.append({"cell_id": cell_id, "status": "completed", "started_at": now})
+                if len(rows) >= batch:
+                    await conn.execute(insert(Execution), rows)
+                    rows = []
+        if rows:
+            await conn.execute(insert(Execution), rows)
+    return session_ids
+
+def hot_queries(session_ids, notebooks: int, cells: int):
+    # The lookups the agents run on every request, with random keys
+    return {
+        "notebook_by_session": lambda: select(Notebook.id).filter(Notebook.session_id == random.choice(session_ids)),
+        "cells_by_notebook": lambda: select(Cell).filter(
+            Cell.notebook_id == random.randint(1, notebooks)
+        ).order_by(Cell.order_index),
+        "latest_execution_for_cell": lambda: select(Execution.id).filter(
+            Execution.cell_id == random.randint(1, notebooks * cells)
+        ).order_by(Execution.id.desc()).limit(1),
+        "saved_notebooks_page": lambda: select(Notebook.id, Notebook.title, Notebook.updated_at).filter(
+            Notebook.is_saved == True
+        ).order_by(Notebook.updated_at.desc(), Notebook.id.desc()).limit(50),
+        "changed_cells": lambda: select(Cell).filter(
+            Cell.notebook_id == random.randint(1, notebooks),
+            Cell.revision > cells - 5
+        )
+    }
+
+async def measure(engine, queries, repeat: int, phase: str) -> dict:
+    results = {}
+    async with engine.connect() as conn:
+        for name, build in queries.items():
+            latencies = []
+            for _ in range(repeat):
+                query = build()
+                started = time.perf_counter()
+                (await conn.execute(query)).all()
+                latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            results[name] = {
+                "phase": phase,
+                "query": name,
+                "p50_ms": round(statistics.median(latencies) * 1000, 3),
+                "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+                "mean_ms": round(statistics.mean(latencies) * 1000, 3)
+            }
+            print(json.dumps(results[name]))
+    return results
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None, help="Database URL (defaults to a temporary SQLite file)")
+    parser.add_argument("--notebooks", type=int, default=2000)
+    parser.add_argument("--cells", type=int, default=50)
+    parser.add_argument("--executions", type=int, default=2, help="Executions per cell")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    
+    tmp = None
+    url = args.url
+    if url is None:
+        tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        url = f"sqlite+aiosqlite:///{tmp.name}"
+    engine = create_async_engine(url)
+    try:
+        started = time.perf_counter()
+        session_ids = await seed(engine, args.notebooks, args.cells, args.executions)
+        print(json.dumps({
+            "seeded": {"notebooks": args.notebooks, "cells": args.notebooks * args.cells,
+                       "executions": args.notebooks * args.cells * args.executions},
+            "seconds": round(time.perf_counter() - started, 2)
+        }))
+        queries = hot_queries(session_ids, args.notebooks, args.cells)
+        indexes = secondary_indexes()
+        
+        async with engine.begin() as conn:
+            for index in indexes:
+                await conn.execute(DropIndex(index))
+            await conn.execute(text("ANALYZE"))
+        before = await measure(engine, queries, args.repeat, "without_indexes")
+        
+        async with engine.begin() as conn:
+            for index in indexes:
+                await conn.execute(CreateIndex(index))
+            await conn.execute(text("ANALYZE"))
+        after = await measure(engine, queries, args.repeat, "with_indexes")
+        
+        for name in queries:
+            print(json.dumps({
+                "query": name,
+                "p50_speedup": round(before[name]["p50_ms"] / after[name]["p50_ms"], 1) if after[name]["p50_ms"] else None
+            }))
+    finally:
+        await engine.dispose()
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+if __name__ == "__main__":
+    asyncio.run(main())
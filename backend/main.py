@@ -1,14 +1,45 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, File, UploadFile, Form
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, File, UploadFile, Form, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import json
 import asyncio
+from contextlib import asynccontextmanager
 from src.agents.supervisor_agent import SupervisorAgent
-from src.models.database import get_db
+from src.models.database import engine, init_db
+from src.services.metrics import registry, METRICS_ENABLED
+from src.services.tracing import RequestInstrumentation, instrument_engine, traces, TRACING_ENABLED
+from src.services.notebook_cache import notebook_cache, CachedNotebook
+from src.services.output_stream import OutputStream
+from src.services.retention import RetentionJob, RETENTION_ENABLED
+from src.services.upload_store import upload_store
+from src.services.file_server import resolve_upload, file_response, blob_response
+from src.services.blob_store import blob_store
+from src.services.session_router import session_router
 
-app = FastAPI(title="Notebook Platform API")
+supervisor = SupervisorAgent()
+retention_job = RetentionJob(is_active=supervisor.session_active, release=supervisor.release_session)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    supervisor.execution_agent.kernel_pool.start()
+    kernel_pool = supervisor.execution_agent.kernel_pool
+    await session_router.start(supervisor.serve_forwarded, lambda session_id: kernel_pool.get(session_id) is not None)
+    if RETENTION_ENABLED:
+        retention_job.start()
+    yield
+    await retention_job.shutdown()
+    await session_router.shutdown()
+    await supervisor.execution_agent.kernel_pool.shutdown()
+    await supervisor.execution_agent.sandbox_pool.shutdown()
+    await engine.dispose()
+
+app = FastAPI(title="Notebook Platform API", lifespan=lifespan)
+if METRICS_ENABLED or TRACING_ENABLED:
+    app.add_middleware(RequestInstrumentation)
+    instrument_engine(engine)
 
 
 app.add_middleware(
@@ -19,29 +50,102 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-supervisor = SupervisorAgent()
-
 class NotebookRequest(BaseModel):
     action: str
     data: Dict[str, Any] = {}
 
+class CellPatchRequest(BaseModel):
+    base_revision: int
+    ops: List[Dict[str, Any]] = []
+    cell_type: Optional[str] = None
+
+class NotebookImportRequest(BaseModel):
+    filename: str
+
+class CancelRequest(BaseModel):
+    job_id: Optional[str] = None
+    cell_id: Optional[int] = None
+
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+
+UPLOAD_STATUS_CODES = {"invalid": 400, "not_found": 404, "conflict": 409, "too_large": 413, "checksum_mismatch": 422}
+
+def upload_response(result: Dict[str, Any], status_code: int = 200) -> JSONResponse:
+    return JSONResponse(content=result, status_code=UPLOAD_STATUS_CODES.get(result.get("status"), status_code))
+
 class ConnectionManager:
+    # Sockets are local to the worker that accepted them. Events for a session whose socket
+    # lives on another worker are published through the session router instead.
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        self.streams: Dict[str, OutputStream] = {}
+        self.subscriptions: Dict[str, Any] = {}
     
     async def connect(self, websocket: WebSocket, session_id: str):
         await websocket.accept()
+        previous = self.streams.pop(session_id, None)
+        if previous:
+            await previous.close()
+        stream = OutputStream(websocket)
+        stream.start()
         self.active_connections[session_id] = websocket
+        self.streams[session_id] = stream
+        deliver = lambda event: self._deliver(session_id, event)
+        self.subscriptions[session_id] = deliver
+        await session_router.attach_socket(session_id, deliver)
     
-    def disconnect(self, session_id: str):
+    async def disconnect(self, session_id: str, websocket: WebSocket = None):
+        if websocket is not None and self.active_connections.get(session_id) is not websocket:
+            return
         if session_id in self.active_connections:
             del self.active_connections[session_id]
+        stream = self.streams.pop(session_id, None)
+        if stream:
+            await stream.close()
+        deliver = self.subscriptions.pop(session_id, None)
+        if deliver:
+            await session_router.detach_socket(session_id, deliver)
+    
+    def _deliver(self, session_id: str, event: dict):
+        # Events published by the worker running the session's kernel
+        stream = self.streams.get(session_id)
+        if stream is None:
+            return
+        if event.get("kind") == "output":
+            stream.send_output(event["output"])
+        else:
+            stream.send(event["message"])
     
     async def send_message(self, session_id: str, message: dict):
-        if session_id in self.active_connections:
-            await self.active_connections[session_id].send_text(json.dumps(message))
+        stream = self.streams.get(session_id)
+        if stream:
+            stream.send(message)
+    
+    async def send_result(self, session_id: str, result: dict):
+        # Sent per cell as executions finish, including each cell of a run_all
+        message = {
+            "type": "execution_result",
+            "data": result
+        }
+        if session_id in self.streams:
+            await self.send_message(session_id, message)
+        else:
+            await session_router.publish_event(session_id, {"kind": "message", "message": message})
+    
+    async def send_output(self, session_id: str, cell_id, output: dict):
+        stream = self.streams.get(session_id)
+        if stream:
+            stream.send_output(output)
+        else:
+            await session_router.publish_event(session_id, {"kind": "output", "output": output})
 
 manager = ConnectionManager()
+registry.gauge("websocket_connections", lambda: len(manager.active_connections), description="WebSocket connections open on this worker")
+supervisor.execution_agent.add_output_handler(manager.send_output)
+supervisor.execution_agent.add_result_handler(manager.send_result)
 
 @app.post("/api/session")
 async def create_session(request: NotebookRequest):
@@ -51,34 +155,120 @@ async def create_session(request: NotebookRequest):
 @app.post("/api/notebook/{session_id}")
 async def notebook_action(session_id: str, request: NotebookRequest):
     result = await supervisor.process_request(session_id, request.action, request.data)
-    
-    # Send real-time update via WebSocket
-    if request.action == "run_cell" and "output" in result:
-        await manager.send_message(session_id, {
-            "type": "execution_result",
-            "data": result
-        })
-    
-    return JSONResponse(content=result)
+    return JSONResponse(content=result, status_code=429 if result.get("status") == "queue_full" else 200)
 
 @app.get("/api/notebook/{session_id}")
-async def load_notebook(session_id: str):
-    result = await supervisor.process_request(session_id, "load_notebook", {})
-    return JSONResponse(content=result)
+async def load_notebook(session_id: str, if_none_match: Optional[str] = Header(None)):
+    # Cache hits, including 304 revalidations, never reach the database
+    entry = await notebook_cache.get(session_id)
+    if entry is None:
+        result = await supervisor.process_request(session_id, "load_notebook", {})
+        if "error" in result:
+            return JSONResponse(content=result)
+        entry = CachedNotebook.from_data(result)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if if_none_match and {"*", entry.etag} & {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@app.get("/api/notebook/{session_id}/changes")
+async def get_notebook_changes(session_id: str, since: int = 0):
+    result = await supervisor.process_request(session_id, "get_changes", {"since": since})
+    status_code = 404 if "error" in result else 200
+    return JSONResponse(content=result, status_code=status_code)
+
+@app.patch("/api/notebook/{session_id}/cells/{cell_id}")
+async def patch_cell(session_id: str, cell_id: int, request: CellPatchRequest):
+    data = request.model_dump(exclude_none=True)
+    data["cell_id"] = cell_id
+    result = await supervisor.process_request(session_id, "patch_cell", data)
+    status_code = {"not_found": 404, "conflict": 409, "invalid": 400}.get(result.get("status"), 200)
+    return JSONResponse(content=result, status_code=status_code)
+
+@app.post("/api/notebook/{session_id}/import")
+async def import_notebook(session_id: str, request: NotebookImportRequest):
+    result = await supervisor.process_request(session_id, "import_notebook", {"filename": request.filename})
+    status_code = {"not_found": 404, "invalid": 400}.get(result.get("status"), 200)
+    return JSONResponse(content=result, status_code=status_code)
+
+@app.post("/api/notebook/{session_id}/interrupt")
+async def interrupt_execution(session_id: str):
+    return await supervisor.process_request(session_id, "interrupt_execution", {})
+
+@app.post("/api/notebook/{session_id}/cancel")
+async def cancel_execution(session_id: str, request: CancelRequest = CancelRequest()):
+    return await supervisor.process_request(session_id, "cancel_execution", request.model_dump())
+
+@app.get("/api/notebook/{session_id}/queue")
+async def get_execution_queue(session_id: str):
+    return await supervisor.process_request(session_id, "get_queue", {})
+
+@app.get("/api/executions/{execution_id}/output")
+async def get_execution_output(execution_id: int, offset: int = 0, limit: int = 65536):
+    result = await supervisor.process_request("", "get_output", {
+        "execution_id": execution_id,
+        "offset": offset,
+        "limit": limit
+    })
+    status_code = 404 if "error" in result else 200
+    return JSONResponse(content=result, status_code=status_code)
 
 @app.get("/api/notebooks")
-async def list_notebooks():
-    result = await supervisor.process_request("", "list_notebooks", {})
+async def list_notebooks(cursor: Optional[str] = None, limit: int = 50, q: Optional[str] = None):
+    result = await supervisor.process_request("", "list_notebooks", {"cursor": cursor, "limit": limit, "q": q})
+    status_code = 400 if "error" in result else 200
+    return JSONResponse(content=result, status_code=status_code)
+
+@app.get("/api/cells/{cell_id}/executions")
+async def list_cell_executions(cell_id: int, cursor: Optional[str] = None, limit: int = 50):
+    result = await supervisor.process_request("", "list_executions", {"cell_id": cell_id, "cursor": cursor, "limit": limit})
+    if "error" in result:
+        return JSONResponse(content=result, status_code=404 if result["error"] == "Cell not found" else 400)
     return JSONResponse(content=result)
 
 @app.post("/api/upload/{session_id}")
-async def upload_file(session_id: str, file: UploadFile = File(...)):
-    content = await file.read()
+async def upload_file(session_id: str, request: Request, file: UploadFile = File(...)):
+    # Multipart bodies are spooled to disk by the form parser; the file is then copied into
+    # place in chunks. Large datasets should use the chunked endpoints below.
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > upload_store.max_file_bytes + 65536:
+        return upload_response({"error": "File exceeds the upload size limit", "status": "too_large"})
     result = await supervisor.process_request(session_id, "upload_file", {
         "filename": file.filename,
-        "content": content
+        "stream": file.file,
+        "size": file.size
     })
-    return JSONResponse(content=result)
+    return upload_response(result)
+
+@app.post("/api/upload/{session_id}/chunked")
+async def init_chunked_upload(session_id: str, request: UploadInitRequest):
+    result = await supervisor.process_request(session_id, "init_upload", request.model_dump())
+    return upload_response(result, 201)
+
+@app.put("/api/upload/{session_id}/chunked/{upload_id}")
+async def upload_chunk(session_id: str, upload_id: str, request: Request, offset: int = 0):
+    # The raw request body is streamed straight to the partial file
+    result = await supervisor.process_request(session_id, "upload_chunk", {
+        "upload_id": upload_id,
+        "offset": offset,
+        "body": request.stream()
+    })
+    return upload_response(result)
+
+@app.get("/api/upload/{session_id}/chunked/{upload_id}")
+async def get_chunked_upload(session_id: str, upload_id: str):
+    result = await supervisor.process_request(session_id, "upload_status", {"upload_id": upload_id})
+    return upload_response(result)
+
+@app.post("/api/upload/{session_id}/chunked/{upload_id}/complete")
+async def complete_chunked_upload(session_id: str, upload_id: str):
+    result = await supervisor.process_request(session_id, "complete_upload", {"upload_id": upload_id})
+    return upload_response(result)
+
+@app.delete("/api/upload/{session_id}/chunked/{upload_id}")
+async def abort_chunked_upload(session_id: str, upload_id: str):
+    result = await supervisor.process_request(session_id, "abort_upload", {"upload_id": upload_id})
+    return upload_response(result)
 
 @app.get("/api/files/{session_id}")
 async def list_files(session_id: str):
@@ -90,11 +280,44 @@ async def cleanup_session(session_id: str):
     result = await supervisor.process_request(session_id, "cleanup_session", {})
     return JSONResponse(content=result)
 
-@app.get("/uploads/{session_id}/{filename}")
-async def get_file(session_id: str, filename: str):
-    from fastapi.responses import FileResponse
-    file_path = f"uploads/{session_id}/{filename}"
-    return FileResponse(file_path)
+@app.api_route("/uploads/{session_id}/{filename}", methods=["GET", "HEAD"])
+async def get_file(session_id: str, filename: str, request: Request):
+    path = await asyncio.to_thread(resolve_upload, upload_store.base_dir, session_id, filename)
+    if path is None:
+        return JSONResponse(content={"error": "File not found"}, status_code=404)
+    return await file_response(request, path)
+
+@app.api_route("/api/blobs/{digest}", methods=["GET", "HEAD"])
+async def get_blob(digest: str, request: Request, type: Optional[str] = None):
+    # Rich cell outputs reference their large payloads by hash; `type` is the output's MIME type
+    path = blob_store.path(digest)
+    if path is None or not await asyncio.to_thread(path.is_file):
+        return JSONResponse(content={"error": "Blob not found"}, status_code=404)
+    return await blob_response(request, path, digest, type)
+
+@app.get("/api/admin/sessions/{session_id}/owner")
+async def session_owner(session_id: str):
+    return {"worker": session_router.worker_id, **await session_router.owner(session_id)}
+
+@app.post("/api/admin/retention")
+async def run_retention():
+    return await retention_job.run_once()
+
+@app.get("/api/metrics")
+async def get_metrics():
+    return JSONResponse(content=registry.snapshot())
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not METRICS_ENABLED:
+        return Response(status_code=404)
+    return Response(content=registry.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/traces")
+async def recent_traces(limit: int = 50, min_ms: float = 0):
+    if not TRACING_ENABLED:
+        return JSONResponse(content={"error": "Tracing is disabled"}, status_code=404)
+    return {"traces": traces.recent(min(max(limit, 1), 200), min_ms)}
 
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
@@ -105,10 +328,10 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
             message = json.loads(data)
             
             if message.get("type") == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
-            
+                await manager.send_message(session_id, {"type": "pong"})
+    
     except WebSocketDisconnect:
-        manager.disconnect(session_id)
+        await manager.disconnect(session_id, websocket)
 
 if __name__ == "__main__":
     import uvicorn
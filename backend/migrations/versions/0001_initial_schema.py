@@ -0,0 +1,73 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+    
+    op.create_table(
+        "sessions",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("ended_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_sessions_id", "sessions", ["id"])
+    
+    op.create_table(
+        "notebooks",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("session_id", sa.String(), sa.ForeignKey("sessions.id"), nullable=True),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("is_saved", sa.Boolean(), nullable=True),
+    )
+    op.create_index("ix_notebooks_id", "notebooks", ["id"])
+    
+    op.create_table(
+        "cells",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("notebook_id", sa.Integer(), sa.ForeignKey("notebooks.id"), nullable=True),
+        sa.Column("cell_type", sa.String(), nullable=True),
+        sa.Column("source", sa.Text(), nullable=True),
+        sa.Column("output", sa.Text(), nullable=True),
+        sa.Column("order_index", sa.Integer(), nullable=True),
+    )
+    op.create_index("ix_cells_id", "cells", ["id"])
+    
+    op.create_table(
+        "executions",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("cell_id", sa.Integer(), sa.ForeignKey("cells.id"), nullable=True),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("ended_at", sa.DateTime(), nullable=True),
+        sa.Column("status", sa.String(), nullable=True),
+        sa.Column("logs", sa.Text(), nullable=True),
+    )
+    op.create_index("ix_executions_id", "executions", ["id"])
+
+def downgrade():
+    op.drop_table("executions")
+    op.drop_table("cells")
+    op.drop_table("notebooks")
+    op.drop_table("sessions")
+    op.drop_table("users")
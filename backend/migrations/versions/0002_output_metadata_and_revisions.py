@@ -0,0 +1,51 @@
+"""Execution output metadata, notebook/cell revisions and cell tombstones
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def _columns(table: str) -> set:
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+def upgrade():
+    # Databases stamped at 0001 by init_db() may already have these from create_all
+    existing = _columns("executions")
+    for column in (
+        sa.Column("output_bytes", sa.Integer(), nullable=True),
+        sa.Column("output_truncated", sa.Boolean(), nullable=True),
+        sa.Column("output_path", sa.String(), nullable=True),
+    ):
+        if column.name not in existing:
+            op.add_column("executions", column)
+    
+    for table in ("notebooks", "cells"):
+        if "revision" not in _columns(table):
+            op.add_column(table, sa.Column("revision", sa.Integer(), nullable=False, server_default="0"))
+    
+    if not sa.inspect(op.get_bind()).has_table("cell_tombstones"):
+        op.create_table(
+            "cell_tombstones",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("notebook_id", sa.Integer(), sa.ForeignKey("notebooks.id"), nullable=True),
+            sa.Column("cell_id", sa.Integer(), nullable=False),
+            sa.Column("revision", sa.Integer(), nullable=False),
+            sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        )
+        op.create_index("ix_cell_tombstones_id", "cell_tombstones", ["id"])
+        op.create_index("ix_cell_tombstones_notebook_id", "cell_tombstones", ["notebook_id"])
+
+def downgrade():
+    op.drop_table("cell_tombstones")
+    op.drop_column("cells", "revision")
+    op.drop_column("notebooks", "revision")
+    op.drop_column("executions", "output_path")
+    op.drop_column("executions", "output_truncated")
+    op.drop_column("executions", "output_bytes")
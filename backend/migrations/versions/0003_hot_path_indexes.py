@@ -0,0 +1,39 @@
+"""Composite indexes for the hot lookups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # load_notebook, create_cell, save_notebook: notebook by session
+    ("ix_notebooks_session_id", "notebooks", ["session_id"]),
+    # list_notebooks: saved notebooks newest first, id as the tie-breaker
+    ("ix_notebooks_is_saved_updated_at", "notebooks", ["is_saved", "updated_at", "id"]),
+    # cells of a notebook in display order
+    ("ix_cells_notebook_id_order_index", "cells", ["notebook_id", "order_index"]),
+    # changes feed: cells of a notebook changed after a revision
+    ("ix_cells_notebook_id_revision", "cells", ["notebook_id", "revision"]),
+    # executions of a cell, latest first
+    ("ix_executions_cell_id_id", "executions", ["cell_id", "id"]),
+    ("ix_cell_tombstones_notebook_id_revision", "cell_tombstones", ["notebook_id", "revision"]),
+]
+
+def upgrade():
+    existing = {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("cell_tombstones")}
+    if "ix_cell_tombstones_notebook_id" in existing:
+        op.drop_index("ix_cell_tombstones_notebook_id", table_name="cell_tombstones")
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    op.create_index("ix_cell_tombstones_notebook_id", "cell_tombstones", ["notebook_id"])
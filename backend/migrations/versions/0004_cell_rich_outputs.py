@@ -0,0 +1,20 @@
+"""Rich cell outputs
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if "outputs" not in {column["name"] for column in sa.inspect(op.get_bind()).get_columns("cells")}:
+        op.add_column("cells", sa.Column("outputs", sa.JSON(), nullable=True))
+
+def downgrade():
+    op.drop_column("cells", "outputs")
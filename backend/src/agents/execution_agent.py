@@ -1,143 +1,607 @@
 import subprocess
 import sys
-import io
-from contextlib import redirect_stdout, redirect_stderr
-from typing import Dict, Any
-from src.models.database import get_db, Cell, Execution
+import os
+import asyncio
+from typing import Dict, Any, Optional, List, Set, Callable, Awaitable
+from sqlalchemy import select, update
+from src.models.database import AsyncSessionLocal, Cell, Execution, Notebook, bump_revision, parse_id
 from datetime import datetime
-from jupyter_client import KernelManager
-import queue
+from src.services.kernel_client import KernelRestarted
+from src.services.kernel_pool import KernelPool
+from src.services.output_buffer import OutputBuffer, spill_path_for, read_spilled_output, encoded_size
+from src.services.sandbox import SandboxPool
+from src.services.scheduler import ExecutionScheduler
+from src.services.notebook_cache import notebook_cache
+from src.services.pagination import keyset_page, finish_page, page_size
+from src.services.upload_store import upload_store
+from src.services.blob_store import blob_store
+from src.services.dependency_graph import DependencyGraph, cell_symbols
+from src.services.metrics import registry
+from src.services.tracing import span
 import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_TIMEOUT = float(os.getenv("EXECUTION_TIMEOUT", "300"))
+INTERRUPT_GRACE_PERIOD = float(os.getenv("INTERRUPT_GRACE_PERIOD", "5"))
+
+RUN_ALL_COMMIT_BATCH = int(os.getenv("RUN_ALL_COMMIT_BATCH", "20"))
+EXECUTION_BACKEND = os.getenv("EXECUTION_BACKEND", "kernel")  # kernel or sandbox
+
+KERNEL_MODULES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "services", "kernel_modules")
+
+OutputHandler = Callable[[str, Any, Dict[str, Any]], Awaitable[None]]
+ResultHandler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+RunPlan = Callable[[DependencyGraph, Dict[int, str]], Set[int]]
+
+# Scheduler priority when the request does not set one: single cells are interactive
+DEFAULT_PRIORITIES = {"run_cell": "high", "run_reactive": "normal", "run_all": "low"}
+
+_executions = registry.counter("executions_total", description="Finished executions by backend and status", labels=("backend", "status"))
+_execution_timeouts = registry.counter("execution_timeouts_total", description="Kernel executions interrupted for exceeding their timeout")
+
+def iopub_to_output(msg_type: str, content: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if msg_type == 'stream':
+        return {"output_type": "stream", "name": content['name'], "text": content['text']}
+    if msg_type in ('display_data', 'execute_result', 'update_display_data'):
+        output = {"output_type": msg_type, "data": content['data'], "metadata": content.get('metadata', {})}
+        display_id = (content.get('transient') or {}).get('display_id')
+        if display_id:
+            output["display_id"] = display_id
+        return output
+    if msg_type == 'error':
+        return {
+            "output_type": "error",
+            "ename": content['ename'],
+            "evalue": content['evalue'],
+            "traceback": content['traceback']
+        }
+    return None
+
+def session_setup_code(session_id: str) -> str:
+    # Run in a kernel when it is handed to a session: the upload directory becomes the working
+    # directory and the `uploads` helper module is imported into the user namespace
+    upload_dir = str(upload_store.session_dir(session_id).resolve())
+    return "\n".join([
+        "import os as _os, sys as _sys",
+        f"_sys.path.insert(0, {KERNEL_MODULES_DIR!r}) if {KERNEL_MODULES_DIR!r} not in _sys.path else None",
+        f"_os.makedirs({upload_dir!r}, exist_ok=True)",
+        f"_os.chdir({upload_dir!r})",
+        "import uploads",
+        f"uploads.ROOT = {upload_dir!r}",
+        "del _os, _sys"
+    ])
 
 class ExecutionAgent:
     def __init__(self):
-        self.kernels = {}  # session_id -> KernelManager
-    
-    def _get_kernel(self, session_id: str):
-        if session_id not in self.kernels:
-            km = KernelManager()
-            km.start_kernel()
-            self.kernels[session_id] = km
-        return self.kernels[session_id]
-    def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        self.kernel_pool = KernelPool(session_setup=session_setup_code)
+        self.sandbox_pool = SandboxPool()
+        self.scheduler = ExecutionScheduler(interrupt=self._interrupt_kernel)
+        self.output_handlers: List[OutputHandler] = []
+        self.result_handlers: List[ResultHandler] = []
+        self.reactive_run = registry.counter("reactive_cells_run_total")
+        self.reactive_skipped = registry.counter("reactive_cells_skipped_total")
+    
+    def add_output_handler(self, handler: OutputHandler):
+        self.output_handlers.append(handler)
+    
+    def add_result_handler(self, handler: ResultHandler):
+        self.result_handlers.append(handler)
+    
+    async def _publish_result(self, session_id: str, result: Dict[str, Any]):
+        for handler in self.result_handlers:
+            try:
+                await handler(session_id, result)
+            except Exception:
+                logger.exception("Result handler failed")
+    
+    async def _publish_output(self, session_id: str, cell_id, output: Dict[str, Any]):
+        output["cell_id"] = cell_id
+        for handler in self.output_handlers:
+            try:
+                await handler(session_id, cell_id, output)
+            except Exception:
+                logger.exception("Output handler failed")
+    
+    async def _get_kernel(self, session_id: str):
+        with span("kernel.acquire"):
+            return await self.kernel_pool.acquire(session_id)
+    
+    async def release_session(self, session_id: str) -> bool:
+        await self.scheduler.cancel(session_id)
+        return await self.kernel_pool.release(session_id)
+    
+    async def _interrupt_kernel(self, session_id: str) -> bool:
+        kernel = self.kernel_pool.get(session_id)
+        if kernel is None:
+            return False
+        await kernel.client.interrupt()
+        return True
+    
+    async def _schedule(self, session_id: str, action: str, data: Dict[str, Any], run: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        # Kernel work waits its turn in the scheduler; sandbox runs are bounded by their own pool
+        if not session_id:
+            return await run()
+        priority = self.scheduler.normalize_priority(data.get("priority"), DEFAULT_PRIORITIES[action])
+        return await self.scheduler.submit(session_id, run, priority, action, data.get("cell_id"))
+    
+    async def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
         action = state.get("action")
         data = state.get("data", {})
+        session_id = state.get("session_id")
         
         if action == "run_cell":
-            result = self._run_cell(data)
+            kernel_session = data.get("session_id", "") if (data.get("backend") or EXECUTION_BACKEND) != "sandbox" else ""
+            result = await self._schedule(kernel_session, action, data, lambda: self._run_cell(data))
         elif action == "run_all":
-            result = self._run_all_cells(data)
+            result = await self._schedule(data.get("session_id") or session_id, action, data, lambda: self._run_all_cells(data, session_id))
+        elif action == "run_reactive":
+            result = await self._schedule(data.get("session_id") or session_id, action, data, lambda: self._run_reactive(data, session_id))
+        elif action == "interrupt_execution":
+            result = await self.scheduler.interrupt(data.get("session_id") or session_id)
+        elif action == "cancel_execution":
+            result = await self.scheduler.cancel(data.get("session_id") or session_id, data.get("job_id"), data.get("cell_id"))
+        elif action == "get_queue":
+            result = {**self.scheduler.snapshot(data.get("session_id") or session_id), "scheduler": self.scheduler.stats()}
+        elif action == "get_dependencies":
+            result = await self._get_dependencies(data, session_id)
+        elif action == "get_output":
+            result = await self._get_output(data)
+        elif action == "list_executions":
+            result = await self._list_executions(data)
         else:
             result = {"error": "Unknown execution action"}
         
         state["result"] = result
         return state
     
-    def _run_cell(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        cell_id = data.get("cell_id")
-        code = data.get("code", "")
-        
-        db = next(get_db())
-        try:
+    async def _start_execution(self, cell_id) -> Optional[int]:
+        async with AsyncSessionLocal() as db:
             # Validate cell exists
-            cell = db.query(Cell).filter(Cell.id == cell_id).first()
+            cell_id = parse_id(cell_id)
+            cell = await db.get(Cell, cell_id) if cell_id is not None else None
             if not cell:
-                return {"error": "Cell not found", "status": "error"}
+                return None
             
             # Create execution record
             execution = Execution(
-                cell_id=int(cell_id),
+                cell_id=cell_id,
                 status="running"
             )
             db.add(execution)
-            db.commit()
-            db.refresh(execution)
-            
-            # Execute code with kernel
-            session_id_str = data.get("session_id", "")
-            output, error, status = self._execute_python_code(code, session_id_str)
-            
+            await db.commit()
+            return execution.id
+    
+    async def _finish_execution(self, cell_id, execution_id: int, buffer: OutputBuffer, error: str, status: str):
+        async with AsyncSessionLocal() as db:
             # Update execution record
+            execution = await db.get(Execution, execution_id)
             execution.ended_at = datetime.utcnow()
             execution.status = status
-            execution.logs = output + error
+            execution.output_bytes = buffer.size + encoded_size(error)
+            execution.output_truncated = buffer.truncated
+            execution.output_path = str(buffer.spill_path) if buffer.truncated and buffer.spill_path else None
             
-            # Update cell output
-            cell.output = output + error
+            # Update cell output; this is the only stored copy of the (bounded) text
+            cell, owner = (await db.execute(
+                select(Cell, Notebook.session_id).join(Notebook, Cell.notebook_id == Notebook.id).filter(Cell.id == parse_id(cell_id))
+            )).one()
+            cell.output = buffer.getvalue() + error
+            cell.outputs = list(buffer.displays) or None
+            cell.revision = await bump_revision(db, cell.notebook_id)
             
-            db.commit()
-            
-            return {
-                "execution_id": execution.id,
-                "output": output,
-                "error": error,
-                "status": status
-            }
-        finally:
-            db.close()
+            await db.commit()
+        await notebook_cache.invalidate(owner)
     
-    def _execute_python_code(self, code: str, session_id: str = None) -> tuple:
-        if not session_id:
-            # Fallback to old exec method
-            stdout_capture = io.StringIO()
-            stderr_capture = io.StringIO()
-            try:
-                with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-                    exec(code, {"__builtins__": __builtins__})
-                output = stdout_capture.getvalue()
-                error = stderr_capture.getvalue()
-                status = "completed" if not error else "error"
-                return output, error, status
-            except Exception as e:
-                return "", str(e), "error"
-        
-        # Use Jupyter kernel
-        km = self._get_kernel(session_id)
-        kc = km.client()
-        kc.start_channels()
+    async def _run_cell(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        cell_id = data.get("cell_id")
+        code = data.get("code", "")
+        
+        execution_id = await self._start_execution(cell_id)
+        if execution_id is None:
+            return {"error": "Cell not found", "status": "error"}
         
+        # Execute code with kernel
+        session_id_str = data.get("session_id", "")
+        buffer = OutputBuffer(spill_path=spill_path_for(execution_id))
         try:
-            msg_id = kc.execute(code)
-            output = ""
-            error = ""
+            _, error, status = await self._execute_python_code(
+                code, session_id_str, data.get("timeout"), cell_id, buffer, data.get("backend")
+            )
+        except Exception as e:
+            # A kernel that cannot be acquired or started must not leave the execution "running"
+            logger.exception("Execution %s failed", execution_id)
+            error, status = f"Execution failed: {e}", "error"
+        finally:
+            buffer.close()
+        
+        await self._finish_execution(cell_id, execution_id, buffer, error, status)
+        
+        result = {
+            "cell_id": cell_id,
+            "execution_id": execution_id,
+            "output": buffer.getvalue(),
+            "error": error,
+            "status": status,
+            "output_bytes": buffer.size,
+            "truncated": buffer.truncated,
+            "outputs": list(buffer.displays)
+        }
+        if session_id_str:
+            await self._publish_result(session_id_str, result)
+        return result
+    
+    async def _get_output(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        execution_id = parse_id(data.get("execution_id"))
+        offset = max(int(data.get("offset", 0)), 0)
+        limit = min(max(int(data.get("limit", 65536)), 1), 1048576)
+        
+        async with AsyncSessionLocal() as db:
+            execution = await db.get(Execution, execution_id) if execution_id is not None else None
+            if not execution:
+                return {"error": "Execution not found"}
             
-            while True:
-                try:
-                    msg = kc.get_iopub_msg(timeout=10)
-                    msg_type = msg['header']['msg_type']
-                    content = msg['content']
-                    
-                    if msg_type == 'stream':
-                        output += content['text']
-                    elif msg_type == 'error':
-                        error += '\n'.join(content['traceback'])
-                    elif msg_type == 'execute_result':
-                        output += str(content['data'].get('text/plain', ''))
-                    elif msg_type == 'status' and content['execution_state'] == 'idle':
-                        break
-                except queue.Empty:
-                    break
+            if execution.output_path and os.path.exists(execution.output_path):
+                page = await asyncio.to_thread(read_spilled_output, execution.output_path, offset, limit)
+            else:
+                # Untruncated output lives only on the cell, so it is available for the latest run
+                latest = await db.scalar(select(Execution.id).filter(
+                    Execution.cell_id == execution.cell_id
+                ).order_by(Execution.id.desc()).limit(1))
+                if latest != execution.id:
+                    return {"error": "Output no longer available"}
+                output = await db.scalar(select(Cell.output).filter(Cell.id == execution.cell_id))
+                encoded = (output or "").encode("utf-8")
+                page = {
+                    "offset": offset,
+                    "next_offset": min(offset + limit, len(encoded)),
+                    "data": encoded[offset:offset + limit].decode("utf-8", errors="replace"),
+                    "eof": offset + limit >= len(encoded)
+                }
             
-            status = "error" if error else "completed"
-            return output, error, status
+            page["execution_id"] = execution.id
+            page["total_bytes"] = execution.output_bytes
+            page["truncated"] = execution.output_truncated
+            return page
+    
+    async def _list_executions(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # A cell's execution history, newest first, paged by id
+        cell_id = parse_id(data.get("cell_id"))
+        if cell_id is None:
+            return {"error": "Cell not found"}
+        limit = page_size(data.get("limit", 50))
+        query = select(
+            Execution.id, Execution.status, Execution.started_at, Execution.ended_at,
+            Execution.output_bytes, Execution.output_truncated
+        ).filter(Execution.cell_id == cell_id)
+        try:
+            query = keyset_page(query, [Execution.id], data.get("cursor"), limit)
+        except ValueError as e:
+            return {"error": str(e)}
+        
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(query)).all()
+            if not rows and not data.get("cursor") and await db.get(Cell, cell_id) is None:
+                return {"error": "Cell not found"}
+        rows, next_cursor = finish_page(rows, ["id"], limit)
+        executions = [{
+            "id": row.id,
+            "status": row.status,
+            "started_at": row.started_at.isoformat() if row.started_at else None,
+            "ended_at": row.ended_at.isoformat() if row.ended_at else None,
+            "duration": (row.ended_at - row.started_at).total_seconds() if row.started_at and row.ended_at else None,
+            "output_bytes": row.output_bytes,
+            "truncated": row.output_truncated
+        } for row in rows]
+        return {"cell_id": cell_id, "executions": executions, "next_cursor": next_cursor}
+    
+    async def _execute_python_code(
+        self,
+        code: str,
+        session_id: str = None,
+        timeout: Optional[float] = None,
+        cell_id=None,
+        buffer: Optional[OutputBuffer] = None,
+        backend: Optional[str] = None
+    ) -> tuple:
+        buffer = buffer if buffer is not None else OutputBuffer()
+        backend = backend or EXECUTION_BACKEND
+        if not session_id or backend == "sandbox":
+            # Stateless snippets run in an isolated, resource-limited worker process
+            with span("sandbox.run"):
+                output, error, status = await self.sandbox_pool.run(code, timeout, session_id)
+            _executions.labels(backend="sandbox", status=status).inc()
+            buffer.write(output)
+            return buffer.getvalue(), error, status
+        
+        # Use the session's persistent kernel client
+        kernel = await self._get_kernel(session_id)
+        # A single run may use unsaved code, so the cell no longer matches its fingerprint
+        kernel.client.executed.pop(parse_id(cell_id), None)
+        execution = await kernel.client.execute(code)
+        try:
+            error, status = await self._collect(kernel.client, execution, session_id, cell_id, buffer, timeout)
+            return buffer.getvalue(), error, status
         finally:
-            kc.stop_channels()
+            kernel.client.finish(execution)
+            kernel.touch()
+    
+    async def _collect(self, client, execution, session_id: str, cell_id, buffer: OutputBuffer, timeout: Optional[float] = None) -> tuple:
+        with span("kernel.execute", cell_id=cell_id) as current:
+            error, status = await self._drain(client, execution, session_id, cell_id, buffer, timeout)
+            current.set(status=status, output_bytes=buffer.size)
+        _executions.labels(backend="kernel", status=status).inc()
+        return error, status
     
-    def _run_all_cells(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        notebook_id = data.get("notebook_id")
+    async def _drain(self, client, execution, session_id: str, cell_id, buffer: OutputBuffer, timeout: Optional[float] = None) -> tuple:
+        # Drains one execution until the kernel is idle and has sent its execute_reply
+        timeout = float(timeout) if timeout else EXECUTION_TIMEOUT
+        deadline = time.monotonic() + timeout
+        interrupted = False
+        idle = False
+        reply_status = None
+        error = ""
+        
+        while not (idle and reply_status):
+            try:
+                channel, msg = await execution.get(timeout=max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                if interrupted:
+                    # The kernel ignored the interrupt; restart it so the session is usable again
+                    await client.restart("Kernel restarted after an unresponsive interrupt")
+                    error += "\nKernel did not respond to interrupt and was restarted"
+                    break
+                await client.interrupt()
+                interrupted = True
+                _execution_timeouts.inc()
+                error += f"Execution timed out after {timeout:g}s; kernel interrupted\n"
+                deadline = time.monotonic() + INTERRUPT_GRACE_PERIOD
+                continue
+            except KernelRestarted as e:
+                error += str(e)
+                break
+            
+            msg_type = msg['header']['msg_type']
+            content = msg['content']
+            if channel == "shell":
+                if msg_type == 'execute_reply':
+                    reply_status = content.get('status', 'ok')
+                continue
+            
+            # Results with only a text/plain representation stay part of the text output
+            plain = msg_type == 'execute_result' and set(content['data']) <= {'text/plain'}
+            output = iopub_to_output(msg_type, content) if self.output_handlers or not plain else None
+            if output is not None and not plain and "data" in output:
+                # Large MIME payloads go to the blob store; the socket and the cell carry references
+                output = await asyncio.to_thread(blob_store.externalize, output)
+                buffer.display(dict(output))
+            if output is not None and self.output_handlers:
+                await self._publish_output(session_id, cell_id, output)
+            
+            if msg_type == 'stream':
+                buffer.write(content['text'])
+            elif msg_type == 'error':
+                error += '\n'.join(content['traceback'])
+            elif plain:
+                buffer.write(str(content['data'].get('text/plain', '')))
+            elif msg_type == 'status' and content['execution_state'] == 'idle':
+                idle = True
+        
+        if reply_status == "aborted" and not error:
+            return error, "aborted"
+        status = "error" if error else "completed"
+        return error, status
+    
+    async def _code_cells(self, db, notebook_id, session_id: str) -> Optional[tuple]:
+        # The notebook id, its owning session and its code cells in order
+        notebook_id = parse_id(notebook_id)
+        if notebook_id is None:
+            owner = session_id
+            notebook_id = await db.scalar(select(Notebook.id).filter(Notebook.session_id == session_id))
+        else:
+            owner = await db.scalar(select(Notebook.session_id).filter(Notebook.id == notebook_id))
+        if notebook_id is None:
+            return None
+        cells = (await db.execute(select(Cell.id, Cell.source).filter(
+            Cell.notebook_id == notebook_id,
+            Cell.cell_type == "code"
+        ).order_by(Cell.order_index))).all()
+        return notebook_id, owner, cells
+    
+    async def _start_run_all(self, notebook_id, session_id: str, plan: Optional[RunPlan] = None) -> Optional[tuple]:
+        # Returns the notebook id, its owning session, (cell_id, source, execution_id) per code cell
+        # to run and the dependency graph with every code cell's fingerprint
+        async with AsyncSessionLocal() as db:
+            found = await self._code_cells(db, notebook_id, session_id)
+            if found is None:
+                return None
+            notebook_id, owner, cells = found
+            graph = DependencyGraph([(cell.id, cell_symbols.get(cell.id, cell.source or "")) for cell in cells])
+            fingerprints = graph.fingerprints()
+            if plan is not None:
+                selected = plan(graph, fingerprints)
+                cells = [cell for cell in cells if cell.id in selected]
+            
+            # One round trip creates every execution record up front
+            executions = [Execution(cell_id=cell.id, status="running") for cell in cells]
+            db.add_all(executions)
+            await db.commit()
+            return (
+                notebook_id,
+                owner,
+                [(cell.id, cell.source or "", execution.id) for cell, execution in zip(cells, executions)],
+                graph,
+                fingerprints
+            )
+    
+    async def _record_results(self, results: List[tuple], notebook_id: int, owner: Optional[str]):
+        ended_at = datetime.utcnow()
+        execution_rows = []
+        cell_rows = []
+        for cell_id, execution_id, buffer, error, status in results:
+            execution_rows.append({
+                "id": execution_id,
+                "ended_at": ended_at,
+                "status": status,
+                "output_bytes": buffer.size + encoded_size(error),
+                "output_truncated": buffer.truncated,
+                "output_path": str(buffer.spill_path) if buffer.truncated and buffer.spill_path else None
+            })
+            if status != "aborted":
+                cell_rows.append({"id": cell_id, "output": buffer.getvalue() + error, "outputs": list(buffer.displays) or None})
+        
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Execution), execution_rows)
+            if cell_rows:
+                revision = await bump_revision(db, notebook_id)
+                for row in cell_rows:
+                    row["revision"] = revision
+                await db.execute(update(Cell), cell_rows)
+            await db.commit()
+        if cell_rows:
+            await notebook_cache.invalidate(owner)
+    
+    async def _run_all_cells(self, data: Dict[str, Any], session_id: str = "") -> Dict[str, Any]:
+        session_id = data.get("session_id") or session_id
+        if not session_id:
+            return {"error": "run_all requires a session", "status": "error"}
+        
+        started = await self._start_run_all(data.get("notebook_id"), session_id)
+        if started is None:
+            return {"error": "Notebook not found", "status": "error"}
+        # The kernel is acquired inside _run_cells, so a failure there finishes the new rows
+        return await self._run_cells(None, session_id, started, data)
+    
+    async def _run_reactive(self, data: Dict[str, Any], session_id: str = "") -> Dict[str, Any]:
+        # Runs the cell and whatever depends on it, plus any stale cells it reads from, skipping
+        # cells whose code and inputs are unchanged since they last ran in this kernel. Without a
+        # cell_id every stale cell in the notebook runs.
+        session_id = data.get("session_id") or session_id
+        if not session_id:
+            return {"error": "run_reactive requires a session", "status": "error"}
+        target = parse_id(data.get("cell_id")) if data.get("cell_id") is not None else None
         
-        db = next(get_db())
         try:
-            cells = db.query(Cell).filter(
-                Cell.notebook_id == notebook_id,
-                Cell.cell_type == "code"
-            ).order_by(Cell.order_index).all()
+            kernel = await self._get_kernel(session_id)
+        except Exception as e:
+            # Planning needs the kernel's state, so no execution rows exist yet
+            logger.exception("Kernel unavailable for session %s", session_id)
+            return {"error": f"Execution failed: {e}", "status": "error"}
+        executed = kernel.client.executed
+        planned: Dict[str, Any] = {}
+        
+        def plan(graph: DependencyGraph, fingerprints: Dict[int, str]) -> Set[int]:
+            stale = {cell_id for cell_id in graph.order if executed.get(cell_id) != fingerprints[cell_id]}
+            if target is None:
+                scope = set(graph.order)
+            elif target in graph:
+                scope = graph.ancestors(target) | {target} | graph.descendants(target)
+                stale.add(target)
+            else:
+                planned["missing"] = True
+                return set()
+            planned["skipped"] = [cell_id for cell_id in graph.order if cell_id in scope and cell_id not in stale]
+            return scope & stale
+        
+        started = await self._start_run_all(data.get("notebook_id"), session_id, plan)
+        if started is None:
+            return {"error": "Notebook not found", "status": "error"}
+        if planned.get("missing"):
+            return {"error": "Cell not found", "status": "error"}
+        self.reactive_skipped.inc(len(planned["skipped"]))
+        self.reactive_run.inc(len(started[2]))
+        result = await self._run_cells(kernel, session_id, started, data)
+        result["skipped"] = planned["skipped"]
+        return result
+    
+    async def _get_dependencies(self, data: Dict[str, Any], session_id: str = "") -> Dict[str, Any]:
+        session_id = data.get("session_id") or session_id
+        async with AsyncSessionLocal() as db:
+            found = await self._code_cells(db, data.get("notebook_id"), session_id)
+        if found is None:
+            return {"error": "Notebook not found", "status": "error"}
+        graph = DependencyGraph([(cell.id, cell_symbols.get(cell.id, cell.source or "")) for cell in found[2]])
+        fingerprints = graph.fingerprints()
+        # Staleness is relative to the session's kernel; without one every cell is stale
+        kernel = self.kernel_pool.get(found[1] or "")
+        executed = kernel.client.executed if kernel is not None else {}
+        cells = graph.describe()
+        for cell in cells:
+            cell["stale"] = executed.get(cell["cell_id"]) != fingerprints[cell["cell_id"]]
+        return {"cells": cells}
+    
+    async def _run_cells(self, kernel, session_id: str, started: tuple, data: Dict[str, Any]) -> Dict[str, Any]:
+        # kernel is None when it still has to be acquired. Any failure after the execution rows
+        # were created finishes the rest of them: the cell it hit as "error", later ones "aborted".
+        notebook_id, owner, cells, _, fingerprints = started
+        stop_on_error = bool(data.get("stop_on_error", True))
+        
+        results = []
+        pending = []
+        submitted = []
+        failed = False
+        client = None
+        try:
+            if kernel is None:
+                kernel = await self._get_kernel(session_id)
+            client = kernel.client
+            # Pipeline every cell into the kernel's queue; with stop_on_error the kernel
+            # itself aborts the rest of the queue after the first failure
+            for _, source, _ in cells:
+                submitted.append(await client.execute(source, stop_on_error=stop_on_error))
             
-            results = []
-            for cell in cells:
-                result = self._run_cell({"cell_id": cell.id, "code": cell.source})
+            for (cell_id, _, execution_id), execution in zip(cells, submitted):
+                buffer = OutputBuffer(spill_path=spill_path_for(execution_id))
+                try:
+                    error, status = await self._collect(client, execution, session_id, cell_id, buffer, data.get("timeout"))
+                finally:
+                    buffer.close()
+                    client.finish(execution)
+                    kernel.touch()
+                
+                if status == "completed":
+                    client.executed[cell_id] = fingerprints[cell_id]
+                elif status != "aborted":
+                    client.executed.pop(cell_id, None)
+                failed = failed or status == "error"
+                result = {
+                    "cell_id": cell_id,
+                    "execution_id": execution_id,
+                    "output": buffer.getvalue(),
+                    "error": error,
+                    "status": status,
+                    "output_bytes": buffer.size,
+                    "truncated": buffer.truncated,
+                    "outputs": list(buffer.displays)
+                }
                 results.append(result)
-            
-            return {"results": results, "status": "completed"}
+                await self._publish_result(session_id, result)
+                
+                pending.append((cell_id, execution_id, buffer, error, status))
+                if len(pending) >= RUN_ALL_COMMIT_BATCH:
+                    await self._record_results(pending, notebook_id, owner)
+                    pending = []
+        except Exception as e:
+            logger.exception("Run of %d cells failed for session %s", len(cells), session_id)
+            failed = True
+            error = f"Execution failed: {e}"
+            for index, (cell_id, _, execution_id) in enumerate(cells[len(results):]):
+                if client is not None:
+                    client.executed.pop(cell_id, None)
+                status = "error" if index == 0 else "aborted"
+                result = {
+                    "cell_id": cell_id, "execution_id": execution_id, "output": "", "error": error, "status": status,
+                    "output_bytes": 0, "truncated": False, "outputs": []
+                }
+                results.append(result)
+                await self._publish_result(session_id, result)
+                pending.append((cell_id, execution_id, OutputBuffer(), error, status))
         finally:
-            db.close()
\ No newline at end of file
+            if client is not None:
+                for execution in submitted:
+                    client.finish(execution)
+            if pending:
+                await self._record_results(pending, notebook_id, owner)
+        
+        return {"results": results, "status": "error" if failed else "completed"}
@@ -1,76 +1,98 @@
 import os
+import time
 import shutil
+import asyncio
 from typing import Dict, Any
-from pathlib import Path
+from src.services.upload_store import upload_store, UploadError
+
+FILE_INDEX_TTL = float(os.getenv("FILE_INDEX_TTL", "30"))
 
 class FileAgent:
     def __init__(self):
-        self.base_upload_dir = Path("uploads")
-        self.base_upload_dir.mkdir(exist_ok=True)
+        self.store = upload_store
+        self.base_upload_dir = upload_store.base_dir
+        # Per-session directory listings: session_id -> (directory mtime, built at, files)
+        self._index: Dict[str, tuple] = {}
     
-    def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
         action = state.get("action")
         data = state.get("data", {})
         session_id = state.get("session_id")
         
-        if action == "upload_file":
-            result = self._upload_file(data, session_id)
-        elif action == "list_files":
-            result = self._list_files(session_id)
-        elif action == "cleanup_session":
-            result = self._cleanup_session(session_id)
-        else:
-            result = {"error": "Unknown file action"}
+        try:
+            if action == "upload_file":
+                result = await asyncio.to_thread(self._upload_file, data, session_id)
+            elif action == "init_upload":
+                result = await asyncio.to_thread(
+                    self.store.init_upload, session_id, data.get("filename"), data.get("size"), data.get("sha256")
+                )
+            elif action == "upload_chunk":
+                if data.get("body") is None:
+                    raise UploadError("Chunk body is required", "invalid")
+                result = await self.store.write_chunk(session_id, data.get("upload_id"), data.get("offset"), data.get("body"))
+            elif action == "upload_status":
+                result = await asyncio.to_thread(self.store.upload_status, session_id, data.get("upload_id"))
+            elif action == "complete_upload":
+                result = await asyncio.to_thread(self._complete_upload, data, session_id)
+            elif action == "abort_upload":
+                result = await asyncio.to_thread(self.store.abort_upload, session_id, data.get("upload_id"))
+            elif action == "list_files":
+                result = await asyncio.to_thread(self._list_files, session_id)
+            elif action == "cleanup_session":
+                result = await asyncio.to_thread(self._cleanup_session, session_id)
+            else:
+                result = {"error": "Unknown file action"}
+        except UploadError as e:
+            result = e.to_result()
         
         state["result"] = result
         return state
     
     def _upload_file(self, data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
-        session_dir = self.base_upload_dir / session_id
-        session_dir.mkdir(exist_ok=True)
-        
-        filename = data.get("filename")
-        file_content = data.get("content")
-        
-        file_path = session_dir / filename
-        
-        with open(file_path, "wb") as f:
-            f.write(file_content)
-        
-        result = {
-            "status": "uploaded",
-            "filename": filename,
-            "path": str(file_path)
-        }
-        
-        if filename.endswith('.ipynb'):
-            import json
-            notebook_data = json.loads(file_content.decode('utf-8'))
-            cells = []
-            for idx, cell in enumerate(notebook_data.get('cells', [])):
-                cells.append({
-                    "cell_type": cell.get('cell_type', 'code'),
-                    "source": ''.join(cell.get('source', [])),
-                    "order_index": idx
-                })
-            result["notebook_cells"] = cells
-        
+        # data["stream"] is a readable binary file object; the content is copied to disk in
+        # chunks and never held in memory or in the request state
+        if data.get("stream") is None:
+            raise UploadError("File content is required", "invalid")
+        result = self.store.save_stream(session_id, data.get("filename"), data["stream"], data.get("size"))
+        self._index.pop(session_id, None)
+        return self._describe(result)
+    
+    def _complete_upload(self, data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+        result = self.store.complete_upload(session_id, data.get("upload_id"))
+        self._index.pop(session_id, None)
+        return self._describe(result)
+    
+    def _describe(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        # Notebooks are parsed by the import_notebook action, not on upload
+        result["is_notebook"] = result["filename"].endswith('.ipynb')
         return result
     
     def _list_files(self, session_id: str) -> Dict[str, Any]:
-        session_dir = self.base_upload_dir / session_id
-        if not session_dir.exists():
+        # Uploads and cleanup drop the entry; the directory mtime and a short TTL catch changes
+        # made by other processes or by kernels writing into the directory
+        session_dir = self.store.session_dir(session_id)
+        try:
+            mtime = session_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._index.pop(session_id, None)
             return {"files": []}
         
-        files = [{
-            "name": f.name,
-            "size": f.stat().st_size,
-            "is_notebook": f.name.endswith('.ipynb')
-        } for f in session_dir.iterdir() if f.is_file()]
-        return {"files": files}
+        cached = self._index.get(session_id)
+        if cached and cached[0] == mtime and time.monotonic() - cached[1] < FILE_INDEX_TTL:
+            return {"files": list(cached[2])}
+        
+        with os.scandir(session_dir) as entries:
+            files = [{
+                "name": entry.name,
+                "size": entry.stat().st_size,
+                "is_notebook": entry.name.endswith('.ipynb')
+            } for entry in entries if entry.is_file(follow_symlinks=False) and not entry.name.startswith(".")]
+        self._index[session_id] = (mtime, time.monotonic(), files)
+        return {"files": list(files)}
     
     def _cleanup_session(self, session_id: str) -> Dict[str, Any]:
-        session_dir = self.base_upload_dir / session_id
+        self._index.pop(session_id, None)
+        session_dir = self.store.session_dir(session_id)
         if session_dir.exists():
             shutil.rmtree(session_dir)
         return {"status": "cleaned"}
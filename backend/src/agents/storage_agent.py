@@ -1,39 +1,51 @@
-from typing import Dict, Any
-from src.models.database import get_db, Session, Notebook, Cell, User
+from typing import Dict, Any, List
+from sqlalchemy import select, insert, update, delete
+from src.models.database import AsyncSessionLocal, Session, Notebook, Cell, CellTombstone, Execution, User, bump_revision, parse_id
+from src.services.notebook_cache import notebook_cache
+from src.services.pagination import keyset_page, finish_page, page_size
+from src.services.retention import purge_session
+from src.services.ipynb import read_cells
+from src.services.upload_store import upload_store, safe_filename, UploadError
 from datetime import datetime
 import uuid
+import asyncio
 
 class StorageAgent:
-    def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
         action = state.get("action")
         data = state.get("data", {})
         session_id = state.get("session_id")
         
         if action == "create_session":
-            result = self._create_session(data)
+            result = await self._create_session(data)
         elif action == "save_notebook":
-            result = self._save_notebook(data, session_id)
+            result = await self._save_notebook(data, session_id)
         elif action == "load_notebook":
-            result = self._load_notebook(session_id)
+            result = await self._load_notebook(session_id)
+        elif action == "get_changes":
+            result = await self._get_changes(session_id, data)
         elif action == "list_notebooks":
-            result = self._list_notebooks()
+            result = await self._list_notebooks(data)
+        elif action == "import_notebook":
+            result = await self._import_notebook(data, session_id)
+        elif action == "end_session":
+            result = await self._end_session(session_id)
         else:
             result = {"error": "Unknown storage action"}
         
         state["result"] = result
         return state
     
-    def _create_session(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        db = next(get_db())
-        try:
+    async def _create_session(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        async with AsyncSessionLocal() as db:
             session_id = str(uuid.uuid4())
             
             # Create default user if not exists
-            user = db.query(User).filter(User.id == 1).first()
+            user = await db.get(User, 1)
             if not user:
                 user = User(id=1, name="Default User", email="user@example.com")
                 db.add(user)
-                db.commit()
+                await db.commit()
             
             session = Session(
                 id=session_id,
@@ -44,64 +56,158 @@ class StorageAgent:
             # Create default notebook
             notebook = Notebook(
                 session_id=session_id,
-                title=data.get("title", "Untitled Notebook")
+                title=data.get("title", "Untitled Notebook"),
+                revision=1
             )
             db.add(notebook)
+            await db.flush()
             
             # Create default cell
             cell = Cell(
                 notebook_id=notebook.id,
                 cell_type="code",
                 source="# Welcome to your notebook\nprint('Hello, World!')",
-                order_index=0
+                order_index=0,
+                revision=1
             )
             db.add(cell)
             
-            db.commit()
-            db.refresh(session)
-            db.refresh(notebook)
+            await db.commit()
             
             return {
                 "session_id": session_id,
                 "notebook_id": notebook.id,
                 "status": "created"
             }
-        finally:
-            db.close()
     
-    def _save_notebook(self, data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
-        db = next(get_db())
-        try:
-            notebook = db.query(Notebook).filter(Notebook.session_id == session_id).first()
+    async def _save_notebook(self, data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+        async with AsyncSessionLocal() as db:
+            notebook = await db.scalar(select(Notebook).filter(Notebook.session_id == session_id))
             if not notebook:
                 return {"error": "Notebook not found"}
             
             notebook.title = data.get("title", notebook.title)
             notebook.updated_at = datetime.utcnow()
             notebook.is_saved = True
+            revision = await bump_revision(db, notebook.id)
             
-            # Update cells if provided
-            cells_data = data.get("cells", [])
-            for cell_data in cells_data:
-                cell = db.query(Cell).filter(Cell.id == cell_data.get("id")).first()
-                if cell:
-                    cell.source = cell_data.get("source", cell.source)
-                    cell.cell_type = cell_data.get("cell_type", cell.cell_type)
-                    cell.order_index = cell_data.get("order_index", cell.order_index)
-            
-            db.commit()
-            return {"status": "saved", "notebook_id": notebook.id}
-        finally:
-            db.close()
+            result = {"status": "saved", "notebook_id": notebook.id, "revision": revision}
+            # Without a cells payload only the notebook metadata is saved
+            if "cells" in data:
+                result.update(await self._sync_cells(db, notebook.id, data.get("cells") or [], revision))
+            
+            await db.commit()
+            await notebook_cache.invalidate(session_id)
+            return result
     
-    def _load_notebook(self, session_id: str) -> Dict[str, Any]:
-        db = next(get_db())
+    async def _import_notebook(self, data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+        # Replaces the notebook's cells with those of an uploaded .ipynb in one transaction
+        try:
+            path = upload_store.session_dir(session_id) / safe_filename(data.get("filename"))
+        except UploadError as e:
+            return e.to_result()
+        if not path.is_file():
+            return {"error": "File not found", "status": "not_found"}
         try:
-            notebook = db.query(Notebook).filter(Notebook.session_id == session_id).first()
+            cells_data = await asyncio.to_thread(read_cells, path)
+        except ValueError as e:
+            return {"error": str(e), "status": "invalid"}
+        
+        async with AsyncSessionLocal() as db:
+            notebook = await db.scalar(select(Notebook).filter(Notebook.session_id == session_id))
+            if not notebook:
+                return {"error": "Notebook not found", "status": "not_found"}
+            
+            notebook.updated_at = datetime.utcnow()
+            revision = await bump_revision(db, notebook.id)
+            result = {"status": "imported", "notebook_id": notebook.id, "revision": revision}
+            result.update(await self._sync_cells(db, notebook.id, cells_data, revision))
+            await db.commit()
+        await notebook_cache.invalidate(session_id)
+        return result
+    
+    async def _sync_cells(self, db, notebook_id: int, cells_data: List[Dict[str, Any]], revision: int) -> Dict[str, Any]:
+        # The payload is the full cell list: one query loads the stored cells, then only
+        # changed rows are updated, unknown cells are inserted and missing ones deleted
+        existing = {
+            row.id: row for row in (await db.execute(
+                select(Cell.id, Cell.cell_type, Cell.source, Cell.order_index).filter(Cell.notebook_id == notebook_id)
+            )).all()
+        }
+        
+        updates = []
+        inserts = []
+        kept = set()
+        for position, cell_data in enumerate(cells_data):
+            cell_id = parse_id(cell_data.get("id"))
+            stored = existing.get(cell_id)
+            if stored is None or cell_id in kept:
+                inserts.append((position, {
+                    "notebook_id": notebook_id,
+                    "cell_type": cell_data.get("cell_type", "code"),
+                    "source": cell_data.get("source", ""),
+                    "order_index": cell_data.get("order_index", position),
+                    "revision": revision
+                }))
+                continue
+            
+            kept.add(cell_id)
+            row = {
+                "id": cell_id,
+                "cell_type": cell_data.get("cell_type", stored.cell_type),
+                "source": cell_data.get("source", stored.source),
+                "order_index": cell_data.get("order_index", position)
+            }
+            if (row["cell_type"], row["source"], row["order_index"]) != (stored.cell_type, stored.source, stored.order_index):
+                row["revision"] = revision
+                updates.append(row)
+        
+        if updates:
+            await db.execute(update(Cell), updates)
+        
+        created = {}
+        if inserts:
+            new_ids = (await db.scalars(
+                insert(Cell).returning(Cell.id, sort_by_parameter_order=True),
+                [row for _, row in inserts]
+            )).all()
+            for (position, _), new_id in zip(inserts, new_ids):
+                created[position] = new_id
+        
+        removed = [cell_id for cell_id in existing if cell_id not in kept]
+        if removed:
+            # Execution history is detached, matching what deleting a single cell does
+            await db.execute(update(Execution).where(Execution.cell_id.in_(removed)).values(cell_id=None))
+            await db.execute(delete(Cell).where(Cell.id.in_(removed)))
+            await db.execute(insert(CellTombstone), [
+                {"notebook_id": notebook_id, "cell_id": cell_id, "revision": revision} for cell_id in removed
+            ])
+        
+        cell_ids = [
+            created[position] if position in created else parse_id(cell_data.get("id"))
+            for position, cell_data in enumerate(cells_data)
+        ]
+        return {
+            "cell_ids": cell_ids,
+            "updated": len(updates),
+            "created": len(created),
+            "deleted": len(removed)
+        }
+    
+    async def _load_notebook(self, session_id: str) -> Dict[str, Any]:
+        cached = await notebook_cache.get(session_id)
+        if cached is not None:
+            return cached.data
+        
+        generation = notebook_cache.generation(session_id)
+        async with AsyncSessionLocal() as db:
+            notebook = await db.scalar(select(Notebook).filter(Notebook.session_id == session_id))
             if not notebook:
                 return {"error": "Notebook not found"}
             
-            cells = db.query(Cell).filter(Cell.notebook_id == notebook.id).order_by(Cell.order_index).all()
+            cells = (await db.scalars(
+                select(Cell).filter(Cell.notebook_id == notebook.id).order_by(Cell.order_index)
+            )).all()
             
             cells_data = []
             for cell in cells:
@@ -110,32 +216,104 @@ class StorageAgent:
                     "cell_type": cell.cell_type,
                     "source": cell.source,
                     "output": cell.output,
-                    "order_index": cell.order_index
+                    "outputs": cell.outputs or [],
+                    "order_index": cell.order_index,
+                    "revision": cell.revision
                 })
             
-            return {
+            result = {
                 "notebook": {
                     "id": notebook.id,
                     "title": notebook.title,
+                    "revision": notebook.revision,
                     "created_at": notebook.created_at.isoformat(),
                     "updated_at": notebook.updated_at.isoformat(),
                     "cells": cells_data
                 }
             }
-        finally:
-            db.close()
+        await notebook_cache.put(session_id, result, generation)
+        return result
     
-    def _list_notebooks(self) -> Dict[str, Any]:
-        db = next(get_db())
+    async def _get_changes(self, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Cells (with outputs) changed after `since`, plus the ids of cells deleted since then
+        since = parse_id(data.get("since"))
+        if since is None:
+            return {"error": "since must be a revision number"}
+        
+        async with AsyncSessionLocal() as db:
+            notebook = (await db.execute(
+                select(Notebook.id, Notebook.title, Notebook.revision).filter(Notebook.session_id == session_id)
+            )).first()
+            if not notebook:
+                return {"error": "Notebook not found"}
+            
+            result = {
+                "notebook_id": notebook.id,
+                "title": notebook.title,
+                "since": since,
+                "revision": notebook.revision,
+                "cells": [],
+                "deleted": []
+            }
+            if since >= notebook.revision:
+                return result
+            
+            cells = (await db.execute(
+                select(Cell.id, Cell.cell_type, Cell.source, Cell.output, Cell.outputs, Cell.order_index, Cell.revision).filter(
+                    Cell.notebook_id == notebook.id,
+                    Cell.revision > since
+                ).order_by(Cell.order_index)
+            )).all()
+            deleted = (await db.scalars(
+                select(CellTombstone.cell_id).filter(
+                    CellTombstone.notebook_id == notebook.id,
+                    CellTombstone.revision > since
+                )
+            )).all()
+            
+            result["cells"] = [{**cell._mapping, "outputs": cell.outputs or []} for cell in cells]
+            result["deleted"] = list(deleted)
+            return result
+    
+    async def _list_notebooks(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Saved notebooks newest first, one keyset page at a time
+        limit = page_size(data.get("limit", 50))
+        query = select(
+            Notebook.id, Notebook.session_id, Notebook.title, Notebook.created_at, Notebook.updated_at
+        ).filter(Notebook.is_saved == True)
+        search = (data.get("q") or "").strip()
+        if search:
+            pattern = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.filter(Notebook.title.ilike(f"%{pattern}%", escape="\\"))
         try:
-            notebooks = db.query(Notebook).filter(Notebook.is_saved == True).order_by(Notebook.updated_at.desc()).all()
-            notebooks_data = [{
-                "id": nb.id,
-                "session_id": nb.session_id,
-                "title": nb.title,
-                "created_at": nb.created_at.isoformat(),
-                "updated_at": nb.updated_at.isoformat()
-            } for nb in notebooks]
-            return {"notebooks": notebooks_data}
-        finally:
-            db.close()
\ No newline at end of file
+            query = keyset_page(query, [Notebook.updated_at, Notebook.id], data.get("cursor"), limit)
+        except ValueError as e:
+            return {"error": str(e)}
+        
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(query)).all()
+        rows, next_cursor = finish_page(rows, ["updated_at", "id"], limit)
+        notebooks_data = [{
+            "id": nb.id,
+            "session_id": nb.session_id,
+            "title": nb.title,
+            "created_at": nb.created_at.isoformat(),
+            "updated_at": nb.updated_at.isoformat()
+        } for nb in rows]
+        return {"notebooks": notebooks_data, "next_cursor": next_cursor}
+    
+    async def _end_session(self, session_id: str) -> Dict[str, Any]:
+        # Saved notebooks outlive their session; anything unsaved is released right away
+        async with AsyncSessionLocal() as db:
+            session = await db.get(Session, session_id)
+            if not session:
+                return {"status": "not_found"}
+            saved = await db.scalar(
+                select(Notebook.id).filter(Notebook.session_id == session_id, Notebook.is_saved == True).limit(1)
+            )
+            if saved is not None:
+                session.ended_at = datetime.utcnow()
+                await db.commit()
+                return {"status": "ended"}
+        await purge_session(session_id)
+        return {"status": "purged"}
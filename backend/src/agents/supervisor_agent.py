@@ -1,9 +1,16 @@
+import os
+import time
+import asyncio
+import inspect
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, Literal, List, Dict, Any
+from typing import TypedDict, Literal, List, Dict, Any, Callable, Tuple
 from src.agents.ui_agent import UIAgent
-from src.agents.execution_agent import ExecutionAgent
+from src.agents.execution_agent import ExecutionAgent, EXECUTION_BACKEND
 from src.agents.storage_agent import StorageAgent
 from src.agents.file_agent import FileAgent
+from src.services.session_router import session_router
+from src.services.metrics import registry, METRICS_ENABLED
+from src.services.tracing import span, instrument_agent, TRACING_ENABLED
 
 class AgentState(TypedDict):
     messages: List[Dict[str, Any]]
@@ -12,44 +19,57 @@ class AgentState(TypedDict):
     data: Dict[str, Any]
     result: Dict[str, Any]
 
+# Route single-step actions straight to their agent; the graph remains for multi-step workflows
+DIRECT_DISPATCH = os.getenv("SUPERVISOR_DIRECT_DISPATCH", "true").lower() == "true"
+
 # Singleton execution agent to maintain kernels
 _execution_agent = ExecutionAgent()
 
+_request_seconds = registry.histogram(
+    "request_seconds", (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+    description="Supervisor request latency by action, including queueing and forwarding", labels=("action",)
+)
+_requests = registry.counter("requests_total", description="Supervisor requests by action and outcome", labels=("action", "outcome"))
+
 class SupervisorAgent:
     def __init__(self):
         self.ui_agent = UIAgent()
         self.execution_agent = _execution_agent
         self.storage_agent = StorageAgent()
         self.file_agent = FileAgent()
+        self.router = session_router
+        self.routes = self._build_routes()
         self.graph = self._build_graph()
     
+    def _build_routes(self) -> Dict[str, Tuple[str, Callable]]:
+        # route -> (graph node name, handler); shared by the graph and the direct dispatcher
+        return {
+            "ui": ("ui_agent", instrument_agent("ui", self.ui_agent.process)),
+            "execute": ("execution_agent", instrument_agent("execution", self.execution_agent.process)),
+            "storage": ("storage_agent", instrument_agent("storage", self.storage_agent.process)),
+            "file": ("file_agent", instrument_agent("file", self.file_agent.process)),
+            "cleanup": ("session_cleanup", instrument_agent("cleanup", self.cleanup_node))
+        }
+    
     def _build_graph(self):
         workflow = StateGraph(AgentState)
         
         workflow.add_node("supervisor", self.supervisor_node)
-        workflow.add_node("ui_agent", self.ui_agent.process)
-        workflow.add_node("execution_agent", self.execution_agent.process)
-        workflow.add_node("storage_agent", self.storage_agent.process)
-        workflow.add_node("file_agent", self.file_agent.process)
+        for node, handler in self.routes.values():
+            workflow.add_node(node, handler)
         
         workflow.set_entry_point("supervisor")
         
+        edges = {route: node for route, (node, _) in self.routes.items()}
+        edges["end"] = END
         workflow.add_conditional_edges(
             "supervisor",
             self.route_request,
-            {
-                "ui": "ui_agent",
-                "execute": "execution_agent", 
-                "storage": "storage_agent",
-                "file": "file_agent",
-                "end": END
-            }
+            edges
         )
         
-        workflow.add_edge("ui_agent", END)
-        workflow.add_edge("execution_agent", END)
-        workflow.add_edge("storage_agent", END)
-        workflow.add_edge("file_agent", END)
+        for node, _ in self.routes.values():
+            workflow.add_edge(node, END)
         
         return workflow.compile()
     
@@ -57,21 +77,109 @@ class SupervisorAgent:
         action = state.get("action", "")
         return state
     
-    def route_request(self, state: AgentState) -> Literal["ui", "execute", "storage", "file", "end"]:
+    async def cleanup_node(self, state: AgentState) -> AgentState:
+        # Free the session's kernel before removing its files and database rows
+        result = await self.release_session(state.get("session_id", ""))
+        ended = await self.storage_agent.process({**state, "action": "end_session"})
+        state["result"] = {**result, "session": ended["result"].get("status")}
+        return state
+    
+    async def release_session(self, session_id: str) -> Dict[str, Any]:
+        # Kernel, router claim and uploads; shared by cleanup_session and retention
+        await self.execution_agent.release_session(session_id)
+        await self.router.release(session_id)
+        state = await self.file_agent.process({"session_id": session_id, "action": "cleanup_session", "data": {}})
+        return state["result"]
+    
+    async def session_active(self, session_id: str) -> bool:
+        # A local kernel, or a kernel or socket claim held by any worker
+        if self.execution_agent.kernel_pool.get(session_id) is not None:
+            return True
+        return any((await self.router.owner(session_id)).values())
+    
+    def route_request(self, state: AgentState) -> Literal["ui", "execute", "storage", "file", "cleanup", "end"]:
         action = state.get("action", "")
         
-        if action in ["create_cell", "delete_cell", "update_cell"]:
+        if action in ["create_cell", "delete_cell", "update_cell", "patch_cell"]:
             return "ui"
-        elif action in ["run_cell", "run_all"]:
+        elif action in [
+            "run_cell", "run_all", "run_reactive", "get_dependencies", "get_output", "list_executions",
+            "interrupt_execution", "cancel_execution", "get_queue"
+        ]:
             return "execute"
-        elif action in ["save_notebook", "load_notebook", "create_session", "list_notebooks"]:
+        elif action in ["save_notebook", "load_notebook", "get_changes", "create_session", "list_notebooks", "import_notebook"]:
             return "storage"
-        elif action in ["upload_file", "list_files", "cleanup_session"]:
+        elif action in ["upload_file", "init_upload", "upload_chunk", "upload_status", "complete_upload", "abort_upload", "list_files"]:
             return "file"
+        elif action == "cleanup_session":
+            return "cleanup"
         else:
             return "end"
     
-    async def process_request(self, session_id: str, action: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    async def dispatch(self, state: AgentState) -> Dict[str, Any]:
+        # Single-step fast path: same routing and response shape as the graph, without its bookkeeping
+        route = self.route_request(state)
+        if route not in self.routes:
+            return state.get("result", {})
+        _, handler = self.routes[route]
+        if inspect.iscoroutinefunction(handler):
+            state = await handler(state)
+        else:
+            # Sync agents do blocking file I/O, so keep them off the event loop like the graph does
+            state = await asyncio.to_thread(handler, state)
+        return state.get("result", {})
+    
+    def kernel_session(self, session_id: str, action: str, data: Dict[str, Any]) -> str:
+        # Session whose kernel the action runs on, or "" when any worker can serve it
+        if action == "run_cell":
+            if (data.get("backend") or EXECUTION_BACKEND) == "sandbox":
+                return ""
+            return data.get("session_id", "")
+        if action in ("run_all", "run_reactive", "get_dependencies", "interrupt_execution", "cancel_execution", "get_queue"):
+            return data.get("session_id") or session_id
+        if action == "cleanup_session":
+            return session_id
+        return ""
+    
+    async def serve_forwarded(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.process_request(
+            request["session_id"], request["action"], request["data"], request.get("use_graph", False), forwarded=True
+        )
+    
+    async def process_request(
+        self,
+        session_id: str,
+        action: str,
+        data: Dict[str, Any],
+        use_graph: bool = False,
+        forwarded: bool = False
+    ) -> Dict[str, Any]:
+        if not METRICS_ENABLED and not TRACING_ENABLED:
+            return await self._process(session_id, action, data, use_graph, forwarded)
+        
+        # Unknown actions share one label so clients cannot grow the metric set
+        label = action if self.route_request({"action": action}) != "end" else "unknown"
+        started = time.perf_counter()
+        outcome = "exception"
+        try:
+            with span("supervisor", action=label, forwarded=forwarded):
+                result = await self._process(session_id, action, data, use_graph, forwarded)
+            outcome = "error" if isinstance(result, dict) and result.get("error") else "ok"
+            return result
+        finally:
+            _request_seconds.labels(action=label).observe(time.perf_counter() - started)
+            _requests.labels(action=label, outcome=outcome).inc()
+    
+    async def _process(self, session_id: str, action: str, data: Dict[str, Any], use_graph: bool, forwarded: bool) -> Dict[str, Any]:
+        # Kernel-bound actions run on the worker that owns the session's kernel
+        kernel_session = "" if forwarded else self.kernel_session(session_id, action, data)
+        if kernel_session:
+            owner = await self.router.route(kernel_session)
+            if owner is not None:
+                request = {"session_id": session_id, "action": action, "data": data, "use_graph": use_graph}
+                with span("router.forward", owner=owner):
+                    return await self.router.forward(owner, request, kernel_session)
+        
         initial_state = AgentState(
             messages=[],
             session_id=session_id,
@@ -80,5 +188,9 @@ class SupervisorAgent:
             result={}
         )
         
-        result = await self.graph.ainvoke(initial_state)
-        return result.get("result", {})
\ No newline at end of file
+        if DIRECT_DISPATCH and not use_graph:
+            return await self.dispatch(initial_state)
+        
+        with span("langgraph"):
+            result = await self.graph.ainvoke(initial_state)
+        return result.get("result", {})
@@ -1,67 +1,131 @@
-from typing import Dict, Any
-from src.models.database import get_db, Cell, Notebook
-from sqlalchemy.orm import Session
+from typing import Dict, Any, List
+from sqlalchemy import select
+from src.models.database import AsyncSessionLocal, Cell, CellTombstone, Notebook, bump_revision, parse_id
+from src.services.notebook_cache import notebook_cache
+from src.services.dependency_graph import cell_symbols
+
+def apply_source_ops(source: str, ops: List[Dict[str, Any]]) -> str:
+    # Ops apply in order, each against the result of the previous one. Offsets are UTF-16
+    # code units so they line up with JavaScript string indices in the editor.
+    text = source.encode("utf-16-le")
+    for op in ops:
+        if not isinstance(op, dict):
+            raise ValueError("Patch ops must be objects with start, end and text")
+        start, end = op.get("start"), op.get("end", op.get("start"))
+        if not isinstance(start, int) or not isinstance(end, int) or not 0 <= start <= end <= len(text) // 2:
+            raise ValueError(f"Invalid patch range {start}..{end}")
+        text = text[:start * 2] + str(op.get("text", "")).encode("utf-16-le") + text[end * 2:]
+    return text.decode("utf-16-le", errors="replace")
 
 class UIAgent:
-    def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def process(self, state: Dict[str, Any]) -> Dict[str, Any]:
         action = state.get("action")
         data = state.get("data", {})
         session_id = state.get("session_id")
         
         if action == "create_cell":
-            result = self._create_cell(data, session_id)
+            result = await self._create_cell(data, session_id)
         elif action == "delete_cell":
-            result = self._delete_cell(data)
+            result = await self._delete_cell(data)
         elif action == "update_cell":
-            result = self._update_cell(data)
+            result = await self._update_cell(data)
+        elif action == "patch_cell":
+            result = await self._patch_cell(data)
         else:
             result = {"error": "Unknown UI action"}
         
         state["result"] = result
         return state
     
-    def _create_cell(self, data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
-        db = next(get_db())
-        try:
-            notebook = db.query(Notebook).filter(Notebook.session_id == session_id).first()
+    async def _create_cell(self, data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+        async with AsyncSessionLocal() as db:
+            notebook = await db.scalar(select(Notebook).filter(Notebook.session_id == session_id))
             if not notebook:
                 return {"error": "Notebook not found"}
             
+            revision = await bump_revision(db, notebook.id)
             cell = Cell(
                 notebook_id=notebook.id,
                 cell_type=data.get("cell_type", "code"),
                 source=data.get("source", ""),
-                order_index=data.get("order_index", 0)
+                order_index=data.get("order_index", 0),
+                revision=revision
             )
             db.add(cell)
-            db.commit()
-            db.refresh(cell)
+            await db.commit()
+            await notebook_cache.invalidate(session_id)
+            self._analyze(cell)
             
-            return {"cell_id": cell.id, "status": "created"}
-        finally:
-            db.close()
+            return {"cell_id": cell.id, "status": "created", "revision": cell.revision}
+    
+    def _analyze(self, cell: Cell):
+        # Keep the dependency graph's view of the cell current, so reactive runs only parse edits
+        if cell.cell_type == "code":
+            cell_symbols.update(cell.id, cell.source or "")
+        else:
+            cell_symbols.discard(cell.id)
     
-    def _delete_cell(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        db = next(get_db())
-        try:
-            cell = db.query(Cell).filter(Cell.id == data.get("cell_id")).first()
+    async def _get_cell(self, db, cell_id, for_update: bool = False) -> tuple:
+        # Returns the cell with the session that owns it, which keys the notebook cache
+        cell_id = parse_id(cell_id)
+        if cell_id is None:
+            return None, None
+        query = select(Cell, Notebook.session_id).join(Notebook, Cell.notebook_id == Notebook.id).filter(Cell.id == cell_id)
+        if for_update:
+            query = query.with_for_update(of=Cell)
+        row = (await db.execute(query)).first()
+        return (row[0], row[1]) if row else (None, None)
+    
+    async def _delete_cell(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        async with AsyncSessionLocal() as db:
+            cell, owner = await self._get_cell(db, data.get("cell_id"))
             if cell:
-                db.delete(cell)
-                db.commit()
+                revision = await bump_revision(db, cell.notebook_id)
+                db.add(CellTombstone(notebook_id=cell.notebook_id, cell_id=cell.id, revision=revision))
+                await db.delete(cell)
+                await db.commit()
+                await notebook_cache.invalidate(owner)
+                cell_symbols.discard(cell.id)
                 return {"status": "deleted"}
             return {"error": "Cell not found"}
-        finally:
-            db.close()
     
-    def _update_cell(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        db = next(get_db())
-        try:
-            cell = db.query(Cell).filter(Cell.id == data.get("cell_id")).first()
+    async def _update_cell(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        async with AsyncSessionLocal() as db:
+            cell, owner = await self._get_cell(db, data.get("cell_id"))
             if cell:
                 cell.source = data.get("source", cell.source)
                 cell.cell_type = data.get("cell_type", cell.cell_type)
-                db.commit()
-                return {"status": "updated"}
+                cell.revision = await bump_revision(db, cell.notebook_id)
+                await db.commit()
+                await notebook_cache.invalidate(owner)
+                self._analyze(cell)
+                return {"status": "updated", "revision": cell.revision}
             return {"error": "Cell not found"}
-        finally:
-            db.close()
\ No newline at end of file
+    
+    async def _patch_cell(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Applies text edits to the source of a cell last seen at base_revision; a concurrent
+        # change to the cell is a conflict and the client rebases onto the returned state
+        base_revision = data.get("base_revision")
+        if not isinstance(base_revision, int):
+            return {"error": "base_revision is required", "status": "invalid"}
+        
+        async with AsyncSessionLocal() as db:
+            cell, owner = await self._get_cell(db, data.get("cell_id"), for_update=True)
+            if not cell:
+                return {"error": "Cell not found", "status": "not_found"}
+            if cell.revision != base_revision:
+                return {
+                    "error": "Cell changed since base_revision",
+                    "status": "conflict",
+                    "cell": {"id": cell.id, "source": cell.source, "cell_type": cell.cell_type, "revision": cell.revision}
+                }
+            try:
+                cell.source = apply_source_ops(cell.source or "", data.get("ops") or [])
+            except ValueError as e:
+                return {"error": str(e), "status": "invalid"}
+            cell.cell_type = data.get("cell_type", cell.cell_type)
+            cell.revision = await bump_revision(db, cell.notebook_id)
+            await db.commit()
+            await notebook_cache.invalidate(owner)
+            self._analyze(cell)
+            return {"cell_id": cell.id, "status": "patched", "revision": cell.revision}
\ No newline at end of file
@@ -1,10 +1,18 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Boolean
+from sqlalchemy import exc, inspect, update, Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Index, JSON
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from alembic import command
+from alembic.config import Config
 from datetime import datetime
 import os
+import time
+from pathlib import Path
+from typing import AsyncIterator, Optional
 from urllib.parse import quote_plus
 from dotenv import load_dotenv
+from src.services.metrics import registry
 
 load_dotenv()
 
@@ -13,12 +21,68 @@ db_port = os.getenv("DATABASE_PORT", "5432")
 db_name = os.getenv("DATABASE_NAME", "notebook_db")
 db_user = os.getenv("DATABASE_USER", "user")
 db_password = quote_plus(os.getenv("DATABASE_PASSWORD", "password"))
-db_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+db_url = os.getenv("DATABASE_URL") or f"postgresql+asyncpg://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+if db_url.startswith("postgresql://"):
+    db_url = "postgresql+asyncpg://" + db_url[len("postgresql://"):]
 
-engine = create_engine(db_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DATABASE_AUTO_MIGRATE = os.getenv("DATABASE_AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+ALEMBIC_CONFIG = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+_checkout_wait = registry.histogram("db_pool_checkout_wait_seconds")
+_checkout_timeouts = registry.counter("db_pool_checkout_timeouts_total")
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    # Times how long callers wait for a connection, including waits on a saturated pool
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            _checkout_timeouts.inc()
+            raise
+        finally:
+            _checkout_wait.observe(time.perf_counter() - started)
+
+engine = create_async_engine(
+    db_url,
+    poolclass=InstrumentedPool,
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_MAX_OVERFLOW,
+    pool_timeout=DATABASE_POOL_TIMEOUT,
+    pool_recycle=DATABASE_POOL_RECYCLE,
+    pool_pre_ping=DATABASE_POOL_PRE_PING
+)
+AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+def parse_id(value) -> Optional[int]:
+    # asyncpg binds parameters strictly, so ids from request payloads are coerced first
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def pool_stats() -> dict:
+    pool = engine.sync_engine.pool
+    capacity = pool.size() + max(DATABASE_MAX_OVERFLOW, 0)
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": checked_out / capacity if capacity else 0.0
+    }
+
+registry.gauge("db_pool_checked_out", lambda: pool_stats()["checked_out"])
+registry.gauge("db_pool_overflow", lambda: pool_stats()["overflow"])
+registry.gauge("db_pool_saturation", lambda: pool_stats()["saturation"])
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -38,41 +102,87 @@ class Session(Base):
 
 class Notebook(Base):
     __tablename__ = "notebooks"
+    __table_args__ = (
+        Index("ix_notebooks_session_id", "session_id"),
+        Index("ix_notebooks_is_saved_updated_at", "is_saved", "updated_at", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String, ForeignKey("sessions.id"))
     title = Column(String, default="Untitled Notebook")
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_saved = Column(Boolean, default=False)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")  # bumped on every change to the notebook or its cells
     session = relationship("Session", back_populates="notebooks")
     cells = relationship("Cell", back_populates="notebook", order_by="Cell.order_index")
 
 class Cell(Base):
     __tablename__ = "cells"
+    __table_args__ = (
+        Index("ix_cells_notebook_id_order_index", "notebook_id", "order_index"),
+        Index("ix_cells_notebook_id_revision", "notebook_id", "revision"),
+    )
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     notebook_id = Column(Integer, ForeignKey("notebooks.id"))
     cell_type = Column(String, default="code")  # code, markdown
     source = Column(Text, default="")
     output = Column(Text, default="")
+    outputs = Column(JSON(none_as_null=True), nullable=True)  # rich outputs (MIME bundles); large payloads are blob store references
     order_index = Column(Integer, default=0)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")  # notebook revision of the cell's last change
     notebook = relationship("Notebook", back_populates="cells")
     executions = relationship("Execution", back_populates="cell")
 
 class Execution(Base):
     __tablename__ = "executions"
+    __table_args__ = (
+        Index("ix_executions_cell_id_id", "cell_id", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     cell_id = Column(Integer, ForeignKey("cells.id"))
     started_at = Column(DateTime, default=datetime.utcnow)
     ended_at = Column(DateTime, nullable=True)
     status = Column(String, default="running")  # running, completed, error
-    logs = Column(Text, default="")
+    logs = Column(Text, default="")  # legacy; cell output is stored once in Cell.output
+    output_bytes = Column(Integer, default=0)
+    output_truncated = Column(Boolean, default=False)
+    output_path = Column(String, nullable=True)  # gzip spill file holding the full output
     cell = relationship("Cell", back_populates="executions")
 
-def get_db():
-    db = SessionLocal()
-    try:
+class CellTombstone(Base):
+    # Lets the changes feed report deletions
+    __tablename__ = "cell_tombstones"
+    __table_args__ = (
+        Index("ix_cell_tombstones_notebook_id_revision", "notebook_id", "revision"),
+    )
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    notebook_id = Column(Integer, ForeignKey("notebooks.id"))
+    cell_id = Column(Integer, nullable=False)
+    revision = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+async def bump_revision(db: AsyncSession, notebook_id: int) -> int:
+    # Atomic increment; the row lock serializes concurrent writers until they commit
+    return await db.scalar(
+        update(Notebook).where(Notebook.id == notebook_id).values(revision=Notebook.revision + 1).returning(Notebook.revision)
+    )
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+def _upgrade_schema(connection):
+    config = Config(str(ALEMBIC_CONFIG))
+    config.attributes["connection"] = connection
+    config.attributes["configure_logger"] = False
+    tables = inspect(connection).get_table_names()
+    if "alembic_version" not in tables and "notebooks" in tables:
+        # Databases created by create_all before migrations existed start from the baseline
+        command.stamp(config, "0001")
+    command.upgrade(config, "head")
+
+async def init_db():
+    if not DATABASE_AUTO_MIGRATE:
+        return
+    async with engine.begin() as conn:
+        await conn.run_sync(_upgrade_schema)
\ No newline at end of file
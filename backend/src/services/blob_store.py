@@ -0,0 +1,119 @@
+import os
+import re
+import json
+import time
+import uuid
+import base64
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Any, Iterable, Optional
+from src.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = Path(os.getenv("BLOB_DIR", "blobs"))
+BLOB_INLINE_MAX_BYTES = int(os.getenv("BLOB_INLINE_MAX_BYTES", "4096"))
+# Unreferenced blobs younger than this are kept: a running cell writes its blobs before the
+# cell row that references them is committed
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Jupyter sends these base64-encoded; they are stored and served as raw bytes
+BINARY_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp", "application/pdf"}
+
+def encode_payload(mime: str, value: Any) -> bytes:
+    if isinstance(value, list):
+        # nbformat allows multi-line strings as lists of lines
+        value = "".join(value)
+    if isinstance(value, str):
+        if mime in BINARY_TYPES:
+            return base64.b64decode(value)
+        return value.encode("utf-8")
+    return json.dumps(value).encode("utf-8")
+
+class BlobStore:
+    # Content-addressed files under blobs/ab/abcdef...: identical outputs from reruns, other
+    # cells or other sessions share one file. Files are written to a temporary name and renamed
+    # into place, so a blob is either absent or complete and never changes once it exists.
+    def __init__(self, base_dir: Path = BLOB_DIR, inline_max_bytes: int = BLOB_INLINE_MAX_BYTES):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(exist_ok=True)
+        self.inline_max_bytes = inline_max_bytes
+        
+        self._writes = registry.counter("blob_writes_total")
+        self._deduplicated = registry.counter("blob_deduplicated_total")
+        self._bytes = registry.counter("blob_bytes_written_total")
+        self._removed = registry.counter("blob_gc_removed_total")
+    
+    def path(self, digest: str) -> Optional[Path]:
+        if not DIGEST_PATTERN.match(digest or ""):
+            return None
+        return self.base_dir / digest[:2] / digest
+    
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if path.exists():
+            # A fresh mtime keeps a reused blob out of a sweep that has not seen its new reference
+            os.utime(path)
+            self._deduplicated.inc()
+            return digest
+        path.parent.mkdir(exist_ok=True)
+        partial = path.with_name(f".{digest}.{uuid.uuid4().hex}.tmp")
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+        self._writes.inc()
+        self._bytes.inc(len(data))
+        return digest
+    
+    def externalize(self, output: Dict[str, Any]) -> Dict[str, Any]:
+        # Returns a copy of a display_data/execute_result output with every MIME payload larger
+        # than inline_max_bytes moved to the store: data keeps the small ones and blobs maps the
+        # others to {"hash", "size"}
+        data = {}
+        blobs = {}
+        for mime, value in (output.get("data") or {}).items():
+            payload = encode_payload(mime, value)
+            if len(payload) > self.inline_max_bytes:
+                blobs[mime] = {"hash": self.put(payload), "size": len(payload)}
+            else:
+                data[mime] = value
+        externalized = {**output, "data": data}
+        if blobs:
+            externalized["blobs"] = blobs
+        return externalized
+    
+    def sweep(self, referenced: Iterable[str], grace_seconds: float = BLOB_GC_GRACE_SECONDS) -> Dict[str, int]:
+        # Deletes blobs no cell references, and temporary files left by interrupted writes
+        referenced = set(referenced)
+        cutoff = time.time() - grace_seconds
+        stats = {"removed": 0, "removed_bytes": 0, "kept": 0}
+        for shard in self.base_dir.iterdir():
+            if not shard.is_dir():
+                continue
+            for path in shard.iterdir():
+                try:
+                    stat_result = path.stat()
+                    if path.name in referenced or stat_result.st_mtime >= cutoff:
+                        stats["kept"] += 1
+                        continue
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+                except OSError:
+                    logger.warning("Could not remove blob %s", path, exc_info=True)
+                    continue
+                stats["removed"] += 1
+                stats["removed_bytes"] += stat_result.st_size
+        self._removed.inc(stats["removed"])
+        return stats
+
+blob_store = BlobStore()
+
+def output_blobs(outputs: Optional[list]) -> Iterable[str]:
+    # Hashes referenced by a cell's stored outputs
+    for output in outputs or ():
+        for ref in (output.get("blobs") or {}).values():
+            yield ref["hash"]
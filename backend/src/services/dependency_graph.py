@@ -0,0 +1,385 @@
+import os
+import ast
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from src.services.metrics import registry
+
+try:
+    from IPython.core.inputtransformer2 import TransformerManager
+except ImportError:
+    TransformerManager = None
+
+DEPENDENCY_CACHE_SIZE = int(os.getenv("DEPENDENCY_CACHE_SIZE", "10000"))
+
+_COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+class CellSymbols:
+    # Global names a cell binds and reads. A cell that cannot be analysed (a syntax error or
+    # a star import) is opaque: it is treated as reading and binding everything.
+    __slots__ = ("defines", "uses", "opaque", "digest")
+    
+    def __init__(self, defines: Set[str], uses: Set[str], opaque: bool, digest: str):
+        self.defines = frozenset(defines)
+        self.uses = frozenset(uses)
+        self.opaque = opaque
+        self.digest = digest
+
+def _to_python(source: str) -> str:
+    # IPython syntax (%magics, !shell) becomes plain calls so the rest of the cell still parses
+    if TransformerManager is not None and ("%" in source or "!" in source):
+        try:
+            return TransformerManager().transform_cell(source)
+        except Exception:
+            return source
+    return source
+
+def _local_names(body: List[ast.stmt]) -> Set[str]:
+    # Names bound anywhere in a function body, which Python makes local for the whole body
+    names: Set[str] = set()
+    declared: Set[str] = set()
+    stack = list(body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            stack.extend(node.decorator_list)
+            continue
+        if isinstance(node, (ast.Lambda,) + _COMPREHENSIONS):
+            continue
+        if isinstance(node, (ast.Global, ast.Nonlocal)):
+            declared.update(node.names)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+        stack.extend(ast.iter_child_nodes(node))
+    return names - declared
+
+class _SymbolVisitor(ast.NodeVisitor):
+    # Walks the cell in execution order. Top-level reads of names the cell has not bound yet are
+    # inputs; reads inside function bodies happen at call time, so they are inputs unless the
+    # cell binds the name anywhere.
+    def __init__(self):
+        self.defines: Set[str] = set()
+        self.uses: Set[str] = set()
+        self.deferred_uses: Set[str] = set()
+        self.star_import = False
+        self.scopes: List[Tuple[str, Set[str]]] = [("module", set())]
+        self.globals: List[Set[str]] = []
+    
+    @property
+    def deferred(self) -> bool:
+        return any(kind == "function" for kind, _ in self.scopes)
+    
+    def _bind(self, name: str):
+        kind, names = self.scopes[-1]
+        if kind == "module":
+            self.defines.add(name)
+            names.add(name)
+        elif kind == "function" and self.globals and name in self.globals[-1]:
+            self.defines.add(name)
+        else:
+            names.add(name)
+    
+    def _read(self, name: str):
+        for index in range(len(self.scopes) - 1, -1, -1):
+            kind, names = self.scopes[index]
+            # Class bodies are only visible to code directly inside them
+            if kind == "class" and index != len(self.scopes) - 1:
+                continue
+            if name in names:
+                if kind == "function" and self.globals and name in self.globals[-1]:
+                    break
+                return
+        (self.deferred_uses if self.deferred else self.uses).add(name)
+    
+    def visit_Name(self, node: ast.Name):
+        if isinstance(node.ctx, ast.Load):
+            self._read(node.id)
+        else:
+            self._bind(node.id)
+    
+    def _mutate(self, target: ast.AST):
+        # df["a"] = ... or obj.attr = ... changes a global in place: read it and rebind it
+        root = target
+        while isinstance(root, (ast.Attribute, ast.Subscript, ast.Starred)):
+            root = root.value
+        if isinstance(root, ast.Name) and len(self.scopes) == 1:
+            self._read(root.id)
+            self._bind(root.id)
+    
+    def _visit_target(self, target: ast.AST):
+        if isinstance(target, (ast.Attribute, ast.Subscript)):
+            self.visit(target.value)
+            if isinstance(target, ast.Subscript):
+                self.visit(target.slice)
+            self._mutate(target)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for element in target.elts:
+                self._visit_target(element)
+        elif isinstance(target, ast.Starred):
+            self._visit_target(target.value)
+        else:
+            self.visit(target)
+    
+    def visit_Assign(self, node: ast.Assign):
+        self.visit(node.value)
+        for target in node.targets:
+            self._visit_target(target)
+    
+    def visit_AugAssign(self, node: ast.AugAssign):
+        self.visit(node.value)
+        if isinstance(node.target, ast.Name):
+            self._read(node.target.id)
+            self._bind(node.target.id)
+        else:
+            self._visit_target(node.target)
+    
+    def visit_AnnAssign(self, node: ast.AnnAssign):
+        self.visit(node.annotation)
+        if node.value is not None:
+            self.visit(node.value)
+            self._visit_target(node.target)
+    
+    def visit_NamedExpr(self, node: ast.NamedExpr):
+        self.visit(node.value)
+        # Assignment expressions in a comprehension bind in the enclosing scope
+        comprehensions = []
+        while self.scopes[-1][0] == "comprehension":
+            comprehensions.append(self.scopes.pop())
+        self._bind(node.target.id)
+        self.scopes.extend(reversed(comprehensions))
+    
+    def visit_Delete(self, node: ast.Delete):
+        for target in node.targets:
+            self._visit_target(target)
+    
+    def visit_For(self, node):
+        self.visit(node.iter)
+        self._visit_target(node.target)
+        for statement in node.body + node.orelse:
+            self.visit(statement)
+    
+    visit_AsyncFor = visit_For
+    
+    def visit_With(self, node):
+        for item in node.items:
+            self.visit(item.context_expr)
+            if item.optional_vars is not None:
+                self._visit_target(item.optional_vars)
+        for statement in node.body:
+            self.visit(statement)
+    
+    visit_AsyncWith = visit_With
+    
+    def visit_ExceptHandler(self, node: ast.ExceptHandler):
+        if node.type is not None:
+            self.visit(node.type)
+        if node.name:
+            self._bind(node.name)
+        for statement in node.body:
+            self.visit(statement)
+    
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            self._bind(alias.asname or alias.name.split(".")[0])
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        for alias in node.names:
+            if alias.name == "*":
+                self.star_import = True
+            else:
+                self._bind(alias.asname or alias.name)
+    
+    def _visit_function(self, args: ast.arguments, body: List[ast.AST], local_names: Set[str]):
+        for default in args.defaults + [d for d in args.kw_defaults if d is not None]:
+            self.visit(default)
+        params = {arg.arg for arg in args.posonlyargs + args.args + args.kwonlyargs}
+        params.update(arg.arg for arg in (args.vararg, args.kwarg) if arg is not None)
+        declared = {name for statement in body if isinstance(statement, ast.AST)
+                    for child in ast.walk(statement) if isinstance(child, ast.Global) for name in child.names}
+        self.scopes.append(("function", params | local_names))
+        self.globals.append(declared)
+        for statement in body:
+            self.visit(statement)
+        self.globals.pop()
+        self.scopes.pop()
+    
+    def visit_FunctionDef(self, node):
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        for arg in node.args.posonlyargs + node.args.args + node.args.kwonlyargs + [node.args.vararg, node.args.kwarg]:
+            if arg is not None and arg.annotation is not None:
+                self.visit(arg.annotation)
+        if node.returns is not None:
+            self.visit(node.returns)
+        self._bind(node.name)
+        self._visit_function(node.args, node.body, _local_names(node.body))
+    
+    visit_AsyncFunctionDef = visit_FunctionDef
+    
+    def visit_Lambda(self, node: ast.Lambda):
+        self._visit_function(node.args, [node.body], set())
+    
+    def visit_ClassDef(self, node: ast.ClassDef):
+        for expression in node.decorator_list + node.bases + [keyword.value for keyword in node.keywords]:
+            self.visit(expression)
+        self.scopes.append(("class", set()))
+        for statement in node.body:
+            self.visit(statement)
+        self.scopes.pop()
+        self._bind(node.name)
+    
+    def _visit_comprehension(self, node, elements: List[ast.AST]):
+        # The first iterable is evaluated in the enclosing scope
+        self.visit(node.generators[0].iter)
+        self.scopes.append(("comprehension", set()))
+        for index, generator in enumerate(node.generators):
+            if index:
+                self.visit(generator.iter)
+            self._visit_target(generator.target)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for element in elements:
+            self.visit(element)
+        self.scopes.pop()
+    
+    def visit_ListComp(self, node):
+        self._visit_comprehension(node, [node.elt])
+    
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+    
+    def visit_DictComp(self, node: ast.DictComp):
+        self._visit_comprehension(node, [node.key, node.value])
+    
+    def visit_MatchAs(self, node: ast.MatchAs):
+        if node.pattern is not None:
+            self.visit(node.pattern)
+        if node.name:
+            self._bind(node.name)
+    
+    def visit_MatchStar(self, node: ast.MatchStar):
+        if node.name:
+            self._bind(node.name)
+    
+    def visit_MatchMapping(self, node: ast.MatchMapping):
+        self.generic_visit(node)
+        if node.rest:
+            self._bind(node.rest)
+
+def analyze(source: str) -> CellSymbols:
+    try:
+        tree = ast.parse(_to_python(source))
+    except (SyntaxError, ValueError):
+        return CellSymbols(set(), set(), True, hashlib.sha1(source.encode("utf-8")).hexdigest())
+    visitor = _SymbolVisitor()
+    visitor.visit(tree)
+    uses = visitor.uses | (visitor.deferred_uses - visitor.defines)
+    # Hashing the syntax tree means comment and whitespace edits do not make a cell stale
+    digest = hashlib.sha1(ast.dump(tree).encode("utf-8")).hexdigest()
+    return CellSymbols(visitor.defines, uses, visitor.star_import, digest)
+
+class SymbolCache:
+    # Per-cell analysis, refreshed as cells are edited so building a notebook's graph only
+    # parses cells whose source changed. Entries are checked against the source on every read,
+    # so edits made through another worker are picked up too.
+    def __init__(self, max_entries: int = DEPENDENCY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Tuple[str, CellSymbols]]" = OrderedDict()
+        self._hits = registry.counter("dependency_analysis_hits_total")
+        self._misses = registry.counter("dependency_analysis_misses_total")
+    
+    def get(self, cell_id: int, source: str) -> CellSymbols:
+        entry = self._entries.get(cell_id)
+        if entry is not None and entry[0] == source:
+            self._entries.move_to_end(cell_id)
+            self._hits.inc()
+            return entry[1]
+        self._misses.inc()
+        return self.update(cell_id, source)
+    
+    def update(self, cell_id: int, source: str) -> CellSymbols:
+        symbols = analyze(source)
+        self._entries[cell_id] = (source, symbols)
+        self._entries.move_to_end(cell_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return symbols
+    
+    def discard(self, cell_id: int):
+        self._entries.pop(cell_id, None)
+
+class DependencyGraph:
+    # Code cells in notebook order. A cell depends on the nearest earlier cell binding each name
+    # it reads, so edges only point forward and notebook order is a topological order.
+    def __init__(self, cells: List[Tuple[int, CellSymbols]]):
+        self.order = [cell_id for cell_id, _ in cells]
+        self.symbols = dict(cells)
+        self.parents: Dict[int, Set[int]] = {}
+        self.children: Dict[int, Set[int]] = {cell_id: set() for cell_id in self.order}
+        
+        last_definer: Dict[str, int] = {}
+        barrier: Optional[int] = None
+        for cell_id, symbols in cells:
+            if symbols.opaque:
+                parents = set(last_definer.values())
+            else:
+                parents = {last_definer[name] for name in symbols.uses if name in last_definer}
+            if barrier is not None:
+                parents.add(barrier)
+            parents.discard(cell_id)
+            self.parents[cell_id] = parents
+            for parent in parents:
+                self.children[parent].add(cell_id)
+            for name in symbols.defines:
+                last_definer[name] = cell_id
+            if symbols.opaque:
+                barrier = cell_id
+    
+    def __contains__(self, cell_id) -> bool:
+        return cell_id in self.symbols
+    
+    def _reach(self, start: Iterable[int], edges: Dict[int, Set[int]]) -> Set[int]:
+        seen: Set[int] = set()
+        stack = [cell for cell_id in start for cell in edges.get(cell_id, ())]
+        while stack:
+            cell_id = stack.pop()
+            if cell_id not in seen:
+                seen.add(cell_id)
+                stack.extend(edges[cell_id])
+        return seen
+    
+    def descendants(self, *cell_ids: int) -> Set[int]:
+        return self._reach(cell_ids, self.children)
+    
+    def ancestors(self, *cell_ids: int) -> Set[int]:
+        return self._reach(cell_ids, self.parents)
+    
+    def fingerprints(self) -> Dict[int, str]:
+        # A cell's fingerprint covers its own code and, through its parents' fingerprints,
+        # everything upstream it reads; it changes exactly when the cell needs to re-run
+        result: Dict[int, str] = {}
+        for cell_id in self.order:
+            digest = hashlib.sha1(self.symbols[cell_id].digest.encode("ascii"))
+            for parent in sorted(self.parents[cell_id]):
+                digest.update(result[parent].encode("ascii"))
+            result[cell_id] = digest.hexdigest()
+        return result
+    
+    def describe(self) -> List[Dict[str, object]]:
+        return [{
+            "cell_id": cell_id,
+            "defines": sorted(self.symbols[cell_id].defines),
+            "uses": sorted(self.symbols[cell_id].uses),
+            "opaque": self.symbols[cell_id].opaque,
+            "parents": sorted(self.parents[cell_id])
+        } for cell_id in self.order]
+
+cell_symbols = SymbolCache()
@@ -0,0 +1,185 @@
+import os
+import zlib
+import asyncio
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from src.services.metrics import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FILE_COMPRESS_MIN_BYTES = int(os.getenv("FILE_COMPRESS_MIN_BYTES", "1024"))
+FILE_COMPRESS_CHUNK_SIZE = int(os.getenv("FILE_COMPRESS_CHUNK_SIZE", "262144"))
+FILE_GZIP_LEVEL = int(os.getenv("FILE_GZIP_LEVEL", "6"))
+FILE_BROTLI_QUALITY = int(os.getenv("FILE_BROTLI_QUALITY", "4"))
+
+# Uploaded files can be replaced under the same name, so clients always revalidate
+CACHE_CONTROL = "private, no-cache"
+# Blobs are addressed by their content and never change
+BLOB_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Output types a blob may be served as; anything else is sent as application/octet-stream
+BLOB_TYPES = {
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp", "image/svg+xml", "application/pdf",
+    "text/html", "text/plain", "text/markdown", "text/latex", "application/json", "application/javascript"
+}
+TEXT_SUFFIXES = {".csv", ".tsv", ".txt", ".md", ".log", ".py", ".ipynb", ".jsonl", ".yaml", ".yml", ".sql"}
+TEXT_TYPES = {"application/json", "application/javascript", "application/xml", "image/svg+xml"}
+
+mimetypes.add_type("application/x-ipynb+json", ".ipynb")
+
+_served = registry.counter("files_served_total")
+_not_modified = registry.counter("files_not_modified_total")
+_compressed = registry.counter("files_compressed_total")
+
+def resolve_upload(base_dir: Path, session_id: str, filename: str) -> Optional[Path]:
+    # Only plain files directly inside the session directory are served: no traversal, no
+    # symlinks out of it and nothing hidden such as in-progress uploads
+    if not session_id or not filename or filename.startswith(".") or session_id.startswith("."):
+        return None
+    session_dir = (base_dir / session_id).resolve()
+    path = (session_dir / filename).resolve()
+    if path.parent != session_dir or session_dir.parent != base_dir.resolve() or not path.is_file():
+        return None
+    return path
+
+def _etag(stat_result: os.stat_result, encoding: Optional[str] = None) -> str:
+    tag = f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+def _not_modified_since(request: Request, stat_result: os.stat_result, etags: set) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as for GET; If-Modified-Since is ignored when If-None-Match is sent
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in candidates or bool(candidates & etags)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _accepted_encoding(request: Request) -> Optional[str]:
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def _compressible(path: Path, media_type: Optional[str]) -> bool:
+    return path.suffix.lower() in TEXT_SUFFIXES or (media_type or "").startswith("text/") or media_type in TEXT_TYPES
+
+def _compressor(encoding: str):
+    if encoding == "br":
+        return brotli.Compressor(quality=FILE_BROTLI_QUALITY)
+    return zlib.compressobj(FILE_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def _compress_chunk(f, compressor, encoding: str) -> tuple:
+    # Read and compress together in the worker thread; both release the GIL
+    chunk = f.read(FILE_COMPRESS_CHUNK_SIZE)
+    if not chunk:
+        return b"", True
+    data = compressor.process(chunk) if encoding == "br" else compressor.compress(chunk)
+    return data, False
+
+async def _compressed_body(path: Path, encoding: str):
+    compressor = _compressor(encoding)
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while True:
+            data, done = await asyncio.to_thread(_compress_chunk, f, compressor, encoding)
+            if done:
+                break
+            if data:
+                yield data
+        yield compressor.finish() if encoding == "br" else compressor.flush()
+    finally:
+        await asyncio.to_thread(f.close)
+
+async def file_response(request: Request, path: Path) -> Response:
+    # Validators come from the file's stat: an ETag of mtime and size plus Last-Modified.
+    # Range and If-Range requests are answered by FileResponse on the identity encoding;
+    # other requests for text files are compressed on the fly when the client accepts it.
+    stat_result = await asyncio.to_thread(os.stat, path)
+    media_type = mimetypes.guess_type(path.name)[0]
+    compressible = _compressible(path, media_type)
+    encoding = None
+    if (
+        compressible
+        and stat_result.st_size >= FILE_COMPRESS_MIN_BYTES
+        and request.method == "GET"
+        and "range" not in request.headers
+    ):
+        encoding = _accepted_encoding(request)
+    
+    headers: Dict[str, str] = {
+        "ETag": _etag(stat_result, encoding),
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+        "Accept-Ranges": "bytes"
+    }
+    if compressible:
+        headers["Vary"] = "Accept-Encoding"
+    
+    etags = {_etag(stat_result), _etag(stat_result, "gzip"), _etag(stat_result, "br")}
+    if _not_modified_since(request, stat_result, etags):
+        _not_modified.inc()
+        return Response(status_code=304, headers=headers)
+    
+    _served.inc()
+    if encoding is None:
+        return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
+    
+    _compressed.inc()
+    headers["Content-Encoding"] = encoding
+    return StreamingResponse(_compressed_body(path, encoding), media_type=media_type or "text/plain", headers=headers)
+
+async def blob_response(request: Request, path: Path, digest: str, media_type: Optional[str]) -> Response:
+    # The digest is the ETag, so a client holding the blob never downloads it again; kernel
+    # output is untrusted, so active content is served under a sandboxing CSP
+    media_type = media_type if media_type in BLOB_TYPES else "application/octet-stream"
+    stat_result = await asyncio.to_thread(os.stat, path)
+    compressible = _compressible(path, media_type)
+    encoding = None
+    if compressible and stat_result.st_size >= FILE_COMPRESS_MIN_BYTES and "range" not in request.headers:
+        encoding = _accepted_encoding(request)
+    
+    headers: Dict[str, str] = {
+        "ETag": f'"{digest}-{encoding}"' if encoding else f'"{digest}"',
+        "Cache-Control": BLOB_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if media_type in ("text/html", "image/svg+xml", "application/javascript"):
+        headers["Content-Security-Policy"] = "sandbox"
+    if compressible:
+        headers["Vary"] = "Accept-Encoding"
+    
+    if _not_modified_since(request, stat_result, {f'"{digest}"', f'"{digest}-gzip"', f'"{digest}-br"'}):
+        _not_modified.inc()
+        return Response(status_code=304, headers=headers)
+    
+    _served.inc()
+    if encoding is None:
+        return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
+    
+    _compressed.inc()
+    headers["Content-Encoding"] = encoding
+    return StreamingResponse(_compressed_body(path, encoding), media_type=media_type, headers=headers)
@@ -0,0 +1,30 @@
+from pathlib import Path
+from typing import Dict, Any, BinaryIO, Iterator, List
+import ijson
+
+PARSE_BUFFER_SIZE = 262144
+
+def iter_cells(f: BinaryIO) -> Iterator[Dict[str, Any]]:
+    # Event-based: only cell_type and source are collected. Outputs, attachments and metadata
+    # stream past one token at a time, so base64 images are never assembled into a tree.
+    cell = None
+    try:
+        for prefix, event, value in ijson.parse(f, buf_size=PARSE_BUFFER_SIZE):
+            if prefix == "cells.item":
+                if event == "start_map":
+                    cell = {"cell_type": "code", "source": []}
+                elif event == "end_map" and cell is not None:
+                    yield {"cell_type": cell["cell_type"], "source": "".join(cell["source"])}
+                    cell = None
+            elif cell is not None and event == "string":
+                if prefix == "cells.item.cell_type":
+                    cell["cell_type"] = value
+                elif prefix == "cells.item.source" or prefix == "cells.item.source.item":
+                    cell["source"].append(value)
+    except ijson.JSONError as e:
+        # yajl appends a multi-line pointer into the input; keep the message itself
+        raise ValueError("Invalid notebook: " + (str(e).splitlines() or ["parse error"])[0])
+
+def read_cells(path: Path) -> List[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        return [{**cell, "order_index": index} for index, cell in enumerate(iter_cells(f))]
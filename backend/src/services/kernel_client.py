@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+from jupyter_client import AsyncKernelManager
+
+logger = logging.getLogger(__name__)
+
+class KernelRestarted(Exception):
+    pass
+
+class Execution:
+    def __init__(self, msg_id: str):
+        self.msg_id = msg_id
+        self.messages: "asyncio.Queue[Tuple[str, Dict[str, Any]]]" = asyncio.Queue()
+    
+    async def get(self, timeout: Optional[float] = None) -> Tuple[str, Dict[str, Any]]:
+        channel, msg = await asyncio.wait_for(self.messages.get(), timeout)
+        if channel == "restart":
+            raise KernelRestarted(msg.get("reason", "Kernel restarted"))
+        return channel, msg
+
+class SessionKernelClient:
+    def __init__(self, km: AsyncKernelManager):
+        self.km = km
+        self._kc = None
+        self._routes: Dict[str, Execution] = {}
+        self._routers: List[asyncio.Task] = []
+        self._restarting: Optional[asyncio.Task] = None
+        # Replayed silently after every restart so session setup survives it
+        self.setup_code: Optional[str] = None
+        # Cell id -> fingerprint of the code and inputs it last ran with; the kernel's state
+        # matches these only until it restarts
+        self.executed: Dict[int, str] = {}
+    
+    @property
+    def connected(self) -> bool:
+        return self._kc is not None and bool(self._routers) and not any(task.done() for task in self._routers)
+    
+    @property
+    def busy(self) -> bool:
+        # An execution is still waiting for its replies
+        return bool(self._routes)
+    
+    async def connect(self, timeout: float = 60):
+        self._kc = self.km.client()
+        self._kc.start_channels()
+        await self._kc.wait_for_ready(timeout=timeout)
+        self._routers = [
+            asyncio.create_task(self._route("iopub", self._kc.get_iopub_msg)),
+            asyncio.create_task(self._route("shell", self._kc.get_shell_msg))
+        ]
+    
+    async def close(self, reason: Optional[str] = None):
+        # With a reason the kernel is going away: executions still waiting on it fail with it
+        for task in self._routers:
+            task.cancel()
+        if self._routers:
+            await asyncio.gather(*self._routers, return_exceptions=True)
+        self._routers = []
+        if self._kc:
+            try:
+                self._kc.stop_channels()
+            except Exception:
+                logger.exception("Failed to stop kernel client channels")
+            self._kc = None
+        if reason is not None:
+            self._fail_pending(reason)
+    
+    async def execute(self, code: str, **kwargs) -> Execution:
+        await self._ensure_alive()
+        # execute() sends synchronously, so the route exists before any reply is read
+        msg_id = self._kc.execute(code, **kwargs)
+        execution = Execution(msg_id)
+        self._routes[msg_id] = execution
+        return execution
+    
+    async def setup(self, code: str, timeout: float = 30):
+        self.setup_code = code
+        await self._run_silent(code, timeout)
+    
+    async def _run_silent(self, code: str, timeout: float):
+        # Bypasses _ensure_alive so it can run from inside a restart
+        msg_id = self._kc.execute(code, silent=True, store_history=False)
+        execution = Execution(msg_id)
+        self._routes[msg_id] = execution
+        try:
+            while True:
+                channel, msg = await execution.get(timeout)
+                if channel == "shell" and msg.get("msg_type") == "execute_reply":
+                    if msg["content"].get("status") != "ok":
+                        raise RuntimeError(f"Kernel setup failed: {msg['content'].get('evalue', '')}")
+                    return
+        finally:
+            self.finish(execution)
+    
+    def finish(self, execution: Execution):
+        self._routes.pop(execution.msg_id, None)
+    
+    async def interrupt(self):
+        await self.km.interrupt_kernel()
+    
+    async def restart(self, reason: str = "Kernel restarted"):
+        # Concurrent callers share one restart instead of bouncing the kernel repeatedly
+        if self._restarting is None or self._restarting.done():
+            self._restarting = asyncio.create_task(self._restart(reason))
+        await asyncio.shield(self._restarting)
+    
+    async def _restart(self, reason: str):
+        await self.close()
+        self._fail_pending(reason)
+        self.executed.clear()
+        await self.km.restart_kernel(now=True)
+        await self.connect()
+        if self.setup_code:
+            try:
+                await self._run_silent(self.setup_code, 30)
+            except (RuntimeError, asyncio.TimeoutError, KernelRestarted):
+                logger.exception("Failed to replay kernel setup after restart")
+    
+    async def _ensure_alive(self):
+        if self._restarting is not None and not self._restarting.done():
+            await asyncio.shield(self._restarting)
+        if not await self.km.is_alive():
+            logger.warning("Kernel died, restarting")
+            await self.restart("Kernel died and was restarted")
+        elif not self.connected:
+            await self.close()
+            await self.connect()
+    
+    def _fail_pending(self, reason: str):
+        routes = list(self._routes.values())
+        self._routes.clear()
+        for execution in routes:
+            execution.messages.put_nowait(("restart", {"reason": reason}))
+    
+    async def _route(self, channel: str, receive):
+        while True:
+            try:
+                msg = await receive()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Kernel client %s router failed", channel)
+                return
+            parent_id = msg.get("parent_header", {}).get("msg_id")
+            execution = self._routes.get(parent_id)
+            if execution:
+                execution.messages.put_nowait((channel, msg))
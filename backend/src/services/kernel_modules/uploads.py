@@ -0,0 +1,114 @@
+# Imported into every session kernel as `uploads`. The kernel's working directory is the
+# session's upload directory, so plain relative paths work too; these loaders add memory
+# mapping and a per-kernel cache so re-running a cell reuses the data instead of re-reading it.
+#
+#     df = uploads.csv("sales.csv")        # parsed once, cached until the file changes
+#     arr = uploads.numpy("features.npy")  # read-only np.memmap, pages loaded on demand
+#     tbl = uploads.parquet("events.parquet", table=True)
+#
+# Cached objects are shared between cells; copy a DataFrame before modifying it in place.
+import os
+import mmap as _mmap
+
+ROOT = os.getcwd()
+
+_cache = {}
+_hits = 0
+_loads = 0
+
+def path(name):
+    return os.path.join(ROOT, name)
+
+def files():
+    return sorted(entry.name for entry in os.scandir(ROOT) if entry.is_file() and not entry.name.startswith("."))
+
+def _cached(name, kind, loader, **kwargs):
+    # Entries are keyed by file, loader and arguments, and revalidated with a stat so a
+    # re-uploaded file is picked up on the next call
+    global _hits, _loads
+    full_path = path(name)
+    stat = os.stat(full_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    key = (full_path, kind, repr(sorted(kwargs.items())))
+    entry = _cache.get(key)
+    if entry is not None and entry[0] == version:
+        _hits += 1
+        return entry[1]
+    value = loader(full_path, **kwargs)
+    _cache[key] = (version, value)
+    _loads += 1
+    return value
+
+def _map_file(full_path):
+    with open(full_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(_mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ))
+
+def mmap(name):
+    # Read-only memoryview over the file; the OS page cache is shared with other readers
+    return _cached(name, "mmap", _map_file)
+
+def _load_numpy(full_path):
+    import numpy as np
+    # .npy maps without copying; .npz archives are opened lazily member by member
+    return np.load(full_path, mmap_mode="r", allow_pickle=False)
+
+def numpy(name):
+    return _cached(name, "numpy", _load_numpy)
+
+def _load_csv(full_path, **kwargs):
+    try:
+        import pandas as pd
+    except ImportError:
+        import csv as _csv
+        import io
+        text = io.TextIOWrapper(io.BytesIO(_map_file(full_path)), encoding="utf-8", newline="")
+        return list(_csv.reader(text, delimiter=kwargs.get("sep", ",")))
+    return pd.read_csv(full_path, memory_map=True, **kwargs)
+
+def csv(name, **kwargs):
+    return _cached(name, "csv", _load_csv, **kwargs)
+
+def _load_parquet(full_path, columns=None, table=False):
+    import pyarrow.parquet as pq
+    result = pq.read_table(full_path, columns=columns, memory_map=True)
+    return result if table else result.to_pandas()
+
+def parquet(name, columns=None, table=False):
+    return _cached(name, "parquet", _load_parquet, columns=columns, table=table)
+
+def _load_arrow(full_path, table=False):
+    import pyarrow as pa
+    # Arrow IPC / Feather v2 buffers point straight into the mapping
+    source = pa.memory_map(full_path, "r")
+    try:
+        result = pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        result = pa.ipc.open_stream(source).read_all()
+    return result if table else result.to_pandas()
+
+def arrow(name, table=False):
+    return _cached(name, "arrow", _load_arrow, table=table)
+
+LOADERS = {
+    ".csv": csv,
+    ".tsv": lambda name, **kwargs: csv(name, **{"sep": "\t", **kwargs}),
+    ".parquet": parquet,
+    ".npy": numpy,
+    ".npz": numpy,
+    ".arrow": arrow,
+    ".feather": arrow
+}
+
+def load(name, **kwargs):
+    loader = LOADERS.get(os.path.splitext(name)[1].lower())
+    if loader is None:
+        return mmap(name)
+    return loader(name, **kwargs)
+
+def clear():
+    _cache.clear()
+
+def cache_info():
+    return {"entries": len(_cache), "hits": _hits, "loads": _loads}
@@ -0,0 +1,242 @@
+import os
+import asyncio
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional
+from jupyter_client import AsyncKernelManager
+from src.services.kernel_client import SessionKernelClient
+from src.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+KERNEL_POOL_SIZE = int(os.getenv("KERNEL_POOL_SIZE", "2"))
+KERNEL_MAX_KERNELS = int(os.getenv("KERNEL_MAX_KERNELS", "20"))
+KERNEL_IDLE_TTL = float(os.getenv("KERNEL_IDLE_TTL", "1800"))
+KERNEL_EVICT_INTERVAL = float(os.getenv("KERNEL_EVICT_INTERVAL", "60"))
+KERNEL_START_TIMEOUT = float(os.getenv("KERNEL_START_TIMEOUT", "60"))
+KERNEL_SETUP_TIMEOUT = float(os.getenv("KERNEL_SETUP_TIMEOUT", "30"))
+
+class PooledKernel:
+    def __init__(self, km: AsyncKernelManager, client: SessionKernelClient):
+        self.km = km
+        self.client = client
+        self.session_id: Optional[str] = None
+        self.last_used = time.monotonic()
+    
+    def touch(self):
+        self.last_used = time.monotonic()
+
+class KernelPool:
+    # All bookkeeping runs on the event loop, so state changes between awaits are atomic
+    def __init__(
+        self,
+        warm_size: int = KERNEL_POOL_SIZE,
+        max_kernels: int = KERNEL_MAX_KERNELS,
+        idle_ttl: float = KERNEL_IDLE_TTL,
+        evict_interval: float = KERNEL_EVICT_INTERVAL,
+        kernel_factory: Callable[[], AsyncKernelManager] = AsyncKernelManager,
+        session_setup: Optional[Callable[[str], str]] = None
+    ):
+        self.warm_size = warm_size
+        self.max_kernels = max(max_kernels, 1)
+        self.idle_ttl = idle_ttl
+        self.evict_interval = evict_interval
+        self.kernel_factory = kernel_factory
+        # Returns code run silently in a kernel when it is handed to a session
+        self.session_setup = session_setup
+        
+        self._warm: List[PooledKernel] = []
+        self._sessions: "OrderedDict[str, PooledKernel]" = OrderedDict()  # LRU order, oldest first
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._starting = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stopping = False
+        
+        self._start_latency = registry.histogram("kernel_start_seconds")
+        self._acquire_latency = registry.histogram("kernel_acquire_seconds")
+        self._warm_hits = registry.counter("kernel_pool_warm_hits_total")
+        self._cold_starts = registry.counter("kernel_pool_cold_starts_total")
+        self._evictions = registry.counter("kernel_pool_evictions_total")
+        registry.gauge("kernel_pool_warm", lambda: len(self._warm))
+        registry.gauge("kernel_pool_active", lambda: len(self._sessions))
+        registry.gauge("kernel_pool_starting", lambda: self._starting)
+    
+    def start(self):
+        if self._worker and not self._worker.done():
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._maintain())
+    
+    async def shutdown(self):
+        # The flag covers a wait_for() that swallows cancellation when the wakeup races it
+        self._stopping = True
+        if self._worker:
+            self._notify()
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        kernels = self._warm + list(self._sessions.values())
+        self._warm = []
+        self._sessions.clear()
+        await asyncio.gather(*(self._shutdown_kernel(kernel) for kernel in kernels))
+    
+    async def acquire(self, session_id: str) -> PooledKernel:
+        kernel = self._sessions.get(session_id)
+        if kernel:
+            self._sessions.move_to_end(session_id)
+            kernel.touch()
+            return kernel
+        
+        # Concurrent first requests for a session share a single handoff
+        pending = self._pending.get(session_id)
+        if pending is None:
+            pending = asyncio.create_task(self._assign(session_id))
+            self._pending[session_id] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(session_id, None))
+        return await asyncio.shield(pending)
+    
+    def get(self, session_id: str) -> Optional[PooledKernel]:
+        return self._sessions.get(session_id)
+    
+    async def release(self, session_id: str) -> bool:
+        kernel = self._sessions.pop(session_id, None)
+        if not kernel:
+            return False
+        await self._shutdown_kernel(kernel)
+        self._notify()
+        return True
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "warm": len(self._warm),
+            "active": len(self._sessions),
+            "starting": self._starting,
+            "max_kernels": self.max_kernels,
+            "start_latency": self._start_latency.snapshot()
+        }
+    
+    async def _assign(self, session_id: str) -> PooledKernel:
+        started = time.perf_counter()
+        if self._warm:
+            kernel = self._warm.pop()
+            self._warm_hits.inc()
+        else:
+            self._cold_starts.inc()
+            victims = self._make_room()
+            self._starting += 1
+            try:
+                await asyncio.gather(*(self._shutdown_kernel(victim) for victim in victims))
+                kernel = await self._start_kernel()
+            finally:
+                self._starting -= 1
+        
+        kernel.session_id = session_id
+        kernel.touch()
+        self._sessions[session_id] = kernel
+        if self.session_setup:
+            # Sent before anything else can reach the kernel, so cells always run after it
+            try:
+                await kernel.client.setup(self.session_setup(session_id), KERNEL_SETUP_TIMEOUT)
+            except Exception:
+                logger.exception("Kernel setup failed for session %s", session_id)
+        self._acquire_latency.observe(time.perf_counter() - started)
+        self._notify()
+        return kernel
+    
+    def _notify(self):
+        if self._wakeup:
+            self._wakeup.set()
+    
+    def _live_count(self) -> int:
+        return len(self._warm) + len(self._sessions) + self._starting
+    
+    def _make_room(self) -> List[PooledKernel]:
+        # Reserves capacity for one more kernel by evicting warm, then LRU kernels
+        victims = []
+        while self._live_count() >= self.max_kernels:
+            if self._warm:
+                victims.append(self._warm.pop(0))
+            elif self._sessions:
+                # The least recently used idle kernel; a busy one only when every kernel is busy,
+                # and its running execution then fails instead of waiting forever
+                session_id = next((key for key, kernel in self._sessions.items() if not kernel.client.busy), None)
+                if session_id is None:
+                    session_id = next(iter(self._sessions))
+                kernel = self._sessions.pop(session_id)
+                logger.info("Evicting LRU kernel for session %s", kernel.session_id)
+                self._evictions.inc()
+                victims.append(kernel)
+            else:
+                break
+        return victims
+    
+    async def _start_kernel(self) -> PooledKernel:
+        started = time.perf_counter()
+        km = self.kernel_factory()
+        await km.start_kernel()
+        # Wait until the kernel answers so pooled kernels are genuinely warm;
+        # the client stays connected for the lifetime of the kernel
+        client = SessionKernelClient(km)
+        try:
+            await client.connect(timeout=KERNEL_START_TIMEOUT)
+        except (RuntimeError, asyncio.CancelledError):
+            await client.close()
+            await km.shutdown_kernel(now=True)
+            raise
+        self._start_latency.observe(time.perf_counter() - started)
+        return PooledKernel(km, client)
+    
+    async def _shutdown_kernel(self, kernel: PooledKernel):
+        try:
+            await kernel.client.close("Kernel was shut down")
+            await kernel.km.shutdown_kernel(now=True)
+        except Exception:
+            logger.exception("Failed to shut down kernel for session %s", kernel.session_id)
+    
+    async def _evict_idle(self):
+        if self.idle_ttl <= 0:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        victims = []
+        # The whole map is scanned: touch() at the end of a run updates last_used without
+        # reordering, so LRU order only approximates idleness
+        for session_id, kernel in list(self._sessions.items()):
+            if kernel.last_used >= cutoff:
+                continue
+            if kernel.client.busy:
+                # last_used is set when a run ends, so long runs look idle
+                continue
+            del self._sessions[session_id]
+            victims.append(kernel)
+        for kernel in victims:
+            logger.info("Evicting idle kernel for session %s", kernel.session_id)
+            self._evictions.inc()
+        await asyncio.gather(*(self._shutdown_kernel(kernel) for kernel in victims))
+    
+    async def _refill(self):
+        while not self._stopping and len(self._warm) + self._starting < self.warm_size and self._live_count() < self.max_kernels:
+            self._starting += 1
+            try:
+                kernel = await self._start_kernel()
+            except Exception:
+                logger.exception("Failed to pre-start kernel")
+                return
+            finally:
+                self._starting -= 1
+            if self._stopping:
+                await self._shutdown_kernel(kernel)
+                return
+            self._warm.append(kernel)
+    
+    async def _maintain(self):
+        while not self._stopping:
+            await self._evict_idle()
+            await self._refill()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.evict_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
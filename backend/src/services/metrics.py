@@ -0,0 +1,195 @@
+import os
+import math
+import threading
+import logging
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Disables the per-request instrumentation and the /metrics endpoint; component counters stay on
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+class Counter:
+    kind = "counter"
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._value = 0.0
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+    
+    def snapshot(self) -> float:
+        return self._value
+    
+    def samples(self, labels: Dict[str, str]) -> List[Sample]:
+        return [("", labels, self._value)]
+
+class Gauge:
+    kind = "gauge"
+    
+    def __init__(self, name: str, fn: Optional[Callable[[], float]] = None):
+        self.name = name
+        self._value = 0.0
+        self._fn = fn
+    
+    def set(self, value: float):
+        self._value = value
+    
+    def snapshot(self) -> float:
+        return self._fn() if self._fn else self._value
+    
+    def samples(self, labels: Dict[str, str]) -> List[Sample]:
+        return [("", labels, float(self.snapshot()))]
+
+class Histogram:
+    kind = "histogram"
+    
+    def __init__(self, name: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(list(self.buckets) + ["+Inf"], self._counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            return {
+                "count": self._count,
+                "sum": self._sum,
+                "avg": self._sum / self._count if self._count else 0.0,
+                "buckets": buckets
+            }
+    
+    def samples(self, labels: Dict[str, str]) -> List[Sample]:
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        samples = []
+        cumulative = 0
+        for bound, bucket in zip(list(self.buckets) + [math.inf], counts):
+            cumulative += bucket
+            samples.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+        samples.append(("_sum", labels, total))
+        samples.append(("_count", labels, count))
+        return samples
+
+class MetricFamily:
+    # One metric per combination of label values, e.g. request_seconds{action="run_cell"}.
+    # Label values must come from a small fixed set; callers map anything else to "other".
+    def __init__(self, name: str, labelnames: Tuple[str, ...], factory: Callable[[], Any]):
+        self.name = name
+        self.labelnames = labelnames
+        self.kind = factory().kind
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+    
+    def labels(self, *values: str, **kwargs: str):
+        key = tuple(str(value) for value in values) or tuple(str(kwargs[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            children = list(self._children.items())
+        return {",".join(f"{name}={value}" for name, value in zip(self.labelnames, key)): child.snapshot() for key, child in children}
+    
+    def samples(self, labels: Dict[str, str]) -> List[Sample]:
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for key, child in children:
+            samples.extend(child.samples({**labels, **dict(zip(self.labelnames, key))}))
+        return samples
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+    
+    def _get_or_create(self, name: str, factory: Callable[[], Any], labels: Tuple[str, ...] = (), description: str = ""):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = MetricFamily(name, tuple(labels), factory) if labels else factory()
+            if description:
+                self._help[name] = description
+            return self._metrics[name]
+    
+    def counter(self, name: str, description: str = "", labels: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(name, lambda: Counter(name), labels, description)
+    
+    def gauge(self, name: str, fn: Optional[Callable[[], float]] = None, description: str = "", labels: Tuple[str, ...] = ()) -> Gauge:
+        gauge = self._get_or_create(name, lambda: Gauge(name, fn), labels, description)
+        if fn is not None and not labels:
+            gauge._fn = fn
+        return gauge
+    
+    def histogram(self, name: str, buckets: tuple = DEFAULT_BUCKETS, description: str = "", labels: Tuple[str, ...] = ()) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(name, buckets), labels, description)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+    
+    def render_prometheus(self) -> str:
+        # Text exposition format 0.0.4
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+            descriptions = dict(self._help)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples({})
+            except Exception:
+                logger.exception("Failed to collect metric %s", metric.name)
+                continue
+            if metric.name in descriptions:
+                lines.append(f"# HELP {metric.name} {descriptions[metric.name]}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from src.services.metrics import registry
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+NOTEBOOK_CACHE_MAX_BYTES = int(os.getenv("NOTEBOOK_CACHE_MAX_BYTES", "67108864"))
+NOTEBOOK_CACHE_TTL = int(os.getenv("NOTEBOOK_CACHE_TTL", "3600"))
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+class CachedNotebook:
+    # Serialized once; the body is sent as-is and the ETag is a hash of it
+    def __init__(self, body: bytes, etag: Optional[str] = None):
+        self.body = body
+        self.etag = etag or '"' + hashlib.sha1(body).hexdigest() + '"'
+    
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> "CachedNotebook":
+        return cls(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+    
+    @property
+    def data(self) -> Dict[str, Any]:
+        return json.loads(self.body)
+
+class MemoryCacheBackend:
+    # LRU bounded by the total size of the cached bodies
+    def __init__(self, max_bytes: int = NOTEBOOK_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, CachedNotebook]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    async def get(self, key: str) -> Optional[CachedNotebook]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+    
+    async def set(self, key: str, entry: CachedNotebook):
+        await self.delete(key)
+        if len(entry.body) > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+    
+    async def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+class RedisCacheBackend:
+    # Any Redis-compatible server; size bounds come from its maxmemory/eviction policy
+    def __init__(self, url: str, ttl: int = NOTEBOOK_CACHE_TTL, prefix: str = "notebook:"):
+        self.client = redis_asyncio.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+    
+    async def get(self, key: str) -> Optional[CachedNotebook]:
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        etag, _, body = raw.partition(b"\n")
+        return CachedNotebook(body, etag.decode("ascii"))
+    
+    async def set(self, key: str, entry: CachedNotebook):
+        await self.client.set(self.prefix + key, entry.etag.encode("ascii") + b"\n" + entry.body, ex=self.ttl or None)
+    
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+def make_backend():
+    if REDIS_URL:
+        if redis_asyncio is not None:
+            return RedisCacheBackend(REDIS_URL)
+        logger.warning("REDIS_URL is set but the redis package is not installed; using the in-process cache")
+    return MemoryCacheBackend()
+
+class NotebookCache:
+    # Read-through cache of serialized load_notebook results, keyed by session. Writers
+    # invalidate after committing; a load that raced an invalidation does not store its result.
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else make_backend()
+        self._generations: Dict[str, int] = {}
+        
+        self._hits = registry.counter("notebook_cache_hits_total")
+        self._misses = registry.counter("notebook_cache_misses_total")
+        self._invalidations = registry.counter("notebook_cache_invalidations_total")
+        registry.gauge("notebook_cache_bytes", lambda: getattr(self.backend, "size", 0))
+        registry.gauge("notebook_cache_entries", lambda: len(self.backend) if hasattr(self.backend, "__len__") else 0)
+    
+    def generation(self, session_id: str) -> int:
+        return self._generations.get(session_id, 0)
+    
+    async def get(self, session_id: str) -> Optional[CachedNotebook]:
+        try:
+            entry = await self.backend.get(session_id)
+        except Exception:
+            logger.exception("Notebook cache read failed")
+            entry = None
+        if entry is not None:
+            self._hits.inc()
+        return entry
+    
+    async def put(self, session_id: str, data: Dict[str, Any], generation: int) -> CachedNotebook:
+        # Called after every database load, so it is where misses are counted
+        self._misses.inc()
+        entry = CachedNotebook.from_data(data)
+        if generation != self.generation(session_id):
+            return entry
+        try:
+            await self.backend.set(session_id, entry)
+        except Exception:
+            logger.exception("Notebook cache write failed")
+        return entry
+    
+    async def invalidate(self, session_id: Optional[str]):
+        if not session_id:
+            return
+        self._generations[session_id] = self.generation(session_id) + 1
+        self._invalidations.inc()
+        try:
+            await self.backend.delete(session_id)
+        except Exception:
+            logger.exception("Notebook cache invalidation failed")
+
+notebook_cache = NotebookCache()
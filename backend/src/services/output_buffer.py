@@ -0,0 +1,125 @@
+import os
+import gzip
+import codecs
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+# Sizes are UTF-8 bytes; a head or tail cut mid-character drops that character
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", "1048576"))
+OUTPUT_HEAD_BYTES = int(os.getenv("OUTPUT_HEAD_BYTES", "65536"))
+OUTPUT_TAIL_BYTES = int(os.getenv("OUTPUT_TAIL_BYTES", "65536"))
+OUTPUT_SPILL_DIR = Path(os.getenv("OUTPUT_SPILL_DIR", "outputs"))
+# Rich outputs (figures, HTML, ...) kept per execution; the earliest are dropped past the limit
+OUTPUT_MAX_DISPLAYS = int(os.getenv("OUTPUT_MAX_DISPLAYS", "100"))
+
+def spill_path_for(execution_id: int) -> Path:
+    return OUTPUT_SPILL_DIR / f"{execution_id}.txt.gz"
+
+def encoded_size(text: str) -> int:
+    return len(text.encode("utf-8", errors="replace"))
+
+def _first_bytes(text: str, limit: int) -> str:
+    return text.encode("utf-8", errors="replace")[:limit].decode("utf-8", errors="ignore")
+
+def _last_bytes(text: str, limit: int) -> str:
+    if limit <= 0:
+        return ""
+    return text.encode("utf-8", errors="replace")[-limit:].decode("utf-8", errors="ignore")
+
+class OutputBuffer:
+    # Appends are O(1) amortised. Output past max_bytes keeps only a head and a tail in memory;
+    # the complete text goes to a gzip side file when a spill path is given.
+    def __init__(
+        self,
+        spill_path: Optional[Path] = None,
+        max_bytes: int = OUTPUT_MAX_BYTES,
+        head_bytes: int = OUTPUT_HEAD_BYTES,
+        tail_bytes: int = OUTPUT_TAIL_BYTES,
+        max_displays: int = OUTPUT_MAX_DISPLAYS
+    ):
+        self.spill_path = spill_path
+        self.max_bytes = max_bytes
+        self.head_bytes = min(head_bytes, max_bytes)
+        self.tail_bytes = min(tail_bytes, max_bytes)
+        self.size = 0
+        self.truncated = False
+        self._chunks: List[str] = []
+        self._head = ""
+        self._tail: deque = deque()
+        self._tail_size = 0
+        self._spill = None
+        self.displays: deque = deque(maxlen=max(max_displays, 1))
+    
+    def display(self, output: Dict[str, Any]):
+        # An update_display_data output replaces the earlier output with the same display_id
+        display_id = output.get("display_id")
+        if output.get("output_type") == "update_display_data":
+            for i, previous in enumerate(self.displays):
+                if display_id is not None and previous.get("display_id") == display_id:
+                    self.displays[i] = {**output, "output_type": previous["output_type"]}
+            return
+        self.displays.append(output)
+    
+    def write(self, text: str):
+        if not text:
+            return
+        data = text.encode("utf-8", errors="replace")
+        self.size += len(data)
+        if not self.truncated:
+            self._chunks.append(text)
+            if self.size > self.max_bytes:
+                self._truncate()
+            return
+        if self._spill:
+            self._spill.write(data)
+        self._tail.append((text, len(data)))
+        self._tail_size += len(data)
+        while self._tail and self._tail_size - self._tail[0][1] >= self.tail_bytes:
+            self._tail_size -= self._tail.popleft()[1]
+    
+    def _truncate(self):
+        self.truncated = True
+        text = "".join(self._chunks)
+        self._chunks = []
+        if self.spill_path is not None:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            self._spill = gzip.open(self.spill_path, "wb")
+            self._spill.write(text.encode("utf-8", errors="replace"))
+        self._head = _first_bytes(text, self.head_bytes)
+        tail = _last_bytes(text, self.tail_bytes)
+        self._tail = deque([(tail, encoded_size(tail))])
+        self._tail_size = self._tail[0][1]
+    
+    def getvalue(self) -> str:
+        if not self.truncated:
+            if len(self._chunks) > 1:
+                self._chunks = ["".join(self._chunks)]
+            return self._chunks[0] if self._chunks else ""
+        tail = _last_bytes("".join(text for text, _ in self._tail), self.tail_bytes)
+        omitted = self.size - encoded_size(self._head) - encoded_size(tail)
+        marker = f"\n... [{omitted} bytes truncated"
+        marker += "; full output available on request] ...\n" if self.spill_path else "] ...\n"
+        return self._head + marker + tail
+    
+    def close(self):
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+def read_spilled_output(path: Path, offset: int, limit: int) -> Dict[str, Any]:
+    # Offsets are byte positions in the uncompressed UTF-8 stream; a page never ends mid-character
+    with gzip.open(path, "rb") as f:
+        f.seek(offset)
+        raw = f.read(limit)
+        eof = not f.read(1)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    text = decoder.decode(raw, final=eof)
+    pending = len(decoder.getstate()[0])
+    consumed = len(raw) - pending
+    return {
+        "offset": offset,
+        "next_offset": offset + consumed,
+        "data": text,
+        "eof": eof and pending == 0
+    }
@@ -0,0 +1,147 @@
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_BATCH_INTERVAL = float(os.getenv("OUTPUT_BATCH_INTERVAL", "0.05"))
+OUTPUT_BATCH_BYTES = int(os.getenv("OUTPUT_BATCH_BYTES", "65536"))
+WS_MAX_PENDING_BYTES = int(os.getenv("WS_MAX_PENDING_BYTES", "4194304"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+def output_size(output: Dict[str, Any]) -> int:
+    if output.get("output_type") == "stream":
+        return len(output.get("text", ""))
+    return len(json.dumps(output))
+
+class OutputBatch:
+    def __init__(self):
+        self.outputs: List[Dict[str, Any]] = []
+        self.size = 0
+    
+    def add(self, output: Dict[str, Any], size: int):
+        last = self.outputs[-1] if self.outputs else None
+        # Consecutive chunks of the same stream collapse into one output
+        if (
+            last is not None
+            and output.get("output_type") == "stream"
+            and last.get("output_type") == "stream"
+            and last.get("cell_id") == output.get("cell_id")
+            and last.get("name") == output.get("name")
+        ):
+            last["text"] += output["text"]
+        else:
+            self.outputs.append(dict(output))
+        self.size += size
+    
+    def frame(self) -> Dict[str, Any]:
+        return {"type": "execution_output", "data": {"outputs": self.outputs}}
+
+class OutputStream:
+    # Per-socket send queue. Control messages keep their order; output chunks are coalesced into
+    # time/size bounded batches, and a client that cannot keep up has stream text dropped
+    # instead of growing server memory without bound.
+    def __init__(
+        self,
+        websocket: WebSocket,
+        batch_interval: float = OUTPUT_BATCH_INTERVAL,
+        batch_bytes: int = OUTPUT_BATCH_BYTES,
+        max_pending_bytes: int = WS_MAX_PENDING_BYTES,
+        send_timeout: float = WS_SEND_TIMEOUT
+    ):
+        self.websocket = websocket
+        self.batch_interval = batch_interval
+        self.batch_bytes = batch_bytes
+        self.max_pending_bytes = max_pending_bytes
+        self.send_timeout = send_timeout
+        self._frames: deque = deque()
+        self._pending_bytes = 0
+        self._dropped: Dict[Any, int] = {}
+        self._wakeup = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+        self.closed = False
+    
+    def start(self):
+        self._sender = asyncio.create_task(self._run())
+    
+    async def close(self):
+        self.closed = True
+        if self._sender and self._sender is not asyncio.current_task():
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
+        self._frames.clear()
+    
+    def send(self, message: Dict[str, Any]):
+        if self.closed:
+            return
+        self._flush_dropped()
+        self._frames.append(message)
+        self._wakeup.set()
+    
+    def send_output(self, output: Dict[str, Any]):
+        if self.closed:
+            return
+        size = output_size(output)
+        if self._pending_bytes + size > self.max_pending_bytes and output.get("output_type") == "stream":
+            key = output.get("cell_id")
+            self._dropped[key] = self._dropped.get(key, 0) + size
+            return
+        self._flush_dropped()
+        batch = self._frames[-1] if self._frames else None
+        if not isinstance(batch, OutputBatch) or batch.size >= self.batch_bytes:
+            batch = OutputBatch()
+            self._frames.append(batch)
+        batch.add(output, size)
+        self._pending_bytes += size
+        self._wakeup.set()
+    
+    def _flush_dropped(self):
+        if not self._dropped:
+            return
+        dropped, self._dropped = self._dropped, {}
+        batch = OutputBatch()
+        for cell_id, size in dropped.items():
+            batch.add({
+                "cell_id": cell_id,
+                "output_type": "stream",
+                "name": "stderr",
+                "text": f"\n[{size} bytes of output dropped: client is receiving too slowly]\n"
+            }, 0)
+        self._frames.append(batch)
+    
+    async def _run(self):
+        try:
+            while not self.closed:
+                if not self._frames:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                head = self._frames[0]
+                if isinstance(head, OutputBatch) and len(self._frames) == 1 and head.size < self.batch_bytes:
+                    # Give fast producers a short window to fill the batch before sending it
+                    await asyncio.sleep(self.batch_interval)
+                    if not self._frames or self._frames[0] is not head:
+                        continue
+                self._frames.popleft()
+                if isinstance(head, OutputBatch):
+                    self._pending_bytes -= head.size
+                    message = head.frame()
+                else:
+                    message = head
+                await asyncio.wait_for(self.websocket.send_text(json.dumps(message)), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("Closing WebSocket: client did not read output within %ss", self.send_timeout)
+            self.closed = True
+            try:
+                await self.websocket.close(code=1013)
+            except Exception:
+                pass
+        except Exception:
+            logger.debug("WebSocket sender stopped", exc_info=True)
+            self.closed = True
@@ -0,0 +1,58 @@
+import json
+import base64
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+from sqlalchemy import Select, tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _encode_value(value: Any):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+def _decode_value(obj: dict):
+    if "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(list(values), default=_encode_value, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, keys: Sequence[Any]) -> List[Any]:
+    # Each value must match its key column's type, so a crafted cursor fails here with a 400
+    # instead of in the database
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw, object_hook=_decode_value)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("Invalid cursor")
+    for key, value in zip(keys, values):
+        expected = key.type.python_type
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            raise ValueError("Invalid cursor")
+    return values
+
+def page_size(limit: Any) -> int:
+    try:
+        return min(max(int(limit), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+
+def keyset_page(query: Select, keys: Sequence[Any], cursor: Optional[str], limit: int) -> Select:
+    # Newest-first keyset pagination: rows strictly after the cursor in (keys...) DESC order.
+    # One extra row is fetched so the caller can tell whether another page exists.
+    if cursor:
+        query = query.filter(tuple_(*keys) < tuple_(*decode_cursor(cursor, keys)))
+    return query.order_by(*(key.desc() for key in keys)).limit(limit + 1)
+
+def finish_page(rows: List[Any], keys: Sequence[str], limit: int) -> tuple:
+    # Returns (rows for this page, cursor for the next page or None)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], key) for key in keys])
@@ -0,0 +1,287 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+from sqlalchemy import select, delete, update, exists, func, and_, or_
+from src.models.database import AsyncSessionLocal, Session, Notebook, Cell, CellTombstone, Execution
+from src.services.metrics import registry
+from src.services.notebook_cache import notebook_cache
+from src.services.upload_store import upload_store
+from src.services.blob_store import blob_store, output_blobs, BLOB_GC_GRACE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() in ("1", "true", "yes")
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_KEEP_PER_CELL = int(os.getenv("RETENTION_KEEP_PER_CELL", "20"))  # 0 keeps every execution
+RETENTION_MAX_AGE_DAYS = float(os.getenv("RETENTION_MAX_AGE_DAYS", "30"))  # 0 disables age-based archival
+RETENTION_ABANDONED_SESSION_DAYS = float(os.getenv("RETENTION_ABANDONED_SESSION_DAYS", "7"))
+RETENTION_ARCHIVE_DIR = Path(os.getenv("RETENTION_ARCHIVE_DIR", "archive"))
+
+_archived = registry.counter("retention_executions_archived_total")
+_compacted = registry.counter("retention_executions_compacted_total")
+_purged = registry.counter("retention_sessions_purged_total")
+_run_latency = registry.histogram("retention_run_seconds", (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning("Could not remove %s", path, exc_info=True)
+
+def _write_archive(path: Path, rows: List[Dict[str, Any]]):
+    # Appends one gzip member per batch; spilled output files move next to the archive
+    outputs_dir = path.parent / "outputs"
+    for row in rows:
+        spill = row.get("output_path")
+        if spill and os.path.exists(spill):
+            outputs_dir.mkdir(parents=True, exist_ok=True)
+            target = outputs_dir / os.path.basename(spill)
+            os.replace(spill, target)
+            row["output_path"] = str(target)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, default=str) + "\n")
+
+async def purge_session(session_id: str, batch_size: int = RETENTION_BATCH_SIZE) -> bool:
+    # Deletes a session with its notebooks, cells and executions; spill files go too
+    async with AsyncSessionLocal() as db:
+        notebook_ids = (await db.scalars(select(Notebook.id).filter(Notebook.session_id == session_id))).all()
+        if not notebook_ids and await db.get(Session, session_id) is None:
+            return False
+        cell_ids = select(Cell.id).filter(Cell.notebook_id.in_(notebook_ids)).scalar_subquery()
+        
+        spill_paths = []
+        while True:
+            rows = (await db.execute(
+                select(Execution.id, Execution.output_path).filter(Execution.cell_id.in_(cell_ids)).limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            spill_paths.extend(row.output_path for row in rows if row.output_path)
+            await db.execute(delete(Execution).where(Execution.id.in_([row.id for row in rows])))
+            await db.commit()
+        
+        if notebook_ids:
+            await db.execute(delete(CellTombstone).where(CellTombstone.notebook_id.in_(notebook_ids)))
+            await db.execute(delete(Cell).where(Cell.notebook_id.in_(notebook_ids)))
+            await db.execute(delete(Notebook).where(Notebook.id.in_(notebook_ids)))
+        await db.execute(delete(Session).where(Session.id == session_id))
+        await db.commit()
+    
+    await asyncio.to_thread(_remove_files, spill_paths)
+    await notebook_cache.invalidate(session_id)
+    _purged.inc()
+    return True
+
+class RetentionJob:
+    # Periodic, batched clean-up: every batch is its own short transaction so no policy holds
+    # locks on the executions table for long
+    def __init__(
+        self,
+        keep_per_cell: int = RETENTION_KEEP_PER_CELL,
+        max_age_days: float = RETENTION_MAX_AGE_DAYS,
+        abandoned_session_days: float = RETENTION_ABANDONED_SESSION_DAYS,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        interval: float = RETENTION_INTERVAL,
+        archive_dir: Path = RETENTION_ARCHIVE_DIR,
+        blob_grace_seconds: float = BLOB_GC_GRACE_SECONDS,
+        is_active: Optional[Callable[[str], Awaitable[bool]]] = None,
+        release: Optional[Callable[[str], Awaitable[Any]]] = None
+    ):
+        self.keep_per_cell = keep_per_cell
+        self.max_age_days = max_age_days
+        self.abandoned_session_days = abandoned_session_days
+        self.batch_size = max(batch_size, 1)
+        self.interval = interval
+        self.archive_dir = archive_dir
+        self.blob_grace_seconds = blob_grace_seconds
+        # True while a session holds a kernel or router claim; such sessions are never purged
+        self.is_active = is_active
+        # Frees a session's kernel, router claim and uploads before its rows go
+        self.release = release
+        self._worker: Optional[asyncio.Task] = None
+        self._stopping = False
+    
+    def start(self):
+        if self._worker and not self._worker.done():
+            return
+        self._stopping = False
+        self._worker = asyncio.create_task(self._maintain())
+    
+    async def shutdown(self):
+        self._stopping = True
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+    
+    async def _maintain(self):
+        while not self._stopping:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Retention run failed")
+            await asyncio.sleep(self.interval)
+    
+    async def run_once(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        archive_path = self.archive_dir / f"executions-{datetime.utcnow():%Y%m%dT%H%M%S}.jsonl.gz"
+        stats = {"sessions_purged": await self._purge_sessions(), "archived": 0}
+        
+        if self.keep_per_cell > 0:
+            stats["archived"] += await self._archive_beyond_latest(archive_path)
+            # Executions detached from deleted cells are never among the latest of any cell
+            stats["archived"] += await self._archive(Execution.cell_id.is_(None), archive_path)
+        if self.max_age_days > 0:
+            cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+            stats["archived"] += await self._archive(Execution.started_at < cutoff, archive_path)
+        stats["compacted"] = await self._compact_logs()
+        stats["stale_uploads"] = await asyncio.to_thread(upload_store.purge_stale)
+        # After the purges above, so blobs of deleted sessions go in the same run
+        stats["blobs"] = await self._collect_blobs()
+        stats["archive"] = str(archive_path) if stats["archived"] else None
+        
+        _run_latency.observe(time.perf_counter() - started)
+        if stats["archived"] or stats["compacted"] or stats["sessions_purged"] or stats["stale_uploads"] or stats["blobs"]["removed"]:
+            logger.info("Retention run: %s", stats)
+        return stats
+    
+    async def _archive(self, condition, archive_path: Path) -> int:
+        # Walks the matching executions in id order, one batch per transaction
+        total = 0
+        last_id = 0
+        while not self._stopping:
+            async with AsyncSessionLocal() as db:
+                batch = (await db.scalars(
+                    select(Execution.id).filter(condition, Execution.id > last_id).order_by(Execution.id).limit(self.batch_size)
+                )).all()
+                if not batch:
+                    break
+                rows = (await db.execute(
+                    select(
+                        Execution.id, Execution.cell_id, Cell.notebook_id, Execution.started_at, Execution.ended_at,
+                        Execution.status, Execution.logs, Execution.output_bytes, Execution.output_truncated,
+                        Execution.output_path
+                    ).outerjoin(Cell, Execution.cell_id == Cell.id).filter(Execution.id.in_(batch))
+                )).all()
+                # Written before the delete commits: a failed batch is archived again, never lost
+                await asyncio.to_thread(_write_archive, archive_path, [dict(row._mapping) for row in rows])
+                await db.execute(delete(Execution).where(Execution.id.in_(batch)))
+                await db.commit()
+            last_id = batch[-1]
+            total += len(batch)
+            _archived.inc(len(batch))
+        return total
+    
+    async def _archive_beyond_latest(self, archive_path: Path) -> int:
+        # Pages through cells with more than keep_per_cell executions by cell id; each cell's
+        # cutoff (the id of its keep_per_cell-th latest execution) is computed once per page,
+        # then everything older is archived by id range
+        total = 0
+        last_cell_id = 0
+        while not self._stopping:
+            async with AsyncSessionLocal() as db:
+                cell_ids = (await db.scalars(
+                    select(Execution.cell_id).filter(Execution.cell_id > last_cell_id)
+                    .group_by(Execution.cell_id).having(func.count() > self.keep_per_cell)
+                    .order_by(Execution.cell_id).limit(self.batch_size)
+                )).all()
+                if not cell_ids:
+                    break
+                ranked = select(
+                    Execution.id,
+                    Execution.cell_id,
+                    func.row_number().over(partition_by=Execution.cell_id, order_by=Execution.id.desc()).label("rank")
+                ).filter(Execution.cell_id.in_(cell_ids)).subquery()
+                cutoffs = (await db.execute(
+                    select(ranked.c.cell_id, ranked.c.id).filter(ranked.c.rank == self.keep_per_cell)
+                )).all()
+            last_cell_id = cell_ids[-1]
+            total += await self._archive(
+                or_(*(and_(Execution.cell_id == row.cell_id, Execution.id < row.id) for row in cutoffs)),
+                archive_path
+            )
+        return total
+    
+    async def _compact_logs(self) -> int:
+        # Output is stored once on the cell; clear the legacy per-execution copy
+        total = 0
+        while not self._stopping:
+            async with AsyncSessionLocal() as db:
+                batch = (await db.scalars(
+                    select(Execution.id).filter(Execution.logs != "").limit(self.batch_size)
+                )).all()
+                if not batch:
+                    break
+                await db.execute(update(Execution).where(Execution.id.in_(batch)).values(logs=""))
+                await db.commit()
+            total += len(batch)
+            _compacted.inc(len(batch))
+        return total
+    
+    async def _purge_sessions(self) -> int:
+        # Ended sessions, and sessions with no activity (a notebook change or an execution) for
+        # abandoned_session_days, whose notebook was never saved
+        conditions = [Session.ended_at.isnot(None)]
+        if self.abandoned_session_days > 0:
+            cutoff = datetime.utcnow() - timedelta(days=self.abandoned_session_days)
+            conditions.append(and_(
+                Session.started_at < cutoff,
+                ~exists().where(Notebook.session_id == Session.id, Notebook.updated_at >= cutoff),
+                ~exists().where(
+                    Notebook.session_id == Session.id, Cell.notebook_id == Notebook.id,
+                    Execution.cell_id == Cell.id, Execution.started_at >= cutoff
+                )
+            ))
+        query = select(Session.id).filter(
+            or_(*conditions),
+            ~exists().where(Notebook.session_id == Session.id, Notebook.is_saved == True)
+        ).order_by(Session.id)
+        
+        total = 0
+        last_id = None
+        while not self._stopping:
+            async with AsyncSessionLocal() as db:
+                page = query if last_id is None else query.filter(Session.id > last_id)
+                session_ids = (await db.scalars(page.limit(self.batch_size))).all()
+            if not session_ids:
+                break
+            last_id = session_ids[-1]
+            for session_id in session_ids:
+                if self.is_active and await self.is_active(session_id):
+                    continue
+                if self.release:
+                    await self.release(session_id)
+                if await purge_session(session_id, self.batch_size):
+                    total += 1
+        return total
+    
+    async def _collect_blobs(self) -> Dict[str, int]:
+        # Mark: every hash referenced by a cell, read one batch of cells at a time. Sweep:
+        # unreferenced blobs past the grace period. A partial mark must never be swept.
+        referenced = set()
+        last_id = 0
+        while True:
+            if self._stopping:
+                return {"removed": 0, "removed_bytes": 0, "kept": 0}
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(Cell.id, Cell.outputs).filter(Cell.id > last_id, Cell.outputs.isnot(None)).order_by(Cell.id).limit(self.batch_size)
+                )).all()
+            if not rows:
+                break
+            for row in rows:
+                referenced.update(output_blobs(row.outputs))
+            last_id = rows[-1].id
+        return await asyncio.to_thread(blob_store.sweep, referenced, self.blob_grace_seconds)
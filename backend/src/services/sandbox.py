@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import time
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+from src.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "10"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "512"))
+SANDBOX_WALL_TIMEOUT = float(os.getenv("SANDBOX_WALL_TIMEOUT", "30"))
+SANDBOX_MAX_JOBS_PER_WORKER = int(os.getenv("SANDBOX_MAX_JOBS_PER_WORKER", "50"))
+SANDBOX_MAX_OUTPUT_BYTES = int(os.getenv("SANDBOX_MAX_OUTPUT_BYTES", "1048576"))
+
+WORKER_SCRIPT = Path(__file__).resolve().with_name("sandbox_worker.py")
+# Passed through to workers; everything else in the server's environment (database and Redis
+# credentials included) stays out of reach of user code
+SANDBOX_ENV_KEYS = ("PATH", "LANG", "LC_ALL", "LC_CTYPE", "TZ", "SYSTEMROOT")
+
+class SandboxWorker:
+    def __init__(self, proc: asyncio.subprocess.Process, workdir: str, session_id: Optional[str]):
+        self.proc = proc
+        self.workdir = workdir
+        # Workers only ever run jobs of the session they were started for
+        self.session_id = session_id
+        self.jobs = 0
+    
+    @property
+    def alive(self) -> bool:
+        return self.proc.returncode is None
+    
+    async def stop(self):
+        if self.alive:
+            self.proc.kill()
+        await self.proc.wait()
+        await asyncio.to_thread(shutil.rmtree, self.workdir, True)
+
+class SandboxPool:
+    # Stateless execution in separate, resource-limited processes. Each worker runs one job at a
+    # time with its own stdout/stderr capture, belongs to a single session and is replaced after
+    # max_jobs to bound leaks. A worker whose job did not finish cleanly is killed, never reused.
+    def __init__(
+        self,
+        size: int = SANDBOX_WORKERS,
+        cpu_seconds: int = SANDBOX_CPU_SECONDS,
+        memory_mb: int = SANDBOX_MEMORY_MB,
+        wall_timeout: float = SANDBOX_WALL_TIMEOUT,
+        max_jobs: int = SANDBOX_MAX_JOBS_PER_WORKER,
+        max_output: int = SANDBOX_MAX_OUTPUT_BYTES
+    ):
+        self.size = max(size, 1)
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.wall_timeout = wall_timeout
+        self.max_jobs = max_jobs
+        self.max_output = max_output
+        self._idle: List[SandboxWorker] = []
+        self._total = 0
+        self._available: Optional[asyncio.Condition] = None
+        
+        self._run_latency = registry.histogram("sandbox_run_seconds")
+        self._recycled = registry.counter("sandbox_workers_recycled_total")
+        self._killed = registry.counter("sandbox_workers_killed_total")
+        registry.gauge("sandbox_workers_idle", lambda: len(self._idle))
+        registry.gauge("sandbox_workers_total", lambda: self._total)
+    
+    async def _spawn(self, session_id: Optional[str]) -> SandboxWorker:
+        # Isolated mode (-I) ignores PYTHON* variables and keeps the backend off sys.path; the
+        # worker starts in a throwaway directory that is removed with it
+        workdir = await asyncio.to_thread(tempfile.mkdtemp, prefix="sandbox-")
+        env = {key: os.environ[key] for key in SANDBOX_ENV_KEYS if key in os.environ}
+        env.update(HOME=workdir, TMPDIR=workdir)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, "-I", str(WORKER_SCRIPT),
+                "--cpu-seconds", str(self.cpu_seconds),
+                "--memory-mb", str(self.memory_mb),
+                "--max-output", str(self.max_output),
+                cwd=workdir,
+                env=env,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                # stdout and stderr are capped at max_output UTF-8 bytes each in the worker; JSON
+                # escaping expands a byte to at most six (a control character as \u00XX)
+                limit=self.max_output * 12 + 65536
+            )
+        except Exception:
+            await asyncio.to_thread(shutil.rmtree, workdir, True)
+            raise
+        return SandboxWorker(proc, workdir, session_id)
+    
+    async def _acquire(self, session_id: Optional[str]) -> SandboxWorker:
+        if self._available is None:
+            self._available = asyncio.Condition()
+        victim = None
+        async with self._available:
+            while True:
+                if session_id:
+                    for worker in self._idle:
+                        if worker.session_id == session_id:
+                            self._idle.remove(worker)
+                            return worker
+                if self._total < self.size:
+                    self._total += 1
+                    break
+                if self._idle:
+                    # Full: the oldest idle worker of another session hands over its slot
+                    victim = self._idle.pop(0)
+                    break
+                await self._available.wait()
+        if victim is not None:
+            self._recycled.inc()
+            await victim.stop()
+        try:
+            return await self._spawn(session_id)
+        except Exception:
+            await self._discard()
+            raise
+    
+    async def _release(self, worker: SandboxWorker):
+        # Jobs without a session never share a worker
+        if not worker.alive or worker.jobs >= self.max_jobs or not worker.session_id:
+            if worker.alive:
+                self._recycled.inc()
+            await worker.stop()
+            await self._discard()
+            return
+        async with self._available:
+            self._idle.append(worker)
+            self._available.notify()
+    
+    async def _discard(self):
+        async with self._available:
+            self._total -= 1
+            self._available.notify()
+    
+    async def run(self, code: str, timeout: Optional[float] = None, session_id: Optional[str] = None) -> tuple:
+        started = time.perf_counter()
+        timeout = float(timeout) if timeout else self.wall_timeout
+        worker = await self._acquire(session_id)
+        worker.jobs += 1
+        clean = False
+        try:
+            worker.proc.stdin.write(json.dumps({"code": code}).encode("utf-8") + b"\n")
+            await worker.proc.stdin.drain()
+            line = await asyncio.wait_for(worker.proc.stdout.readline(), timeout)
+            if not line:
+                await worker.proc.wait()
+                self._killed.inc()
+                return "", f"Sandbox worker terminated (exit code {worker.proc.returncode})", "error"
+            result = json.loads(line)
+            clean = True
+            return result["output"], result["error"], result["status"]
+        except asyncio.TimeoutError:
+            return "", f"Execution exceeded the {timeout:g}s wall-clock limit and was killed", "error"
+        except (BrokenPipeError, ConnectionResetError):
+            return "", "Sandbox worker terminated unexpectedly", "error"
+        finally:
+            # Timeouts, cancellation and protocol errors leave the worker mid-job
+            if not clean and worker.alive:
+                self._killed.inc()
+                await worker.stop()
+            await self._release(worker)
+            self._run_latency.observe(time.perf_counter() - started)
+    
+    async def shutdown(self):
+        workers, self._idle = self._idle, []
+        await asyncio.gather(*(worker.stop() for worker in workers), return_exceptions=True)
+        self._total -= len(workers)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"idle": len(self._idle), "total": self._total, "size": self.size}
@@ -0,0 +1,108 @@
+import os
+import sys
+import io
+import json
+import signal
+import resource
+import argparse
+import traceback
+
+# Runs as a standalone child process (python -I path/to/sandbox_worker.py). Jobs arrive as
+# JSON lines on stdin and results leave as JSON lines on a private copy of stdout, so nothing
+# user code prints at the file-descriptor level can corrupt the protocol.
+
+class CpuLimitExceeded(BaseException):
+    pass
+
+class BoundedWriter(io.TextIOBase):
+    # Keeps the first limit bytes of UTF-8, so the reply line the parent reads stays bounded
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size = 0
+        self.chunks = []
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, text: str) -> int:
+        data = text.encode("utf-8", errors="replace")
+        if self.size < self.limit:
+            # A character cut in half at the limit is dropped
+            self.chunks.append(data[:self.limit - self.size].decode("utf-8", errors="ignore"))
+        self.size += len(data)
+        return len(text)
+    
+    def getvalue(self) -> str:
+        value = "".join(self.chunks)
+        if self.size > self.limit:
+            value += f"\n... [{self.size - self.limit} bytes truncated] ...\n"
+        return value
+
+def _on_cpu_limit(signum, frame):
+    raise CpuLimitExceeded()
+
+def _cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def run_job(code: str, cpu_seconds: int, max_output: int) -> dict:
+    stdout = BoundedWriter(max_output)
+    stderr = BoundedWriter(max_output)
+    # RLIMIT_CPU is cumulative per process, so each job gets a budget on top of what was used
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(_cpu_time()) + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    
+    status = "completed"
+    real_stdout, real_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        exec(compile(code, "<cell>", "exec"), {"__builtins__": __builtins__, "__name__": "__main__"})
+    except CpuLimitExceeded:
+        status = "error"
+        stderr.write(f"CPU time limit of {cpu_seconds}s exceeded\n")
+    except MemoryError:
+        status = "error"
+        stderr.write("Memory limit exceeded\n")
+    except BaseException as e:
+        status = "error"
+        # Drop this module's frame so the traceback starts at the user's code
+        stderr.write("".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next)))
+    finally:
+        sys.stdout, sys.stderr = real_stdout, real_stderr
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+    
+    error = stderr.getvalue()
+    if error:
+        status = "error"
+    return {"output": stdout.getvalue(), "error": error, "status": status}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cpu-seconds", type=int, default=10)
+    parser.add_argument("--memory-mb", type=int, default=512)
+    parser.add_argument("--max-output", type=int, default=1048576)
+    args = parser.parse_args()
+    
+    protocol_in = sys.stdin.buffer
+    protocol_out = os.fdopen(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    sys.stdin = open(os.devnull)
+    
+    if args.memory_mb > 0:
+        limit = args.memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    
+    for line in protocol_in:
+        job = json.loads(line)
+        result = run_job(job["code"], args.cpu_seconds, args.max_output)
+        protocol_out.write(json.dumps(result).encode("utf-8") + b"\n")
+        protocol_out.flush()
+
+if __name__ == "__main__":
+    main()
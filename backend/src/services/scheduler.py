@@ -0,0 +1,230 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from src.services.metrics import registry
+from src.services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_MAX_CONCURRENT = int(os.getenv("EXECUTION_MAX_CONCURRENT", "8"))
+EXECUTION_MAX_QUEUED_PER_SESSION = int(os.getenv("EXECUTION_MAX_QUEUED_PER_SESSION", "50"))
+# Dispatch turns per round for each priority, highest first; lower levels still get their turns
+EXECUTION_PRIORITY_WEIGHTS = os.getenv("EXECUTION_PRIORITY_WEIGHTS", "high=4,normal=2,low=1")
+
+def parse_weights(spec: str) -> Dict[str, int]:
+    weights = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip():
+            weights[name.strip()] = max(int(weight or 1), 1)
+    return weights
+
+class Job:
+    def __init__(self, session_id: str, priority: str, run: Callable[[], Awaitable[Dict[str, Any]]], action: str, cell_id=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.priority = priority
+        self.run = run
+        self.action = action
+        self.cell_id = cell_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.interrupted = False
+        # The job runs in its submitter's context, not in that of whichever job freed its slot
+        self.context = contextvars.copy_context()
+    
+    def describe(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "job_id": self.id,
+            "action": self.action,
+            "cell_id": self.cell_id,
+            "priority": self.priority,
+            "state": "running" if self.started_at is not None else "queued",
+            "waited": round((self.started_at or now) - self.enqueued_at, 3),
+            "running_for": round(now - self.started_at, 3) if self.started_at is not None else None
+        }
+
+class ExecutionScheduler:
+    # Sits in front of the kernels. Each session has a FIFO queue and runs one job at a time,
+    # as its kernel would anyway. Sessions whose next job is waiting sit in a ring per priority;
+    # free slots under the global limit go round-robin through the ring of the priority whose
+    # turn it is, so one session's backlog cannot hold up everyone else's first cell.
+    # All state is touched only from the event loop.
+    def __init__(
+        self,
+        interrupt: Callable[[str], Awaitable[bool]],
+        max_concurrent: int = EXECUTION_MAX_CONCURRENT,
+        max_queued: int = EXECUTION_MAX_QUEUED_PER_SESSION,
+        weights: Optional[Dict[str, int]] = None
+    ):
+        self.interrupt_kernel = interrupt
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_queued = max(max_queued, 1)
+        weights = weights or parse_weights(EXECUTION_PRIORITY_WEIGHTS)
+        self.priorities = list(weights)
+        self._turns = self._build_turns(weights)
+        self._turn = 0
+        self._queues: Dict[str, Deque[Job]] = {}
+        self._running: Dict[str, Job] = {}
+        self._ready: Dict[str, Deque[str]] = {priority: deque() for priority in self.priorities}
+        self._tasks = set()
+        
+        self._wait = registry.histogram("scheduler_wait_seconds", (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+        self._run_time = registry.histogram("scheduler_run_seconds", (0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+        self._rejected = registry.counter("scheduler_rejected_total")
+        self._cancelled = registry.counter("scheduler_cancelled_total")
+        self._interrupts = registry.counter("scheduler_interrupts_total")
+        registry.gauge("scheduler_running", lambda: len(self._running))
+        registry.gauge("scheduler_queue_depth", lambda: sum(len(queue) for queue in self._queues.values()))
+        registry.gauge("scheduler_sessions_waiting", lambda: sum(len(ring) for ring in self._ready.values()))
+        for priority in self.priorities:
+            registry.gauge(f"scheduler_queue_depth_{priority}", lambda p=priority: sum(
+                1 for queue in self._queues.values() for job in queue if job.priority == p
+            ))
+    
+    @staticmethod
+    def _build_turns(weights: Dict[str, int]) -> List[str]:
+        # high=4,normal=2,low=1 -> high normal low high normal high high
+        turns = []
+        remaining = dict(weights)
+        while any(remaining.values()):
+            for priority, left in remaining.items():
+                if left:
+                    turns.append(priority)
+                    remaining[priority] = left - 1
+        return turns
+    
+    def normalize_priority(self, priority: Optional[str], default: str) -> str:
+        if priority in self._ready:
+            return priority
+        return default if default in self._ready else self.priorities[len(self.priorities) // 2]
+    
+    async def submit(
+        self,
+        session_id: str,
+        run: Callable[[], Awaitable[Dict[str, Any]]],
+        priority: str,
+        action: str,
+        cell_id=None
+    ) -> Dict[str, Any]:
+        queue = self._queues.setdefault(session_id, deque())
+        if len(queue) >= self.max_queued:
+            self._rejected.inc()
+            return {"error": "Too many executions queued for this session", "status": "queue_full"}
+        with span("scheduler", priority=priority) as current:
+            job = Job(session_id, priority, run, action, cell_id)
+            queue.append(job)
+            if len(queue) == 1 and session_id not in self._running:
+                self._ready[priority].append(session_id)
+            self._dispatch()
+            # The job keeps its place even if the caller goes away
+            result = await asyncio.shield(job.future)
+            current.set(waited=round(job.started_at - job.enqueued_at, 6) if job.started_at is not None else None)
+        return result
+    
+    def _next_session(self) -> Optional[str]:
+        for step in range(len(self._turns)):
+            priority = self._turns[(self._turn + step) % len(self._turns)]
+            if self._ready[priority]:
+                self._turn = (self._turn + step + 1) % len(self._turns)
+                return self._ready[priority].popleft()
+        return None
+    
+    def _dispatch(self):
+        while len(self._running) < self.max_concurrent:
+            session_id = self._next_session()
+            if session_id is None:
+                return
+            job = self._queues[session_id].popleft()
+            job.started_at = time.monotonic()
+            self._wait.observe(job.started_at - job.enqueued_at)
+            self._running[session_id] = job
+            task = asyncio.create_task(self._run(job), context=job.context)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, job: Job):
+        try:
+            result = await job.run()
+        except Exception as e:
+            logger.exception("Scheduled %s failed", job.action)
+            result = {"error": str(e), "status": "error"}
+        finally:
+            self._run_time.observe(time.monotonic() - job.started_at)
+            del self._running[job.session_id]
+            self._requeue(job.session_id)
+            self._dispatch()
+        if job.interrupted and isinstance(result, dict):
+            result["interrupted"] = True
+        if not job.future.done():
+            job.future.set_result(result)
+    
+    def _requeue(self, session_id: str):
+        # Put the session back in the ring of its next job's priority, or forget it
+        for ring in self._ready.values():
+            if session_id in ring:
+                ring.remove(session_id)
+        queue = self._queues.get(session_id)
+        if not queue:
+            self._queues.pop(session_id, None)
+        elif session_id not in self._running:
+            self._ready[queue[0].priority].append(session_id)
+    
+    async def interrupt(self, session_id: str) -> Dict[str, Any]:
+        job = self._running.get(session_id)
+        if job is None:
+            return {"status": "idle"}
+        job.interrupted = True
+        self._interrupts.inc()
+        if not await self.interrupt_kernel(session_id):
+            return {"status": "idle"}
+        return {"status": "interrupted", "job": job.describe()}
+    
+    async def cancel(self, session_id: str, job_id: Optional[str] = None, cell_id=None) -> Dict[str, Any]:
+        # Drops matching queued jobs and interrupts the running one if it matches; with no
+        # filter, the session's whole queue is cleared
+        def matches(job: Job) -> bool:
+            if job_id is not None:
+                return job.id == job_id
+            if cell_id is not None:
+                return job.cell_id is not None and str(job.cell_id) == str(cell_id)
+            return True
+        
+        cancelled = []
+        queue = self._queues.get(session_id, deque())
+        for job in [job for job in queue if matches(job)]:
+            queue.remove(job)
+            cancelled.append(job.id)
+            if not job.future.done():
+                job.future.set_result({"error": "Execution cancelled before it started", "status": "cancelled", "job_id": job.id})
+        self._cancelled.inc(len(cancelled))
+        self._requeue(session_id)
+        
+        interrupted = None
+        running = self._running.get(session_id)
+        if running is not None and matches(running):
+            interrupted = (await self.interrupt(session_id)).get("job")
+        return {"status": "cancelled" if cancelled or interrupted else "idle", "cancelled": cancelled, "interrupted": interrupted}
+    
+    def snapshot(self, session_id: str) -> Dict[str, Any]:
+        running = self._running.get(session_id)
+        return {
+            "running": running.describe() if running else None,
+            "queued": [job.describe() for job in self._queues.get(session_id, ())]
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": len(self._running),
+            "max_concurrent": self.max_concurrent,
+            "queued": {priority: sum(
+                1 for queue in self._queues.values() for job in queue if job.priority == priority
+            ) for priority in self.priorities}
+        }
@@ -0,0 +1,381 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from typing import Dict, Any, Awaitable, Callable, Iterable, List, Optional, Set
+from src.services.metrics import registry
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+SESSION_OWNER_TTL = float(os.getenv("SESSION_OWNER_TTL", "30"))
+ROUTER_HEARTBEAT_INTERVAL = float(os.getenv("ROUTER_HEARTBEAT_INTERVAL", "10"))
+ROUTER_ACK_TIMEOUT = float(os.getenv("ROUTER_ACK_TIMEOUT", "5"))
+ROUTER_REQUEST_TIMEOUT = float(os.getenv("ROUTER_REQUEST_TIMEOUT", "360"))
+
+Handler = Callable[[Dict[str, Any]], None]
+
+class MemoryBus:
+    # Single-process stand-in for Redis: the same registry and pub/sub semantics, with messages
+    # round-tripped through JSON so anything that works here also serializes for Redis. Several
+    # routers sharing one MemoryBus behave like workers sharing a Redis server.
+    def __init__(self):
+        self._keys: Dict[str, tuple] = {}
+        self._channels: Dict[str, Set[Handler]] = {}
+    
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._keys.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._keys[key]
+            return None
+        return entry[0]
+    
+    async def claim(self, key: str, worker_id: str, ttl: float) -> str:
+        owner = self._live(key)
+        if owner is None:
+            self._keys[key] = (worker_id, time.monotonic() + ttl)
+            return worker_id
+        return owner
+    
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+    
+    async def replace(self, key: str, expected: Optional[str], worker_id: str, ttl: float) -> bool:
+        if self._live(key) != expected:
+            return False
+        self._keys[key] = (worker_id, time.monotonic() + ttl)
+        return True
+    
+    async def refresh(self, keys: Iterable[str], worker_id: str, ttl: float) -> List[str]:
+        # Returns the keys this worker still owns
+        kept = []
+        for key in keys:
+            if self._live(key) == worker_id:
+                self._keys[key] = (worker_id, time.monotonic() + ttl)
+                kept.append(key)
+        return kept
+    
+    async def release(self, key: str, worker_id: str):
+        if self._live(key) == worker_id:
+            del self._keys[key]
+    
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        payload = json.dumps(message)
+        for handler in list(self._channels.get(channel, ())):
+            try:
+                handler(json.loads(payload))
+            except Exception:
+                logger.exception("Bus handler for %s failed", channel)
+    
+    async def subscribe(self, channel: str, handler: Handler):
+        self._channels.setdefault(channel, set()).add(handler)
+    
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self._channels.get(channel)
+        if handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self._channels[channel]
+    
+    async def close(self):
+        pass
+
+class RedisBus:
+    # Registry keys are compare-and-set through Lua so a worker only extends or drops keys it owns
+    REPLACE = "if redis.call('get', KEYS[1]) == (ARGV[1] ~= '' and ARGV[1] or false) then " \
+              "redis.call('set', KEYS[1], ARGV[2], 'PX', ARGV[3]) return 1 end return 0"
+    REFRESH = "if redis.call('get', KEYS[1]) == ARGV[1] then redis.call('pexpire', KEYS[1], ARGV[2]) return 1 end return 0"
+    RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    
+    def __init__(self, url: str = "", prefix: str = "router:", client=None):
+        # client must decode responses
+        self.client = client if client is not None else redis_asyncio.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._pubsub = self.client.pubsub()
+        self._handlers: Dict[str, Set[Handler]] = {}
+        self._reader: Optional[asyncio.Task] = None
+        self._closing = False
+        self._replace = self.client.register_script(self.REPLACE)
+        self._refresh = self.client.register_script(self.REFRESH)
+        self._release = self.client.register_script(self.RELEASE)
+    
+    async def claim(self, key: str, worker_id: str, ttl: float) -> str:
+        if await self.client.set(self.prefix + key, worker_id, nx=True, px=int(ttl * 1000)):
+            return worker_id
+        owner = await self.client.get(self.prefix + key)
+        # The key expired between the two calls; try once more
+        return owner if owner is not None else await self.claim(key, worker_id, ttl)
+    
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(self.prefix + key)
+    
+    async def replace(self, key: str, expected: Optional[str], worker_id: str, ttl: float) -> bool:
+        return bool(await self._replace(keys=[self.prefix + key], args=[expected or "", worker_id, int(ttl * 1000)]))
+    
+    async def refresh(self, keys: Iterable[str], worker_id: str, ttl: float) -> List[str]:
+        keys = list(keys)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                await self._refresh(keys=[self.prefix + key], args=[worker_id, int(ttl * 1000)], client=pipe)
+            results = await pipe.execute()
+        return [key for key, kept in zip(keys, results) if kept]
+    
+    async def release(self, key: str, worker_id: str):
+        await self._release(keys=[self.prefix + key], args=[worker_id])
+    
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        await self.client.publish(self.prefix + channel, json.dumps(message))
+    
+    async def subscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.setdefault(channel, set())
+        handlers.add(handler)
+        if len(handlers) == 1:
+            await self._pubsub.subscribe(self.prefix + channel)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+    
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self._handlers.get(channel)
+        if handlers is None:
+            return
+        handlers.discard(handler)
+        if not handlers:
+            del self._handlers[channel]
+            await self._pubsub.unsubscribe(self.prefix + channel)
+    
+    async def _read(self):
+        while not self._closing:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The client may surface cancellation as a connection error
+                if self._closing:
+                    break
+                logger.exception("Redis bus reader failed; retrying")
+                await asyncio.sleep(1)
+                continue
+            if message is None or message.get("type") != "message":
+                continue
+            channel = message["channel"][len(self.prefix):]
+            payload = json.loads(message["data"])
+            for handler in list(self._handlers.get(channel, ())):
+                try:
+                    handler(payload)
+                except Exception:
+                    logger.exception("Bus handler for %s failed", channel)
+    
+    async def close(self):
+        self._closing = True
+        if self._reader:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+        await self._pubsub.aclose()
+        await self.client.aclose()
+
+def make_bus():
+    if REDIS_URL:
+        if redis_asyncio is None:
+            # An in-process bus would route each worker's sessions on its own, silently
+            raise RuntimeError("REDIS_URL is set but the redis package is not installed (pip install 'redis>=5')")
+        return RedisBus(REDIS_URL)
+    return MemoryBus()
+
+class SessionRouter:
+    # Session affinity across workers. The registry maps kernel:{session} and socket:{session}
+    # to the worker that holds them; owners keep their keys alive with heartbeats, so a dead
+    # worker's sessions are claimed by the next worker that needs them. Kernel requests are
+    # forwarded to the owner over its worker:{id} channel, and execution events are published
+    # on events:{session} for whichever worker holds the session's WebSocket.
+    def __init__(
+        self,
+        bus=None,
+        worker_id: str = WORKER_ID,
+        owner_ttl: float = SESSION_OWNER_TTL,
+        heartbeat_interval: float = ROUTER_HEARTBEAT_INTERVAL,
+        ack_timeout: float = ROUTER_ACK_TIMEOUT,
+        request_timeout: float = ROUTER_REQUEST_TIMEOUT
+    ):
+        self.bus = bus if bus is not None else make_bus()
+        self.worker_id = worker_id
+        self.owner_ttl = owner_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.ack_timeout = ack_timeout
+        self.request_timeout = request_timeout
+        self.handler: Optional[Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = None
+        self.is_active: Callable[[str], bool] = lambda session_id: False
+        
+        self._kernels: Dict[str, float] = {}  # session_id -> claimed at
+        self._sockets: Dict[str, Handler] = {}
+        self._waiting: Dict[str, Dict[str, asyncio.Future]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.started = False
+        
+        self._forwarded = registry.counter("router_forwarded_total")
+        self._served = registry.counter("router_served_total")
+        self._takeovers = registry.counter("router_takeovers_total")
+        self._events = registry.counter("router_events_published_total")
+        self._forward_latency = registry.histogram("router_forward_seconds", (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 360.0))
+        registry.gauge("router_owned_kernels", lambda: len(self._kernels))
+        registry.gauge("router_local_sockets", lambda: len(self._sockets))
+    
+    async def start(self, handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]], is_active: Callable[[str], bool]):
+        # handler runs a forwarded request locally; is_active says whether this worker still
+        # holds a kernel for a session, which decides whether its ownership is renewed
+        self.handler = handler
+        self.is_active = is_active
+        await self.bus.subscribe(f"worker:{self.worker_id}", self._on_message)
+        self._heartbeat = asyncio.create_task(self._beat())
+        self.started = True
+    
+    async def shutdown(self):
+        if not self.started:
+            return
+        self.started = False
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for session_id in list(self._kernels):
+            await self.bus.release(f"kernel:{session_id}", self.worker_id)
+        for session_id in list(self._sockets):
+            await self.bus.release(f"socket:{session_id}", self.worker_id)
+        await self.bus.unsubscribe(f"worker:{self.worker_id}", self._on_message)
+        await self.bus.close()
+    
+    async def route(self, session_id: str) -> Optional[str]:
+        # None when this worker owns (or has just claimed) the session's kernel
+        if not self.started:
+            return None
+        if session_id in self._kernels:
+            return None
+        owner = await self.bus.claim(f"kernel:{session_id}", self.worker_id, self.owner_ttl)
+        if owner == self.worker_id:
+            self._kernels[session_id] = time.monotonic()
+            return None
+        return owner
+    
+    async def forward(self, owner: str, request: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        request_id = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        waiting = {"ack": loop.create_future(), "reply": loop.create_future()}
+        self._waiting[request_id] = waiting
+        self._forwarded.inc()
+        try:
+            await self.bus.publish(f"worker:{owner}", {
+                "type": "request", "id": request_id, "reply_to": self.worker_id, "request": request
+            })
+            try:
+                await asyncio.wait_for(asyncio.shield(waiting["ack"]), self.ack_timeout)
+            except asyncio.TimeoutError:
+                # The owner did not answer: take the session over unless someone else already has
+                if await self.bus.replace(f"kernel:{session_id}", owner, self.worker_id, self.owner_ttl):
+                    logger.warning("Worker %s did not answer; taking over session %s", owner, session_id)
+                    self._takeovers.inc()
+                    self._kernels[session_id] = time.monotonic()
+                    return await self.handler(request)
+                new_owner = await self.route(session_id)
+                if new_owner is None:
+                    return await self.handler(request)
+                if new_owner == owner:
+                    return {"error": f"Worker {owner} holding the session did not respond", "status": "error"}
+                return await self.forward(new_owner, request, session_id)
+            try:
+                return await asyncio.wait_for(waiting["reply"], self.request_timeout)
+            except asyncio.TimeoutError:
+                return {"error": "Timed out waiting for the worker holding the session", "status": "error"}
+        finally:
+            self._waiting.pop(request_id, None)
+            self._forward_latency.observe(time.perf_counter() - started)
+    
+    async def release(self, session_id: str):
+        if self._kernels.pop(session_id, None) is not None:
+            await self.bus.release(f"kernel:{session_id}", self.worker_id)
+    
+    async def owner(self, session_id: str) -> Dict[str, Optional[str]]:
+        return {
+            "kernel": await self.bus.get(f"kernel:{session_id}"),
+            "socket": await self.bus.get(f"socket:{session_id}")
+        }
+    
+    async def attach_socket(self, session_id: str, deliver: Handler):
+        previous = self._sockets.get(session_id)
+        if previous is not None:
+            await self.bus.unsubscribe(f"events:{session_id}", previous)
+        self._sockets[session_id] = deliver
+        await self.bus.subscribe(f"events:{session_id}", deliver)
+        await self.bus.replace(f"socket:{session_id}", await self.bus.get(f"socket:{session_id}"), self.worker_id, self.owner_ttl)
+    
+    async def detach_socket(self, session_id: str, deliver: Handler):
+        if self._sockets.get(session_id) is not deliver:
+            return
+        del self._sockets[session_id]
+        await self.bus.unsubscribe(f"events:{session_id}", deliver)
+        await self.bus.release(f"socket:{session_id}", self.worker_id)
+    
+    async def publish_event(self, session_id: str, event: Dict[str, Any]):
+        if not self.started:
+            return
+        self._events.inc()
+        await self.bus.publish(f"events:{session_id}", event)
+    
+    def _on_message(self, message: Dict[str, Any]):
+        kind = message.get("type")
+        if kind == "request":
+            task = asyncio.create_task(self._serve(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return
+        waiting = self._waiting.get(message.get("id"))
+        if waiting is None:
+            return
+        future = waiting.get(kind)
+        if future is not None and not future.done():
+            future.set_result(message.get("result"))
+    
+    async def _serve(self, message: Dict[str, Any]):
+        reply_to = f"worker:{message['reply_to']}"
+        await self.bus.publish(reply_to, {"type": "ack", "id": message["id"]})
+        self._served.inc()
+        try:
+            result = await self.handler(message["request"])
+        except Exception as e:
+            logger.exception("Forwarded request failed")
+            result = {"error": str(e), "status": "error"}
+        await self.bus.publish(reply_to, {"type": "reply", "id": message["id"], "result": result})
+    
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                now = time.monotonic()
+                # Keep kernels that are alive here or were claimed too recently to have started
+                for session_id, claimed_at in list(self._kernels.items()):
+                    if not self.is_active(session_id) and now - claimed_at > self.owner_ttl:
+                        await self.release(session_id)
+                kept = await self.bus.refresh([f"kernel:{s}" for s in self._kernels], self.worker_id, self.owner_ttl)
+                for key in {f"kernel:{s}" for s in self._kernels} - set(kept):
+                    self._kernels.pop(key.split(":", 1)[1], None)
+                await self.bus.refresh([f"socket:{s}" for s in self._sockets], self.worker_id, self.owner_ttl)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Session router heartbeat failed")
+
+session_router = SessionRouter()
@@ -0,0 +1,216 @@
+import os
+import time
+import uuid
+import inspect
+import logging
+import functools
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+from src.services.metrics import registry, METRICS_ENABLED
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "1.0"))
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_span_seconds = registry.histogram("span_seconds", description="Duration of traced request stages", labels=("span",))
+_tracer = otel_trace.get_tracer("notebook-backend") if otel_trace is not None and TRACING_ENABLED else None
+
+class _NoopSpan:
+    # Shared by every call site while tracing is off, so a disabled span is one attribute lookup
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+    
+    def set(self, **attributes):
+        pass
+
+_NOOP = _NoopSpan()
+
+class Span:
+    # Spans nest through a context variable, which asyncio copies into tasks, so stages running
+    # in the scheduler or a kernel drain are attached to the request that started them.
+    # Finished root spans are kept in a ring buffer; spans are also sent to OpenTelemetry when
+    # it is installed and configured (e.g. by running under opentelemetry-instrument).
+    __slots__ = ("name", "attributes", "children", "trace_id", "parent", "started", "duration", "_token", "_otel")
+    
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.children: List[Span] = []
+        self.duration: Optional[float] = None
+        self._otel = None
+    
+    def __enter__(self):
+        self.parent = _current.get()
+        self.trace_id = self.parent.trace_id if self.parent is not None else uuid.uuid4().hex
+        self._token = _current.set(self)
+        if _tracer is not None:
+            self._otel = _tracer.start_as_current_span(self.name, attributes={
+                key: value for key, value in self.attributes.items() if isinstance(value, (str, bool, int, float))
+            })
+            self._otel.__enter__()
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        if self._otel is not None:
+            self._otel.__exit__(exc_type, exc, tb)
+        _span_seconds.labels(span=self.name).observe(self.duration)
+        if self.parent is not None:
+            self.parent.children.append(self)
+        else:
+            traces.add(self)
+        return False
+    
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children]
+        }
+
+def span(name: str, **attributes):
+    if not TRACING_ENABLED:
+        return _NOOP
+    return Span(name, attributes)
+
+def record_span(name: str, started: float, duration: float, **attributes):
+    # For stages timed by callbacks rather than a with block, such as database queries
+    parent = _current.get()
+    if not TRACING_ENABLED or parent is None:
+        return
+    finished = Span(name, attributes)
+    finished.trace_id = parent.trace_id
+    finished.started = started
+    finished.duration = duration
+    parent.children.append(finished)
+    _span_seconds.labels(span=name).observe(duration)
+
+class TraceBuffer:
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self._traces: deque = deque(maxlen=size)
+    
+    def add(self, root: Span):
+        self._traces.append(root)
+        if root.duration >= TRACE_SLOW_SECONDS:
+            stages = ", ".join(f"{child.name}={child.duration * 1000:.1f}ms" for child in root.children)
+            logger.info("Slow request %s took %.1fms: %s", root.name, root.duration * 1000, stages)
+    
+    def recent(self, limit: int = 50, min_ms: float = 0) -> List[Dict[str, Any]]:
+        roots = [root for root in reversed(self._traces) if root.duration * 1000 >= min_ms][:limit]
+        return [{"trace_id": root.trace_id, **root.to_dict()} for root in roots]
+
+traces = TraceBuffer()
+
+_agent_seconds = registry.histogram("agent_seconds", description="Time spent in each agent", labels=("agent",))
+
+def instrument_agent(name: str, handler: Callable) -> Callable:
+    # Times an agent's process() for both the graph and direct dispatch; a no-op when disabled
+    if not METRICS_ENABLED and not TRACING_ENABLED:
+        return handler
+    histogram = _agent_seconds.labels(agent=name)
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def timed(state):
+            started = time.perf_counter()
+            with span(f"agent.{name}"):
+                try:
+                    return await handler(state)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+        return timed
+    
+    @functools.wraps(handler)
+    def timed_sync(state):
+        started = time.perf_counter()
+        with span(f"agent.{name}"):
+            try:
+                return handler(state)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+    return timed_sync
+
+_db_query_seconds = registry.histogram(
+    "db_query_seconds", (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+    description="Database statement latency", labels=("operation",)
+)
+_DB_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+def instrument_engine(engine):
+    # Statement timings from SQLAlchemy's cursor events, which also run for the async engine
+    if not METRICS_ENABLED and not TRACING_ENABLED:
+        return
+    from sqlalchemy import event
+    
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+    
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        duration = time.perf_counter() - started
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        operation = operation if operation in _DB_OPERATIONS else "OTHER"
+        _db_query_seconds.labels(operation=operation).observe(duration)
+        record_span("db.query", started, duration, operation=operation, rows=max(cursor.rowcount, 0))
+    
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def failed(context):
+        stack = context.connection.info.get("query_started") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+_http_seconds = registry.histogram(
+    "http_request_seconds", description="HTTP request latency by route", labels=("method", "route")
+)
+_http_requests = registry.counter(
+    "http_requests_total", description="HTTP responses by route and status class", labels=("method", "route", "status")
+)
+
+class RequestInstrumentation:
+    # Plain ASGI middleware: one root span and one latency sample per HTTP request, labelled by
+    # the route template rather than the raw path so label values stay bounded
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = {"code": 500}
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+        
+        started = time.perf_counter()
+        with span("http", method=scope["method"]) as root:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                root.set(route=route, status=status["code"])
+                if isinstance(root, Span):
+                    root.name = f"{scope['method']} {route}"
+                _http_seconds.labels(method=scope["method"], route=route).observe(time.perf_counter() - started)
+                _http_requests.labels(method=scope["method"], route=route, status=f"{status['code'] // 100}xx").inc()
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, AsyncIterator, BinaryIO, Optional
+from src.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", "1048576"))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", "2147483648"))
+UPLOAD_SESSION_QUOTA_BYTES = int(os.getenv("UPLOAD_SESSION_QUOTA_BYTES", "10737418240"))
+UPLOAD_PARTIAL_TTL = float(os.getenv("UPLOAD_PARTIAL_TTL", "86400"))
+# Direct uploads of unknown size reserve quota in steps of this many bytes
+UPLOAD_RESERVE_STEP = int(os.getenv("UPLOAD_RESERVE_STEP", "67108864"))
+
+PARTIAL_DIR = ".partial"
+
+class UploadError(Exception):
+    # status is one of invalid, not_found, conflict, too_large, checksum_mismatch
+    def __init__(self, message: str, status: str, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+    
+    def to_result(self) -> Dict[str, Any]:
+        return {"error": str(self), "status": self.status, **self.details}
+
+def safe_filename(filename: Optional[str]) -> str:
+    name = Path(filename or "").name
+    if not name or name in (".", "..") or name.startswith(".") or name != filename:
+        raise UploadError(f"Invalid filename {filename!r}", "invalid")
+    return name
+
+class UploadStore:
+    # Writes uploads to uploads/{session_id}/ in fixed-size chunks. Direct uploads and
+    # resumable chunked uploads both land in a .partial file that is renamed into place once
+    # complete, so readers never see a half-written file. Quotas count finished files plus the
+    # declared size of every pending chunked upload.
+    def __init__(
+        self,
+        base_dir: Path = UPLOAD_DIR,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        max_file_bytes: int = UPLOAD_MAX_FILE_BYTES,
+        session_quota_bytes: int = UPLOAD_SESSION_QUOTA_BYTES,
+        reserve_step: int = UPLOAD_RESERVE_STEP
+    ):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(exist_ok=True)
+        self.chunk_size = chunk_size
+        self.max_file_bytes = max_file_bytes
+        self.session_quota_bytes = session_quota_bytes
+        self.reserve_step = max(reserve_step, chunk_size)
+        self._quota_lock = threading.Lock()
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+        # Running checksums of chunked uploads: upload_id -> (bytes hashed, hasher)
+        self._hashers: Dict[str, tuple] = {}
+        
+        self._bytes = registry.counter("upload_bytes_total")
+        self._completed = registry.counter("uploads_completed_total")
+        self._rejected = registry.counter("uploads_rejected_total")
+    
+    def session_dir(self, session_id: str) -> Path:
+        return self.base_dir / safe_filename(session_id)
+    
+    def _partial_dir(self, session_id: str) -> Path:
+        path = self.session_dir(session_id) / PARTIAL_DIR
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+    
+    def session_usage(self, session_id: str, exclude: Optional[str] = None) -> int:
+        session_dir = self.base_dir / session_id
+        if not session_dir.exists():
+            return 0
+        used = sum(f.stat().st_size for f in session_dir.iterdir() if f.is_file())
+        partial_dir = session_dir / PARTIAL_DIR
+        if partial_dir.exists():
+            for meta_path in partial_dir.glob("*.json"):
+                if meta_path.stem != exclude:
+                    try:
+                        used += json.loads(meta_path.read_text())["size"]
+                    except (OSError, ValueError, KeyError):
+                        pass
+        return used
+    
+    def _check_quota(self, session_id: str, size: int, replacing: Optional[Path] = None, exclude: Optional[str] = None):
+        if size > self.max_file_bytes:
+            self._rejected.inc()
+            raise UploadError(f"File exceeds the {self.max_file_bytes} byte limit", "too_large")
+        used = self.session_usage(session_id, exclude)
+        if replacing is not None and replacing.exists():
+            used -= replacing.stat().st_size
+        if used + size > self.session_quota_bytes:
+            self._rejected.inc()
+            raise UploadError(
+                f"Session upload quota of {self.session_quota_bytes} bytes exceeded", "too_large",
+                used=used, quota=self.session_quota_bytes
+            )
+    
+    def _finish(self, part_path: Path, target: Path, size: int, sha256: str) -> Dict[str, Any]:
+        os.replace(part_path, target)
+        self._completed.inc()
+        return {"status": "uploaded", "filename": target.name, "path": str(target), "size": size, "sha256": sha256}
+    
+    def _reserve(self, session_id: str, filename: str, upload_id: str, target: Path, needed: int, wanted: int) -> int:
+        # Records up to wanted (at least needed) bytes against the quota the way a chunked
+        # upload's declared size is, and returns the amount reserved
+        if needed > self.max_file_bytes:
+            self._rejected.inc()
+            raise UploadError(f"File exceeds the {self.max_file_bytes} byte limit", "too_large")
+        with self._quota_lock:
+            used = self.session_usage(session_id, exclude=upload_id)
+            if target.exists():
+                used -= target.stat().st_size
+            reserved = min(wanted, self.max_file_bytes, self.session_quota_bytes - used)
+            if reserved < needed:
+                self._rejected.inc()
+                raise UploadError(
+                    f"Session upload quota of {self.session_quota_bytes} bytes exceeded", "too_large",
+                    used=used, quota=self.session_quota_bytes
+                )
+            (self._partial_dir(session_id) / f"{upload_id}.json").write_text(json.dumps({
+                "filename": filename,
+                "size": reserved,
+                "created_at": time.time()
+            }))
+        return reserved
+    
+    def save_stream(self, session_id: str, filename: str, stream: BinaryIO, size: Optional[int] = None) -> Dict[str, Any]:
+        # Blocking; callers run it in a worker thread. A known size is reserved up front;
+        # otherwise the reservation grows in reserve_step increments as data arrives, so the
+        # quota is checked against the disk a handful of times rather than once per chunk.
+        filename = safe_filename(filename)
+        target = self.session_dir(session_id) / filename
+        upload_id = uuid.uuid4().hex
+        part_path = self._partial_dir(session_id) / f"{upload_id}.part"
+        meta_path = part_path.with_suffix(".json")
+        known = isinstance(size, int) and size >= 0
+        
+        hasher = hashlib.sha256()
+        received = 0
+        try:
+            reserved = self._reserve(session_id, filename, upload_id, target, size if known else 0, size if known else self.reserve_step)
+            with open(part_path, "wb") as f:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                    if received > reserved:
+                        if known:
+                            self._rejected.inc()
+                            raise UploadError("File is larger than its declared size", "too_large")
+                        reserved = self._reserve(session_id, filename, upload_id, target, received, reserved + self.reserve_step)
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    self._bytes.inc(len(chunk))
+            with self._quota_lock:
+                result = self._finish(part_path, target, received, hasher.hexdigest())
+                meta_path.unlink(missing_ok=True)
+            return result
+        finally:
+            part_path.unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+    
+    def init_upload(self, session_id: str, filename: str, size: Any, sha256: Optional[str] = None) -> Dict[str, Any]:
+        filename = safe_filename(filename)
+        if not isinstance(size, int) or size < 0:
+            raise UploadError("size must be a non-negative integer", "invalid")
+        target = self.session_dir(session_id) / filename
+        upload_id = uuid.uuid4().hex
+        partial_dir = self._partial_dir(session_id)
+        with self._quota_lock:
+            self._check_quota(session_id, size, replacing=target)
+            (partial_dir / f"{upload_id}.part").touch()
+            (partial_dir / f"{upload_id}.json").write_text(json.dumps({
+                "filename": filename,
+                "size": size,
+                "sha256": sha256.lower() if sha256 else None,
+                "created_at": time.time()
+            }))
+        self._hashers[upload_id] = (0, hashlib.sha256())
+        return {"status": "created", "upload_id": upload_id, "chunk_size": self.chunk_size, "received": 0, "size": size}
+    
+    def _load_upload(self, session_id: str, upload_id: str) -> tuple:
+        if not upload_id or not upload_id.isalnum():
+            raise UploadError("Upload not found", "not_found")
+        partial_dir = self.base_dir / safe_filename(session_id) / PARTIAL_DIR
+        try:
+            meta = json.loads((partial_dir / f"{upload_id}.json").read_text())
+        except (OSError, ValueError):
+            raise UploadError("Upload not found", "not_found")
+        return meta, partial_dir / f"{upload_id}.part"
+    
+    def upload_status(self, session_id: str, upload_id: str) -> Dict[str, Any]:
+        meta, part_path = self._load_upload(session_id, upload_id)
+        return {
+            "status": "pending",
+            "upload_id": upload_id,
+            "filename": meta["filename"],
+            "size": meta["size"],
+            "received": part_path.stat().st_size,
+            "chunk_size": self.chunk_size
+        }
+    
+    async def write_chunk(self, session_id: str, upload_id: str, offset: Any, body: AsyncIterator[bytes]) -> Dict[str, Any]:
+        # Appends the request body at offset, which must equal the bytes received so far; a
+        # client resumes after a failure by asking for the status and sending from "received"
+        meta, part_path = await asyncio.to_thread(self._load_upload, session_id, upload_id)
+        lock = self._upload_locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            f = await asyncio.to_thread(open, part_path, "ab")
+            try:
+                received = f.tell()
+                if offset != received:
+                    raise UploadError("Offset does not match the bytes received", "conflict", received=received)
+                
+                hashed, hasher = self._hashers.get(upload_id, (None, None))
+                if hashed != received:
+                    # Picked up after a restart or by another process; rehashed on completion
+                    hasher = None
+                
+                buffered = []
+                buffered_size = 0
+                async for piece in body:
+                    if received + buffered_size + len(piece) > meta["size"]:
+                        self._rejected.inc()
+                        raise UploadError("Chunk runs past the declared size", "too_large", received=received)
+                    buffered.append(piece)
+                    buffered_size += len(piece)
+                    if buffered_size >= self.chunk_size:
+                        received = await self._append(f, upload_id, hasher, received, buffered)
+                        buffered, buffered_size = [], 0
+                if buffered:
+                    received = await self._append(f, upload_id, hasher, received, buffered)
+            finally:
+                await asyncio.to_thread(f.close)
+        return {"status": "pending", "upload_id": upload_id, "received": received, "size": meta["size"]}
+    
+    async def _append(self, f, upload_id: str, hasher, received: int, pieces: list) -> int:
+        chunk = b"".join(pieces)
+        await asyncio.to_thread(f.write, chunk)
+        received += len(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+            self._hashers[upload_id] = (received, hasher)
+        self._bytes.inc(len(chunk))
+        return received
+    
+    def complete_upload(self, session_id: str, upload_id: str) -> Dict[str, Any]:
+        meta, part_path = self._load_upload(session_id, upload_id)
+        size = part_path.stat().st_size
+        if size != meta["size"]:
+            raise UploadError("Upload is incomplete", "conflict", received=size, size=meta["size"])
+        
+        hashed, hasher = self._hashers.pop(upload_id, (None, None))
+        if hashed != size:
+            hasher = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                while chunk := f.read(self.chunk_size):
+                    hasher.update(chunk)
+        sha256 = hasher.hexdigest()
+        if meta.get("sha256") and meta["sha256"] != sha256:
+            self.abort_upload(session_id, upload_id)
+            raise UploadError("Checksum does not match", "checksum_mismatch", sha256=sha256)
+        
+        target = self.session_dir(session_id) / meta["filename"]
+        with self._quota_lock:
+            result = self._finish(part_path, target, size, sha256)
+            (part_path.parent / f"{upload_id}.json").unlink(missing_ok=True)
+        self._upload_locks.pop(upload_id, None)
+        return result
+    
+    def abort_upload(self, session_id: str, upload_id: str) -> Dict[str, Any]:
+        _, part_path = self._load_upload(session_id, upload_id)
+        part_path.unlink(missing_ok=True)
+        (part_path.parent / f"{upload_id}.json").unlink(missing_ok=True)
+        self._hashers.pop(upload_id, None)
+        self._upload_locks.pop(upload_id, None)
+        return {"status": "aborted", "upload_id": upload_id}
+    
+    def purge_stale(self, max_age: float = UPLOAD_PARTIAL_TTL) -> int:
+        # Drops chunked uploads that have not been written to for max_age seconds
+        cutoff = time.time() - max_age
+        removed = 0
+        for partial_dir in self.base_dir.glob(f"*/{PARTIAL_DIR}"):
+            # Includes the temporary files of direct uploads interrupted by a crash
+            for path in list(partial_dir.iterdir()):
+                part_path, meta_path = path.with_suffix(".part"), path.with_suffix(".json")
+                if path != part_path and path != meta_path:
+                    continue
+                try:
+                    last_write = max(p.stat().st_mtime for p in (part_path, meta_path) if p.exists())
+                except ValueError:
+                    continue
+                if last_write < cutoff:
+                    part_path.unlink(missing_ok=True)
+                    meta_path.unlink(missing_ok=True)
+                    self._hashers.pop(path.stem, None)
+                    self._upload_locks.pop(path.stem, None)
+                    removed += 1
+        return removed
+
+upload_store = UploadStore()
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+# Settings are read at import time, so the environment is prepared before any backend module loads
+WORKDIR = tempfile.mkdtemp(prefix="notebook-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    "UPLOAD_DIR": os.path.join(WORKDIR, "uploads"),
+    "BLOB_DIR": os.path.join(WORKDIR, "blobs"),
+    "OUTPUT_SPILL_DIR": os.path.join(WORKDIR, "outputs"),
+    "RETENTION_ARCHIVE_DIR": os.path.join(WORKDIR, "archive"),
+    "RETENTION_ENABLED": "false",
+    "KERNEL_POOL_SIZE": "0",
+    "REDIS_URL": ""
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def session_id(client):
+    response = client.post("/api/session", json={"action": "create_session", "data": {}})
+    return response.json()["session_id"]
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import select
+from src.models.database import AsyncSessionLocal, Execution
+
+@pytest.fixture
+def broken_kernels(client, monkeypatch):
+    import main
+    async def acquire(session_id):
+        raise RuntimeError("no kernel available")
+    monkeypatch.setattr(main.supervisor.execution_agent.kernel_pool, "acquire", acquire)
+
+def post(client, session_id, action, **data):
+    return client.post(f"/api/notebook/{session_id}", json={"action": action, "data": {"session_id": session_id, **data}}).json()
+
+def execution_statuses(client, ids):
+    async def query():
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(Execution.id, Execution.status, Execution.ended_at).filter(Execution.id.in_(ids)))).all()
+        return {row.id: (row.status, row.ended_at is not None) for row in rows}
+    return client.portal.call(query)
+
+def test_run_cell_records_kernel_failure(client, session_id, broken_kernels):
+    cell_id = post(client, session_id, "create_cell", source="x = 1")["cell_id"]
+    result = post(client, session_id, "run_cell", cell_id=cell_id, code="x = 1")
+    assert result["status"] == "error"
+    assert "no kernel available" in result["error"]
+    assert execution_statuses(client, [result["execution_id"]]) == {result["execution_id"]: ("error", True)}
+
+def test_run_all_records_kernel_failure(client, session_id, broken_kernels):
+    post(client, session_id, "create_cell", source="y = 2")
+    result = post(client, session_id, "run_all")
+    assert result["status"] == "error"
+    statuses = [cell["status"] for cell in result["results"]]
+    assert len(statuses) == 2 and statuses == ["error", "aborted"]
+    assert all("no kernel available" in cell["error"] for cell in result["results"])
+    
+    ids = [cell["execution_id"] for cell in result["results"]]
+    recorded = execution_statuses(client, ids)
+    # Nothing is left "running"
+    assert recorded == {ids[0]: ("error", True), ids[1]: ("aborted", True)}
+
+def test_run_reactive_reports_kernel_failure(client, session_id, broken_kernels):
+    result = post(client, session_id, "run_reactive")
+    assert result == {"error": "Execution failed: no kernel available", "status": "error"}
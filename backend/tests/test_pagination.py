@@ -0,0 +1,35 @@
+import json
+import base64
+from datetime import datetime
+import pytest
+from src.models.database import Notebook, Execution
+from src.services.pagination import encode_cursor, decode_cursor
+
+def raw_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+def test_cursor_round_trip():
+    values = [datetime(2026, 1, 2, 3, 4, 5), 42]
+    assert decode_cursor(encode_cursor(values), [Notebook.updated_at, Notebook.id]) == values
+
+@pytest.mark.parametrize("cursor, keys", [
+    ("not base64!", [Execution.id]),
+    (raw_cursor({"id": 1}), [Execution.id]),
+    (raw_cursor([1, 2]), [Execution.id]),
+    (raw_cursor(["1"]), [Execution.id]),
+    (raw_cursor([True]), [Execution.id]),
+    (raw_cursor([1.5]), [Execution.id]),
+    (raw_cursor(["2026-01-01T00:00:00", 1]), [Notebook.updated_at, Notebook.id]),
+    (raw_cursor([{"$dt": "yesterday"}, 1]), [Notebook.updated_at, Notebook.id]),
+    (raw_cursor([{"$dt": 5}, 1]), [Notebook.updated_at, Notebook.id]),
+])
+def test_crafted_cursors_are_rejected(cursor, keys):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor, keys)
+
+def test_crafted_cursors_are_a_bad_request(client):
+    response = client.get("/api/notebooks", params={"cursor": raw_cursor(["x", 1])})
+    assert response.status_code == 400
+    assert response.json() == {"error": "Invalid cursor"}
+    response = client.get("/api/cells/1/executions", params={"cursor": raw_cursor(["1"])})
+    assert response.status_code == 400
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+import pytest
+import gzip
+import json
+from sqlalchemy import insert, select, update, func
+from src.models.database import AsyncSessionLocal, Session, Notebook, Cell, Execution
+from src.services.retention import RetentionJob
+from src.services.upload_store import upload_store
+
+def age(client, session_id, days, notebook=True):
+    async def run():
+        old = datetime.utcnow() - timedelta(days=days)
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Session).where(Session.id == session_id).values(started_at=old))
+            if notebook:
+                await db.execute(update(Notebook).where(Notebook.session_id == session_id).values(updated_at=old))
+            await db.commit()
+    client.portal.call(run)
+
+def exists(client, session_id) -> bool:
+    async def run():
+        async with AsyncSessionLocal() as db:
+            return await db.get(Session, session_id) is not None
+    return client.portal.call(run)
+
+@pytest.fixture
+def sessions(client):
+    return [client.post("/api/session", json={"action": "create_session", "data": {}}).json()["session_id"] for _ in range(3)]
+
+def test_purge_abandoned_sessions(client, sessions):
+    abandoned, recently_edited, active = sessions
+    age(client, abandoned, 30)
+    age(client, recently_edited, 30, notebook=False)
+    age(client, active, 30)
+    upload_store.session_dir(abandoned).mkdir(parents=True, exist_ok=True)
+    
+    released = []
+    async def is_active(session_id):
+        return session_id == active
+    async def release(session_id):
+        released.append(session_id)
+    job = RetentionJob(abandoned_session_days=7, batch_size=1, is_active=is_active, release=release)
+    client.portal.call(job._purge_sessions)
+    
+    assert not exists(client, abandoned)
+    assert exists(client, recently_edited)
+    assert exists(client, active)
+    assert abandoned in released and active not in released and recently_edited not in released
+
+def test_purge_releases_kernel_and_uploads(client, sessions):
+    import main
+    session_id = sessions[0]
+    age(client, session_id, 30)
+    session_dir = upload_store.session_dir(session_id)
+    session_dir.mkdir(parents=True, exist_ok=True)
+    (session_dir / "data.csv").write_text("a,b\n")
+    
+    job = RetentionJob(
+        abandoned_session_days=7, is_active=main.supervisor.session_active, release=main.supervisor.release_session
+    )
+    client.portal.call(job._purge_sessions)
+    assert not exists(client, session_id)
+    assert not session_dir.exists()
+
+def test_archive_keeps_latest_executions_per_cell(client, session_id, tmp_path):
+    notebook = client.get(f"/api/notebook/{session_id}").json()["notebook"]
+    cell_id = notebook["cells"][0]["id"]
+    other = client.post(f"/api/notebook/{session_id}", json={"action": "create_cell", "data": {"source": "x"}}).json()["cell_id"]
+    
+    async def seed():
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(Execution), [{"cell_id": cell_id, "status": "completed"} for _ in range(7)])
+            await db.execute(insert(Execution), [{"cell_id": other, "status": "completed"} for _ in range(2)])
+            await db.commit()
+            return (await db.scalars(select(Execution.id).filter(Execution.cell_id == cell_id).order_by(Execution.id))).all()
+    ids = client.portal.call(seed)
+    
+    archive_path = tmp_path / "executions.jsonl.gz"
+    job = RetentionJob(keep_per_cell=3, batch_size=2)
+    assert client.portal.call(job._archive_beyond_latest, archive_path) == 4
+    
+    async def remaining():
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(
+                select(Execution.cell_id, func.count()).filter(Execution.cell_id.in_([cell_id, other])).group_by(Execution.cell_id)
+            )).all()
+    assert dict(client.portal.call(remaining)) == {cell_id: 3, other: 2}
+    with gzip.open(archive_path, "rt") as f:
+        assert sorted(json.loads(line)["id"] for line in f) == ids[:4]
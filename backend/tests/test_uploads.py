@@ -0,0 +1,77 @@
+import io
+import hashlib
+import asyncio
+import pytest
+from src.services.upload_store import UploadStore, UploadError
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(tmp_path, chunk_size=1000, max_file_bytes=30000, session_quota_bytes=50000, reserve_step=4000)
+
+async def body(*pieces):
+    for piece in pieces:
+        yield piece
+
+def test_direct_upload_counts_against_quota(store):
+    data = b"a" * 20000
+    result = store.save_stream("s1", "a.bin", io.BytesIO(data), len(data))
+    assert result["size"] == 20000 and result["sha256"] == hashlib.sha256(data).hexdigest()
+    store.save_stream("s1", "b.bin", io.BytesIO(b"b" * 20000))
+    with pytest.raises(UploadError) as error:
+        store.save_stream("s1", "c.bin", io.BytesIO(b"c" * 20000))
+    assert error.value.status == "too_large"
+    # Replacing a file only needs room for the difference
+    store.save_stream("s1", "b.bin", io.BytesIO(b"b" * 25000))
+    assert store.session_usage("s1") == 45000
+    assert not list((store.session_dir("s1") / ".partial").iterdir())
+
+def test_direct_upload_rejects_data_past_declared_size(store):
+    with pytest.raises(UploadError) as error:
+        store.save_stream("s1", "a.bin", io.BytesIO(b"a" * 5000), 100)
+    assert error.value.status == "too_large"
+    assert not (store.session_dir("s1") / "a.bin").exists()
+
+def test_pending_chunked_uploads_reserve_their_declared_size(store):
+    store.init_upload("s1", "a.bin", 30000)
+    with pytest.raises(UploadError) as error:
+        store.init_upload("s1", "b.bin", 25000)
+    assert error.value.status == "too_large"
+    with pytest.raises(UploadError):
+        store.save_stream("s1", "c.bin", io.BytesIO(b"c" * 25000))
+
+def test_chunked_upload_resumes_from_received_offset(store):
+    data = bytes(range(256)) * 40
+    upload = store.init_upload("s1", "d.bin", len(data), hashlib.sha256(data).hexdigest())
+    upload_id = upload["upload_id"]
+    
+    asyncio.run(store.write_chunk("s1", upload_id, 0, body(data[:4000])))
+    with pytest.raises(UploadError) as error:
+        asyncio.run(store.write_chunk("s1", upload_id, 0, body(data[:10])))
+    assert error.value.status == "conflict" and error.value.details["received"] == 4000
+    with pytest.raises(UploadError) as error:
+        store.complete_upload("s1", upload_id)
+    assert error.value.status == "conflict"
+    
+    # A restarted server has no running checksum and rehashes the file on completion
+    store._hashers.clear()
+    received = store.upload_status("s1", upload_id)["received"]
+    with pytest.raises(UploadError) as error:
+        asyncio.run(store.write_chunk("s1", upload_id, received, body(data[received:] + b"x")))
+    assert error.value.status == "too_large"
+    received = store.upload_status("s1", upload_id)["received"]
+    asyncio.run(store.write_chunk("s1", upload_id, received, body(data[received:])))
+    result = store.complete_upload("s1", upload_id)
+    assert result["sha256"] == hashlib.sha256(data).hexdigest()
+    assert (store.session_dir("s1") / "d.bin").read_bytes() == data
+
+def test_chunked_upload_checksum_mismatch_is_discarded(store):
+    upload_id = store.init_upload("s1", "e.bin", 5, "00" * 32)["upload_id"]
+    asyncio.run(store.write_chunk("s1", upload_id, 0, body(b"hello")))
+    with pytest.raises(UploadError) as error:
+        store.complete_upload("s1", upload_id)
+    assert error.value.status == "checksum_mismatch"
+    assert error.value.details["sha256"] == hashlib.sha256(b"hello").hexdigest()
+    with pytest.raises(UploadError) as error:
+        store.upload_status("s1", upload_id)
+    assert error.value.status == "not_found"
+    assert store.session_usage("s1") == 0
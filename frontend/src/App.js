@@ -1,9 +1,23 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import NotebookCell from './components/NotebookCell';
-import { createSession, loadNotebook, saveNotebook, createCell, listNotebooks, uploadFile, listFiles, cleanupSession } from './api';
+import { isRichOutput, mergeDisplays } from './components/RichOutput';
+import { createSession, loadNotebook, saveNotebook, createCell, listNotebooks, uploadFile, listFiles, importNotebook, cleanupSession, getChanges, patchCell } from './api';
 import { connectWebSocket } from './websocket';
 import './App.css';
 
+// Source edits are sent this long after the last keystroke
+const CELL_SYNC_DELAY = 500;
+
+// The single replacement that turns `from` into `to`; offsets are UTF-16 code units, as the
+// server expects
+const diffSource = (from, to) => {
+  let start = 0;
+  while (start < from.length && start < to.length && from[start] === to[start]) start++;
+  let end = 0;
+  while (end < from.length - start && end < to.length - start && from[from.length - 1 - end] === to[to.length - 1 - end]) end++;
+  return { start, end: from.length - end, text: to.slice(start, to.length - end) };
+};
+
 function App() {
   const [sessionId, setSessionId] = useState(null);
   const [notebook, setNotebook] = useState({ title: 'Untitled Notebook' });
@@ -14,6 +28,13 @@ function App() {
   const [showNotebookList, setShowNotebookList] = useState(false);
   const [notebooks, setNotebooks] = useState([]);
   const [uploadedFiles, setUploadedFiles] = useState([]);
+  // Cell id -> { source, revision } last confirmed by the server, plus the pending sync timer
+  const syncState = useRef({});
+  // Read by callbacks registered once per session, which would otherwise see stale state
+  const cellsRef = useRef(cells);
+  cellsRef.current = cells;
+  const notebookRef = useRef(notebook);
+  notebookRef.current = notebook;
 
   useEffect(() => {
     initializeSession();
@@ -26,7 +47,11 @@ function App() {
       loadNotebookData();
       loadFiles();
     }
+    // Pick up changes made elsewhere (another tab, an import) when the window regains focus
+    const handleFocus = () => sessionId && refreshNotebook();
+    window.addEventListener('focus', handleFocus);
     return () => {
+      window.removeEventListener('focus', handleFocus);
       if (sessionId) {
         cleanupSession(sessionId);
       }
@@ -48,18 +73,119 @@ function App() {
       if (response.notebook) {
         setNotebook(response.notebook);
         setCells(response.notebook.cells || []);
+        syncState.current = {};
+        trackCells(response.notebook.cells || []);
       }
     } catch (error) {
       console.error('Failed to load notebook:', error);
     }
   };
 
+  const trackCells = (changed) => {
+    for (const cell of changed) {
+      syncState.current[cell.id] = { ...syncState.current[cell.id], source: cell.source || '', revision: cell.revision };
+    }
+  };
+
+  const hasLocalEdits = (cell) => {
+    const sync = syncState.current[cell.id];
+    return Boolean(sync && (sync.timer || sync.inFlight || cell.source !== sync.source));
+  };
+
+  // Applies only what changed since the revision already shown; cells with unsent edits keep
+  // their local source
+  const refreshNotebook = async () => {
+    const { revision } = notebookRef.current;
+    if (revision === undefined) {
+      await loadNotebookData();
+      return;
+    }
+    try {
+      const changes = await getChanges(sessionId, revision);
+      const deleted = new Set(changes.deleted);
+      const changed = new Map(changes.cells.map(cell => [cell.id, cell]));
+      setCells(prev => {
+        const kept = prev
+          .filter(cell => !deleted.has(cell.id))
+          .map(cell => changed.has(cell.id)
+            ? { ...cell, ...changed.get(cell.id), source: hasLocalEdits(cell) ? cell.source : changed.get(cell.id).source }
+            : cell);
+        const added = changes.cells.filter(cell => !prev.some(existing => existing.id === cell.id));
+        return [...kept, ...added].sort((a, b) => a.order_index - b.order_index);
+      });
+      setNotebook(prev => ({ ...prev, title: changes.title, revision: changes.revision }));
+      for (const cellId of deleted) {
+        clearTimeout(syncState.current[cellId]?.timer);
+        delete syncState.current[cellId];
+      }
+      trackCells(changes.cells.filter(cell => !cellsRef.current.some(existing => existing.id === cell.id && hasLocalEdits(existing))));
+    } catch (error) {
+      console.error('Failed to refresh notebook:', error);
+    }
+  };
+
+  // Sends one cell's edits as a patch against the revision it was last synced at; edits made
+  // while a patch is in flight follow in the next one
+  const syncCellSource = async (cellId) => {
+    const sync = syncState.current[cellId];
+    if (!sync) return;
+    sync.timer = null;
+    if (sync.inFlight) return;
+    const cell = cellsRef.current.find(c => c.id === cellId);
+    if (!cell || cell.source === sync.source) return;
+    const source = cell.source;
+    sync.inFlight = true;
+    try {
+      const response = await patchCell(sessionId, cellId, sync.revision, [diffSource(sync.source, source)]);
+      sync.source = source;
+      sync.revision = response.revision;
+    } catch (error) {
+      const conflict = error.response?.data;
+      if (conflict?.status !== 'conflict') {
+        console.error('Failed to save cell:', error);
+        sync.inFlight = false;
+        return;
+      }
+      // Changed on the server: the next patch rebases the local text onto its version
+      sync.source = conflict.cell.source || '';
+      sync.revision = conflict.cell.revision;
+    }
+    sync.inFlight = false;
+    syncCellSource(cellId);
+  };
+
+  const outputText = (output) => {
+    if (output.output_type === 'stream') return output.text;
+    if (output.output_type === 'error') return output.traceback.join('\n');
+    return output.data?.['text/plain'] || '';
+  };
+
   const handleWebSocketMessage = (message) => {
-    if (message.type === 'execution_result') {
-      const { cell_id, output, error } = message.data;
+    if (message.type === 'execution_output') {
+      const chunks = {};
+      const displays = {};
+      for (const output of message.data.outputs) {
+        if (isRichOutput(output)) {
+          displays[output.cell_id] = [...(displays[output.cell_id] || []), output];
+        } else {
+          chunks[output.cell_id] = (chunks[output.cell_id] || '') + outputText(output);
+        }
+      }
+      setCells(prev => prev.map(cell =>
+        cell.id in chunks || cell.id in displays
+          ? {
+              ...cell,
+              output: (cell.streaming ? cell.output : '') + (chunks[cell.id] || ''),
+              outputs: mergeDisplays(cell.streaming ? cell.outputs || [] : [], displays[cell.id] || []),
+              streaming: true
+            }
+          : cell
+      ));
+    } else if (message.type === 'execution_result') {
+      const { cell_id, output, error, outputs } = message.data;
       setCells(prev => prev.map(cell => 
         cell.id === cell_id 
-          ? { ...cell, output: output + error }
+          ? { ...cell, output: output + error, outputs: outputs || [], streaming: false }
           : cell
       ));
     }
@@ -80,8 +206,10 @@ function App() {
         cell_type: 'code',
         source: '',
         output: '',
-        order_index: cells.length
+        order_index: cells.length,
+        revision: response.revision
       };
+      trackCells([newCell]);
       setCells([...cells, newCell]);
     } catch (error) {
       console.error('Failed to create cell:', error);
@@ -97,6 +225,11 @@ function App() {
     setCells(prev => prev.map(cell => 
       cell.id === cellId ? { ...cell, ...updates } : cell
     ));
+    const sync = syncState.current[cellId];
+    if ('source' in updates && sync) {
+      clearTimeout(sync.timer);
+      sync.timer = setTimeout(() => syncCellSource(cellId), CELL_SYNC_DELAY);
+    }
   };
 
   const deleteCell = (cellId) => {
@@ -137,17 +270,9 @@ function App() {
     try {
       const result = await uploadFile(sessionId, file);
       await loadFiles();
-      if (result.notebook_cells && file.name.endsWith('.ipynb')) {
-        const newCells = [];
-        for (const cell of result.notebook_cells) {
-          const response = await createCell(sessionId, cell);
-          newCells.push({
-            ...cell,
-            id: response.cell_id,
-            output: ''
-          });
-        }
-        setCells(newCells);
+      if (result.is_notebook) {
+        await importNotebook(sessionId, result.filename);
+        await refreshNotebook();
       }
     } catch (error) {
       console.error('Failed to upload file:', error);
@@ -168,20 +293,8 @@ function App() {
   const handleFileClick = async (file) => {
     if (file.is_notebook) {
       try {
-        const blob = await fetch(`http://localhost:8000/uploads/${sessionId}/${file.name}`).then(r => r.blob());
-        const result = await uploadFile(sessionId, new File([blob], file.name));
-        if (result.notebook_cells) {
-          const newCells = [];
-          for (const cell of result.notebook_cells) {
-            const response = await createCell(sessionId, cell);
-            newCells.push({
-              ...cell,
-              id: response.cell_id,
-              output: ''
-            });
-          }
-          setCells(newCells);
-        }
+        await importNotebook(sessionId, file.name);
+        await refreshNotebook();
       } catch (error) {
         console.error('Failed to load notebook:', error);
       }
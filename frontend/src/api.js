@@ -9,6 +9,9 @@ const api = axios.create({
   },
 });
 
+// Large rich outputs are stored once by content hash and referenced from the cell
+export const blobUrl = (hash, mime) => `${API_BASE_URL}/blobs/${hash}?type=${encodeURIComponent(mime)}`;
+
 export const createSession = async (data) => {
   const response = await api.post('/session', {
     action: 'create_session',
@@ -38,6 +41,24 @@ export const runCell = async (sessionId, data) => {
   return response.data;
 };
 
+export const cancelExecution = async (sessionId, data = {}) => {
+  const response = await api.post(`/notebook/${sessionId}/cancel`, data);
+  return response.data;
+};
+
+export const getChanges = async (sessionId, since) => {
+  const response = await api.get(`/notebook/${sessionId}/changes`, { params: { since } });
+  return response.data;
+};
+
+export const patchCell = async (sessionId, cellId, baseRevision, ops) => {
+  const response = await api.patch(`/notebook/${sessionId}/cells/${cellId}`, {
+    base_revision: baseRevision,
+    ops
+  });
+  return response.data;
+};
+
 export const createCell = async (sessionId, data) => {
   const response = await api.post(`/notebook/${sessionId}`, {
     action: 'create_cell',
@@ -67,7 +88,42 @@ export const listNotebooks = async () => {
   return response.data;
 };
 
+// Files above this size go through the resumable chunked upload endpoints
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 3;
+
+const uploadFileChunked = async (sessionId, file) => {
+  const { data: upload } = await api.post(`/upload/${sessionId}/chunked`, {
+    filename: file.name,
+    size: file.size
+  });
+  const uploadUrl = `/upload/${sessionId}/chunked/${upload.upload_id}`;
+  let received = upload.received;
+  let failures = 0;
+  while (received < file.size) {
+    const chunk = file.slice(received, received + upload.chunk_size);
+    try {
+      const response = await api.put(uploadUrl, chunk, {
+        params: { offset: received },
+        headers: { 'Content-Type': 'application/octet-stream' }
+      });
+      received = response.data.received;
+      failures = 0;
+    } catch (error) {
+      if (++failures > MAX_CHUNK_RETRIES) throw error;
+      // Resume from whatever the server actually stored
+      const status = await api.get(uploadUrl);
+      received = status.data.received;
+    }
+  }
+  const response = await api.post(`${uploadUrl}/complete`);
+  return response.data;
+};
+
 export const uploadFile = async (sessionId, file) => {
+  if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+    return uploadFileChunked(sessionId, file);
+  }
   const formData = new FormData();
   formData.append('file', file);
   const response = await axios.post(`http://localhost:8000/api/upload/${sessionId}`, formData, {
@@ -76,6 +132,11 @@ export const uploadFile = async (sessionId, file) => {
   return response.data;
 };
 
+export const importNotebook = async (sessionId, filename) => {
+  const response = await api.post(`/notebook/${sessionId}/import`, { filename });
+  return response.data;
+};
+
 export const listFiles = async (sessionId) => {
   const response = await api.get(`/files/${sessionId}`);
   return response.data;
@@ -1,6 +1,7 @@
 import React, { useState, useRef } from 'react';
 import Editor from '@monaco-editor/react';
-import { runCell } from '../api';
+import { runCell, cancelExecution } from '../api';
+import RichOutput from './RichOutput';
 
 const NotebookCell = ({ cell, sessionId, onUpdate, onDelete, index, onAddCell }) => {
   const [isRunning, setIsRunning] = useState(false);
@@ -49,7 +50,7 @@ const NotebookCell = ({ cell, sessionId, onUpdate, onDelete, index, onAddCell })
       console.log('Response:', response);
       
       const outputText = (response.output || '') + (response.error || '');
-      onUpdate(cell.id, { output: outputText });
+      onUpdate(cell.id, { output: outputText, outputs: response.outputs || [] });
       setUserInput('');
     } catch (error) {
       console.error('Failed to run cell:', error);
@@ -59,6 +60,15 @@ const NotebookCell = ({ cell, sessionId, onUpdate, onDelete, index, onAddCell })
     }
   };
   
+  const handleStopCell = async () => {
+    // Drops the run if it is still queued, interrupts the kernel if it has started
+    try {
+      await cancelExecution(sessionId, { cell_id: cell.id });
+    } catch (error) {
+      console.error('Failed to stop cell:', error);
+    }
+  };
+  
   console.log('Cell output:', cell.output);
 
   return (
@@ -73,14 +83,13 @@ const NotebookCell = ({ cell, sessionId, onUpdate, onDelete, index, onAddCell })
         {/* Left sidebar with play button */}
         <div className="flex flex-col items-center pt-3 pr-2">
           <button
-            onClick={handleRunCell}
-            disabled={isRunning}
+            onClick={isRunning ? handleStopCell : handleRunCell}
             className={`w-10 h-10 rounded-full flex items-center justify-center transition-all ${
               isRunning 
-                ? 'bg-gray-300 cursor-not-allowed' 
+                ? 'bg-gray-300 hover:bg-gray-400' 
                 : 'bg-white border-2 border-gray-300 hover:border-gray-900 hover:bg-gray-50'
             }`}
-            title="Run cell (Ctrl+Enter)"
+            title={isRunning ? 'Stop cell' : 'Run cell (Ctrl+Enter)'}
           >
             {isRunning ? (
               <svg className="animate-spin h-5 w-5 text-gray-600" xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24">
@@ -189,6 +198,14 @@ const NotebookCell = ({ cell, sessionId, onUpdate, onDelete, index, onAddCell })
               </pre>
             </div>
           )}
+
+          {cell.outputs && cell.outputs.length > 0 && (
+            <div className="mt-2 border border-gray-300 rounded-lg bg-white p-4 space-y-2">
+              {cell.outputs.map((output, i) => (
+                <RichOutput key={output.display_id || i} output={output} />
+              ))}
+            </div>
+          )}
         </div>
       </div>
 
@@ -0,0 +1,66 @@
+import React from 'react';
+import { blobUrl } from '../api';
+
+// Richest representation first; text/plain is the fallback every bundle carries
+const MIME_ORDER = ['text/html', 'image/svg+xml', 'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'text/markdown', 'text/plain'];
+
+export const isRichOutput = (output) => {
+  if (!output.data) return false;
+  if (output.output_type !== 'execute_result') return true;
+  // Plain-text results are already part of the cell's text output
+  return Object.keys({ ...output.data, ...output.blobs }).some(mime => mime !== 'text/plain');
+};
+
+export const mergeDisplays = (current, incoming) => {
+  let merged = current;
+  for (const output of incoming) {
+    if (output.output_type === 'update_display_data') {
+      merged = merged.map(previous =>
+        output.display_id && previous.display_id === output.display_id
+          ? { ...output, output_type: previous.output_type }
+          : previous
+      );
+    } else {
+      merged = [...merged, output];
+    }
+  }
+  return merged;
+};
+
+const RichOutput = ({ output }) => {
+  const blobs = output.blobs || {};
+  const data = output.data || {};
+  const mime = MIME_ORDER.find(type => type in blobs || type in data);
+  if (!mime) return null;
+  // Large payloads are fetched from the blob store, which browsers cache for good
+  const src = mime in blobs ? blobUrl(blobs[mime].hash, mime) : null;
+  const value = Array.isArray(data[mime]) ? data[mime].join('') : data[mime];
+
+  if (mime === 'text/html') {
+    // Kernel output is untrusted: HTML renders in a sandboxed frame without scripts
+    return (
+      <iframe
+        title="Cell output"
+        sandbox=""
+        src={src || undefined}
+        srcDoc={src ? undefined : value}
+        className="w-full bg-white border-0"
+        style={{ height: '300px', resize: 'vertical', overflow: 'auto' }}
+      />
+    );
+  }
+  if (mime.startsWith('image/')) {
+    const inline = mime === 'image/svg+xml'
+      ? `data:image/svg+xml;charset=utf-8,${encodeURIComponent(value)}`
+      : `data:${mime};base64,${value}`;
+    return <img src={src || inline} alt={data['text/plain'] || 'Cell output'} className="max-w-full" />;
+  }
+  if (src) {
+    return <a href={src} target="_blank" rel="noopener noreferrer" className="text-sm text-blue-600 underline">View output ({blobs[mime].size} bytes)</a>;
+  }
+  return (
+    <pre className="text-sm text-gray-900 whitespace-pre-wrap font-mono leading-relaxed">{value}</pre>
+  );
+};
+
+export default RichOutput;